@@ -3,93 +3,255 @@
 # Imports - Importations des modules nécessaires
 # =====================================================
 from fastapi import FastAPI, Body, Query, Request, UploadFile, File, Form
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from core.query_chromadb import ask_question_stream, get_collection, get_pmids_from_contexts, is_substantial_question, client
+try:
+    from sse_starlette.sse import EventSourceResponse
+except ImportError:
+    EventSourceResponse = None
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+from core.query_chromadb import ask_question_stream_async, get_collection, get_pmids_batch, clear_pmids_cache, is_substantial_question
+from core.micro_batcher import MicroBatcher
 from core.pipeline_gdrive import run_pipeline
-from core.translate import translate_text_stream, transcribe_audio_whisper, translate_audio_whisper, get_supported_languages
+from core import session_store
+from core import openai_client
+from core.translate import translate_text_stream, transcribe_audio_whisper, translate_audio_whisper_async, get_supported_languages
 from dotenv import load_dotenv
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Final, Optional, Set
+from collections import OrderedDict
+from contextlib import contextmanager
 import json
+import orjson
 import uuid
+import hashlib
+import gzip
 from datetime import datetime, timedelta
+import itertools
 import threading
+import queue
+import time
+import atexit
+import asyncio
 import re as re_tts
 import os
 
+try:
+    import fcntl  # verrous flock inter-processus (POSIX uniquement)
+except ImportError:
+    fcntl = None
 
-def _generate_tts_audio(text, language):
-    """Generate TTS audio from text. Returns audio bytes or None on error."""
+
+# Nettoyage markdown/références avant synthèse vocale, appliqué dans l'ordre
+_TTS_CLEANUP_PATTERNS = [
+    (re_tts.compile(r'\*\*(.+?)\*\*'), r'\1'),
+    (re_tts.compile(r'\*(.+?)\*'), r'\1'),
+    (re_tts.compile(r'#{1,6}\s'), ''),
+    (re_tts.compile(r'```[\s\S]*?```'), ''),
+    (re_tts.compile(r'`([^`]+)`'), r'\1'),
+    (re_tts.compile(r'\[([^\]]+)\]\([^)]+\)'), r'\1'),
+    (re_tts.compile(r'PMID:\s*\d+', re_tts.IGNORECASE), ''),
+    (re_tts.compile(r'\[\d+\]'), ''),
+    # Sections de références en fin de ligne, en une seule passe
+    (re_tts.compile(r'(?:R\u00e9f\u00e9rences?\s*PubMed|References?|Sources?)\s*:.*$', re_tts.MULTILINE | re_tts.IGNORECASE), ''),
+    (re_tts.compile(r'\n{2,}'), '. '),
+    (re_tts.compile(r'\n'), ' '),
+    (re_tts.compile(r'\s{2,}'), ' '),
+]
+
+
+async def _generate_tts_audio(text, language):
+    """
+    Generate TTS audio from text. Returns audio bytes or None on error.
+    Le nettoyage est négligeable ; l'appel réseau est attendu sur la boucle
+    d'événements (client asynchrone), sans thread dédié.
+    """
     try:
-        import openai
-        client_tts = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         clean = text
-        clean = re_tts.sub(r'\*\*(.+?)\*\*', r'\1', clean)
-        clean = re_tts.sub(r'\*(.+?)\*', r'\1', clean)
-        clean = re_tts.sub(r'#{1,6}\s', '', clean)
-        clean = re_tts.sub(r'```[\s\S]*?```', '', clean)
-        clean = re_tts.sub(r'`([^`]+)`', r'\1', clean)
-        clean = re_tts.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', clean)
-        clean = re_tts.sub(r'PMID:\s*\d+', '', clean, flags=re_tts.IGNORECASE)
-        clean = re_tts.sub(r'\[\d+\]', '', clean)
-        clean = re_tts.sub(r'R\u00e9f\u00e9rences?\s*PubMed\s*:.*$', '', clean, flags=re_tts.MULTILINE|re_tts.IGNORECASE)
-        clean = re_tts.sub(r'References?\s*:.*$', '', clean, flags=re_tts.MULTILINE|re_tts.IGNORECASE)
-        clean = re_tts.sub(r'Sources?\s*:.*$', '', clean, flags=re_tts.MULTILINE|re_tts.IGNORECASE)
-        clean = re_tts.sub(r'\n{2,}', '. ', clean)
-        clean = re_tts.sub(r'\n', ' ', clean)
-        clean = re_tts.sub(r'\s{2,}', ' ', clean)
+        for pattern, repl in _TTS_CLEANUP_PATTERNS:
+            clean = pattern.sub(repl, clean)
         clean = clean.strip()[:4096]
         if not clean:
             return None
         voice = "nova" if language in ["fr", "es", "it", "pt", "ro"] else "alloy"
-        tts_resp = client_tts.audio.speech.create(
+        tts_resp = await tts_async_client.audio.speech.create(
             model="tts-1", voice=voice, input=clean, response_format="mp3"
         )
-        audio_bytes = b""
-        for audio_chunk in tts_resp.iter_bytes(4096):
-            audio_bytes += audio_chunk
-        return audio_bytes
+        return tts_resp.content
     except Exception as e:
         print(f"TTS generation error: {e}")
         return None
 
 
-def _tts_thread_worker(session, question_id, text, language):
-    """Background worker that generates TTS and stores result in session."""
-    audio_bytes = _generate_tts_audio(text, language)
-    if audio_bytes:
-        session.setdefault('tts_audio', {})[question_id] = audio_bytes
-    else:
-        session.setdefault('tts_audio', {})[question_id] = b''  # Empty = failed
+async def _tts_background_task(session_id, session, question_id, text, language):
+    """
+    Background task that generates TTS and stores the result in Redis (served
+    by any worker) or, without session store, in the local session.
+    """
+    async with _tts_semaphore:
+        audio_bytes = await _generate_tts_audio(text, language)
+    if await session_store.save_tts_audio(session_id, question_id, audio_bytes or b'', TTS_AUDIO_TTL):
+        return
+    tts_store = session.setdefault('tts_audio', {})
+    tts_store[question_id] = audio_bytes or b''  # Empty = failed
+    # Keep only the most recent audios (never fetched ones would otherwise pile up)
+    while len(tts_store) > TTS_AUDIO_MAX_ENTRIES:
+        tts_store.pop(next(iter(tts_store)), None)
 
  # Chargement des variables d'environnement depuis le bon emplacement
 # =====================================================
 # Configuration & Constantes
 # =====================================================
-PROJECT_ROOT = Path(__file__).parent
+PROJECT_ROOT: Final[Path] = Path(__file__).parent
 env_path = PROJECT_ROOT / '.env'
+STATIC_DIR: Final[Path] = PROJECT_ROOT / "static"
+TEMPLATES_DIR: Final[Path] = PROJECT_ROOT / "templates"
+CONFIG_PATH: Final[Path] = PROJECT_ROOT / "config" / "config.json"
 load_dotenv(dotenv_path=env_path)
 
+# Clients OpenAI partagés pour la synthèse vocale (même pool HTTP/2 que query_chromadb et translate)
+tts_client = openai_client.client
+# Client asynchrone pour la synthèse en arrière-plan de /query
+tts_async_client = openai_client.aclient
+_tts_tasks = set()  # références fortes vers les tâches TTS en cours
+TTS_MAX_CONCURRENCY = 8  # synthèses simultanées ; les suivantes attendent leur tour
+_tts_semaphore = asyncio.Semaphore(TTS_MAX_CONCURRENCY)
+
 app = FastAPI(title="Dok2u Multi Agent")
 
 # Mount static files and templates with absolute paths
-app.mount("/static", StaticFiles(directory=str(PROJECT_ROOT / "static")), name="static")
-templates = Jinja2Templates(directory=str(PROJECT_ROOT / "templates"))
+app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 
-conversation_sessions: Dict[str, Dict] = {}
+# Sessions ordonnées par dernière activité (la plus ancienne en tête)
+conversation_sessions: "OrderedDict[str, Dict]" = OrderedDict()
+# Protège la structure de conversation_sessions (boucle d'événements + endpoints
+# synchrones du pool de threads) ; sections critiques courtes, sans I/O
+_sessions_lock = threading.Lock()
 SESSION_TIMEOUT = timedelta(hours=2)
+SESSION_CLEANUP_INTERVAL = timedelta(seconds=30)
+_last_session_cleanup = datetime.min
+# session_id -> nombre de réponses /query en cours dans ce processus
+_streaming_sessions: Dict[str, int] = {}
+SSE_PING_INTERVAL = 15  # secondes entre deux keep-alive SSE
+# En-têtes des réponses SSE (désactive la mise en cache et le buffering des proxys)
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Connection": "keep-alive",
+}
+TTS_AUDIO_MAX_ENTRIES = 8  # audios TTS conservés par session
+TTS_AUDIO_TTL = timedelta(minutes=10)  # durée de conservation d'un audio TTS dans Redis
+SSE_COALESCE_MIN_CHARS = 32  # taille minimale d'un chunk SSE regroupé
+SSE_COALESCE_MAX_DELAY = 0.02  # secondes d'attente maximale avant envoi d'un chunk partiel
+
+# Les requêtes /api/pmids concurrentes (fenêtre de 20 ms) partagent un appel
+# d'embedding et une requête ChromaDB
+pmids_batcher = MicroBatcher(get_pmids_batch, window=0.02, max_batch=32)
+PMIDS_BATCH_TIMEOUT = 30.0  # secondes d'attente maximale d'un lot /api/pmids
 
+# Traductions du frontend : config.json est lu une seule fois et servi tel quel
+try:
+    _CONFIG_BYTES = CONFIG_PATH.read_bytes()
+except FileNotFoundError:
+    _CONFIG_BYTES = b'{"error": "config not found"}'
+_CONFIG_ETAG = '"' + hashlib.md5(_CONFIG_BYTES).hexdigest() + '"'
 
-QUESTION_LOG_PATH = PROJECT_ROOT / "question_log.json"
-question_log_lock = threading.Lock()
+
+# Journal append-only (JSON Lines) : une ligne par question, plus des lignes "patch"
+# pour les commentaires et votes, repliées à la lecture par fold_question_log() et
+# intégrées périodiquement par le thread d'écriture (_compact_question_log).
+# Dans chaque processus, seul ce thread écrit, via un descripteur O_APPEND ; entre
+# processus (plusieurs workers uvicorn), les ajouts prennent un flock partagé sur
+# QUESTION_LOG_LOCK_PATH et seule la compaction le prend en exclusif. Les lecteurs
+# voient des lignes complètes et conservent l'ancien fichier en cas de compaction
+# (os.replace).
+QUESTION_LOG_PATH: Final[Path] = PROJECT_ROOT / "question_log.jsonl"
+QUESTION_LOG_TMP_PATH: Final[Path] = PROJECT_ROOT / "question_log.jsonl.tmp"
+QUESTION_LOG_LOCK_PATH: Final[Path] = PROJECT_ROOT / "question_log.jsonl.lock"
+LEGACY_QUESTION_LOG_PATH: Final[Path] = PROJECT_ROOT / "question_log.json"
+# Instantané gzip du journal replié, servi par /api/download_log
+LOG_SNAPSHOT_PATH: Final[Path] = PROJECT_ROOT / "question_log.json.gz"
+LOG_SNAPSHOT_TMP_PATH: Final[Path] = PROJECT_ROOT / "question_log.json.gz.tmp"
+_log_snapshot_lock = threading.Lock()
+_log_snapshot_source = None  # (inode, taille, mtime_ns) du journal à la création de l'instantané
+LOG_BATCH_SIZE = 1000
+LOG_FLUSH_INTERVAL = 0.2  # secondes
+LOG_COMPACT_THRESHOLD = 500  # nombre de patches avant réécriture compacte du journal
+_log_fd: Optional[int] = None  # descripteur O_APPEND du journal (thread d'écriture)
+_log_lock_fd: Optional[int] = None  # descripteur du fichier de verrou flock
+_log_queue = queue.SimpleQueue()
+_question_ids: Set[str] = set()  # questions connues de ce worker (journal lu + questions en file)
+_question_scan_offset = 0  # position lue dans le journal, écritures des autres workers comprises
+_question_scan_inode: Optional[int] = None
+_question_scan_lock = threading.Lock()
+_log_patch_count = 0  # patches écrits depuis la dernière compaction
+# Journal replié en mémoire, mis à jour à partir de la dernière position lue
+_folded_entries: Dict[str, Dict] = {}
+_folded_offset = 0
+_folded_inode: Optional[int] = None
+_folded_lock = threading.Lock()
 
 ######################################################
 # Fonctions utilitaires
 ######################################################
 
+def _new_id():
+    """Identifiant court (24 caractères hex) pour les question_id, moins coûteux que str(uuid.uuid4())."""
+    return os.urandom(12).hex()
+
+
+# Phrases suggérant de consulter un professionnel (réponse sans PMIDs)
+DISCLAIMER_PATTERNS_FR = (
+    'consulter un professionnel',
+    'consulte un professionnel',
+    'consultez un professionnel',
+    'consulter votre médecin',
+    'consultez votre médecin',
+    'parler à un médecin',
+    'parlez à un médecin',
+    'voir un médecin',
+    'voyez un médecin',
+    'demander conseil à un professionnel',
+    'demandez conseil à un professionnel',
+    'avis médical',
+    'consultation médicale',
+    'professionnel de santé',
+    'professionnel de la santé',
+    'nutritionniste',
+    'diététicien',
+)
+DISCLAIMER_PATTERNS_EN = (
+    'consult a professional',
+    'consult your doctor',
+    'see a doctor',
+    'talk to a doctor',
+    'speak to a doctor',
+    'seek medical advice',
+    'medical consultation',
+    'health professional',
+    'healthcare professional',
+    'nutritionist',
+    'dietitian',
+)
+
+# Automate Aho-Corasick : un seul passage sur la réponse, quel que soit le nombre de phrases.
+# Sans pyahocorasick, une alternation regex compilée (un seul passage également).
+if ahocorasick is not None:
+    _DISCLAIMER_AC = ahocorasick.Automaton()
+    for _pattern in DISCLAIMER_PATTERNS_FR + DISCLAIMER_PATTERNS_EN:
+        _DISCLAIMER_AC.add_word(_pattern, _pattern)
+    _DISCLAIMER_AC.make_automaton()
+else:
+    _DISCLAIMER_AC = None
+_DISCLAIMER_RE = re_tts.compile("|".join(map(re_tts.escape, DISCLAIMER_PATTERNS_FR + DISCLAIMER_PATTERNS_EN)))
+
+
 def contains_medical_disclaimer(response_text):
     """
     Détecte si la réponse contient des phrases suggérant de consulter un professionnel.
@@ -97,58 +259,342 @@ def contains_medical_disclaimer(response_text):
     """
     if not response_text:
         return False
-    
     response_lower = response_text.lower()
-    
-    # Patterns français
-    french_patterns = [
-        'consulter un professionnel',
-        'consulte un professionnel',
-        'consultez un professionnel',
-        'consulter votre médecin',
-        'consultez votre médecin',
-        'parler à un médecin',
-        'parlez à un médecin',
-        'voir un médecin',
-        'voyez un médecin',
-        'demander conseil à un professionnel',
-        'demandez conseil à un professionnel',
-        'avis médical',
-        'consultation médicale',
-        'professionnel de santé',
-        'professionnel de la santé',
-        'nutritionniste',
-        'diététicien',
-    ]
-    
-    # Patterns anglais
-    english_patterns = [
-        'consult a professional',
-        'consult your doctor',
-        'see a doctor',
-        'talk to a doctor',
-        'speak to a doctor',
-        'seek medical advice',
-        'medical consultation',
-        'health professional',
-        'healthcare professional',
-        'nutritionist',
-        'dietitian',
-    ]
-    
-    all_patterns = french_patterns + english_patterns
-    
-    # Vérifier si au moins un pattern est présent
-    for pattern in all_patterns:
-        if pattern in response_lower:
-            return True
-    
-    return False
+    if _DISCLAIMER_AC is not None:
+        return next(_DISCLAIMER_AC.iter(response_lower), None) is not None
+    return _DISCLAIMER_RE.search(response_lower) is not None
+
+
+def _load_question_index():
+    """
+    Construit l'ensemble des question_id du journal JSONL.
+    Migre l'ancien journal question_log.json s'il existe encore.
+    """
+    global _log_patch_count
+    if not QUESTION_LOG_PATH.exists() and LEGACY_QUESTION_LOG_PATH.exists():
+        with _log_file_lock(exclusive=True):
+            # Revérifié sous verrou : un autre worker a pu migrer entre-temps
+            if not QUESTION_LOG_PATH.exists():
+                try:
+                    with open(LEGACY_QUESTION_LOG_PATH, 'r', encoding='utf-8') as f:
+                        legacy = json.load(f)
+                    with open(QUESTION_LOG_PATH, 'ab') as f:
+                        for entry in legacy:
+                            f.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
+                except Exception as e:
+                    print(f"Error migrating legacy question log: {e}")
+    _log_patch_count += _scan_question_log()
+
+
+def _scan_question_log():
+    """
+    Ajoute à _question_ids les questions écrites dans le journal depuis la
+    dernière lecture, y compris par les autres workers (relecture complète si
+    le journal a été remplacé par une compaction). Retourne le nombre de
+    patches lus.
+    """
+    global _question_scan_offset, _question_scan_inode
+    with _question_scan_lock:
+        try:
+            f = open(QUESTION_LOG_PATH, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != _question_scan_inode or stat.st_size < _question_scan_offset:
+                _question_scan_offset = 0
+                _question_scan_inode = stat.st_ino
+            f.seek(_question_scan_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # lignes complètes uniquement
+        _question_scan_offset += end
+    patches = 0
+    for line in data[:end].splitlines():
+        try:
+            record = orjson.loads(line)
+        except ValueError:
+            continue
+        if "patch" in record:
+            patches += 1
+        elif "question_id" in record:
+            _question_ids.add(record["question_id"])
+    return patches
+
+
+@contextmanager
+def _log_file_lock(exclusive=False):
+    """
+    Verrou flock inter-processus sur le journal : partagé pour les ajouts
+    (plusieurs workers peuvent écrire en O_APPEND en même temps), exclusif
+    pour la migration et la compaction. Sans fcntl (Windows), ne fait rien.
+    """
+    global _log_lock_fd
+    if fcntl is None:
+        yield
+        return
+    if _log_lock_fd is None:
+        _log_lock_fd = os.open(QUESTION_LOG_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(_log_lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(_log_lock_fd, fcntl.LOCK_UN)
+
+
+def _open_log_fd():
+    """(Ré)ouvre le descripteur O_APPEND du journal."""
+    global _log_fd
+    if _log_fd is not None:
+        os.close(_log_fd)
+    _log_fd = os.open(QUESTION_LOG_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+
+def _log_fd_is_stale():
+    """True si le journal a été remplacé (compaction par un autre processus) depuis l'ouverture de _log_fd."""
+    try:
+        return os.stat(QUESTION_LOG_PATH).st_ino != os.fstat(_log_fd).st_ino
+    except FileNotFoundError:
+        return True
+
+
+def _write_log_batch(records):
+    """Écrit un lot d'enregistrements en un seul appel os.write() (un fsync par lot) et met à jour l'index."""
+    global _log_patch_count
+    lines = [orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in records]
+    data = memoryview(b"".join(lines))
+    with _log_file_lock():
+        if _log_fd is None or _log_fd_is_stale():
+            _open_log_fd()
+        while data:
+            data = data[os.write(_log_fd, data):]
+        os.fsync(_log_fd)
+    for record in records:
+        if "patch" in record:
+            _log_patch_count += 1
+        else:
+            _question_ids.add(record["question_id"])
+
+
+def _apply_log_lines(entries, lines):
+    """Applique des lignes du journal à `entries` (question_id -> entrée) : ajouts et patches."""
+    for line in lines:
+        try:
+            record = orjson.loads(line)
+        except ValueError:
+            continue
+        if "patch" in record:
+            target = entries.get(record["patch"])
+            if target is not None:
+                target.update({k: v for k, v in record.items() if k != "patch"})
+        elif "question_id" in record:
+            entries[record["question_id"]] = record
+    return entries
+
+
+def _fold_log_lines(lines):
+    """Replie les lignes du journal : applique chaque patch à l'entrée de sa question."""
+    return list(_apply_log_lines({}, lines).values())
+
+
+def _compact_question_log():
+    """
+    Réécrit le journal sous forme canonique (une ligne par question, patches
+    intégrés) via un fichier temporaire sous flock exclusif.
+    """
+    global _log_patch_count
+    with _log_file_lock(exclusive=True):
+        with open(QUESTION_LOG_PATH, 'rb') as f:
+            entries = _fold_log_lines(f)
+        with open(QUESTION_LOG_TMP_PATH, 'wb', buffering=1 << 20) as f:
+            for entry in entries:
+                f.write(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE))
+        os.replace(QUESTION_LOG_TMP_PATH, QUESTION_LOG_PATH)
+        _open_log_fd()
+    _question_ids.update(entry["question_id"] for entry in entries)
+    _log_patch_count = 0
+
+
+def _log_writer_worker():
+    """
+    Thread d'arrière-plan : regroupe les enregistrements en attente (jusqu'à
+    LOG_BATCH_SIZE ou LOG_FLUSH_INTERVAL secondes) et les écrit en un seul appel.
+    Les threading.Event reçus servent de barrière de vidage.
+    """
+    while True:
+        batch, barriers = [], []
+        item = _log_queue.get()
+        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        while True:
+            if isinstance(item, threading.Event):
+                barriers.append(item)
+                break
+            batch.append(item)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= LOG_BATCH_SIZE or remaining <= 0:
+                break
+            try:
+                item = _log_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                _write_log_batch(batch)
+                if _log_patch_count >= LOG_COMPACT_THRESHOLD:
+                    _compact_question_log()
+            except Exception as e:
+                print(f"Error writing question log: {e}")
+        for barrier in barriers:
+            barrier.set()
+
+
+def flush_question_log(timeout=5.0):
+    """Attend que tous les enregistrements déjà en file soient écrits sur disque."""
+    barrier = threading.Event()
+    _log_queue.put(barrier)
+    return barrier.wait(timeout)
+
+
+def fold_question_log():
+    """
+    Matérialise le journal JSONL en liste d'entrées, en appliquant les
+    enregistrements "patch" (commentaires, votes) à leur question.
+    """
+    global _folded_offset, _folded_inode
+    flush_question_log()
+    with _folded_lock:
+        if not QUESTION_LOG_PATH.exists():
+            return []
+        with open(QUESTION_LOG_PATH, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != _folded_inode or stat.st_size < _folded_offset:
+                # Journal remplacé (compaction) : relecture complète
+                _folded_entries.clear()
+                _folded_offset = 0
+                _folded_inode = stat.st_ino
+            f.seek(_folded_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # lignes complètes uniquement
+        _apply_log_lines(_folded_entries, data[:end].splitlines())
+        _folded_offset += end
+        return [dict(entry) for entry in _folded_entries.values()]
+
+
+def _question_log_signature():
+    try:
+        st = QUESTION_LOG_PATH.stat()
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def refresh_log_snapshot():
+    """
+    Régénère l'instantané gzip du journal replié dès que le journal a changé
+    (ajout, commentaire, vote ou compaction) depuis sa création.
+    """
+    global _log_snapshot_source
+    with _log_snapshot_lock:
+        source = _question_log_signature()
+        if LOG_SNAPSHOT_PATH.exists() and source == _log_snapshot_source:
+            return
+        # La signature est relevée avant le repli : un ajout concurrent
+        # provoquera au pire une régénération de plus
+        tmp_path = LOG_SNAPSHOT_TMP_PATH.with_name(f"{LOG_SNAPSHOT_TMP_PATH.name}.{os.getpid()}")
+        with gzip.open(tmp_path, 'wb', compresslevel=9) as f:
+            f.write(orjson.dumps(fold_question_log()))
+        os.replace(tmp_path, LOG_SNAPSHOT_PATH)
+        _log_snapshot_source = source
+
+
+_SENTINEL = object()
+
+async def iterate_in_thread(iterator):
+    """
+    Adapte un itérateur synchrone (bloquant) en itérateur asynchrone.
+    Chaque next() est exécuté dans le pool de threads par défaut, ce qui évite
+    à Starlette de faire un aller-retour par chunk pour un générateur synchrone.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, _SENTINEL)
+        if item is _SENTINEL:
+            break
+        yield item
+
+
+async def coalesce_chunks(chunks, min_chars=SSE_COALESCE_MIN_CHARS, max_delay=SSE_COALESCE_MAX_DELAY):
+    """
+    Regroupe les tokens d'un flux asynchrone en chunks d'au moins `min_chars`
+    caractères, sans retenir un token plus de `max_delay` secondes.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = chunks.__aiter__()
+    buffer, size, deadline = [], 0, None
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(chunks.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Délai écoulé : envoie ce qui est déjà reçu
+                yield "".join(buffer)
+                buffer, size = [], 0
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= min_chars:
+                yield "".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def _sse_frames(events):
+    """Encode chaque payload en événement SSE (`data: ...`)."""
+    async for payload in events:
+        yield b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+async def _sse_events(events):
+    """Encode chaque payload pour EventSourceResponse, qui gère le framing."""
+    async for payload in events:
+        yield {"data": orjson.dumps(payload).decode()}
+
+
+def sse_response(events):
+    """
+    Construit la réponse SSE à partir d'un itérateur asynchrone de payloads JSON.
+    Utilise EventSourceResponse (keep-alive, en-têtes anti-buffering) si
+    sse-starlette est installé, sinon un StreamingResponse équivalent.
+    """
+    if EventSourceResponse is not None:
+        # sep="\n" : le frontend découpe les messages sur "\n\n"
+        return EventSourceResponse(_sse_events(events), ping=SSE_PING_INTERVAL, sep="\n")
+    return StreamingResponse(
+        _sse_frames(events),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
 
 
 def save_question_response(question_id, question, response):
     """
     Sauvegarde une question et sa réponse dans le fichier journal.
+    L'écriture est faite par le thread d'arrière-plan ; cet appel ne bloque pas.
     """
     entry = {
         "question_id": question_id,
@@ -157,44 +603,35 @@ def save_question_response(question_id, question, response):
         "timestamp": datetime.now().isoformat(),
         "comments": []
     }
-    with question_log_lock:
-        try:
-            if QUESTION_LOG_PATH.exists():
-                with open(QUESTION_LOG_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                data = []
-        except Exception:
-            data = []
-        data.append(entry)
-        with open(QUESTION_LOG_PATH, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    _question_ids.add(question_id)
+    _log_queue.put(entry)
+
+def _patch_question(question_id, fields):
+    """Met en file un enregistrement patch pour une question existante. Retourne False si inconnue."""
+    if question_id not in _question_ids:
+        # Question peut-être enregistrée par un autre worker : lit la fin du journal
+        _scan_question_log()
+        if question_id not in _question_ids:
+            return False
+    _log_queue.put({"patch": question_id, **fields})
+    return True
 
 def add_comment_to_question(question_id, comment):
-    """Add a comment to a question by id."""
     """
     Ajoute un commentaire à une question par son identifiant.
     """
-    with question_log_lock:
-        try:
-            if QUESTION_LOG_PATH.exists():
-                with open(QUESTION_LOG_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                return False
-        except Exception:
-            return False
-        for entry in data:
-            if entry.get("question_id") == question_id:
-                # Remplace tous les commentaires par le nouveau commentaire
-                entry["comments"] = [{
-                    "comment": comment,
-                    "timestamp": datetime.now().isoformat()
-                }]
-                with open(QUESTION_LOG_PATH, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                return True
-        return False
+    # Remplace tous les commentaires par le nouveau commentaire
+    return _patch_question(question_id, {
+        "comments": [{
+            "comment": comment,
+            "timestamp": datetime.now().isoformat()
+        }]
+    })
+
+
+_load_question_index()
+threading.Thread(target=_log_writer_worker, name="question-log-writer", daemon=True).start()
+atexit.register(flush_question_log)
 
 
 ######################################################
@@ -222,15 +659,16 @@ class TranslateRequest(BaseModel):
 async def query_agent(request: QueryRequest):
     session_id = request.session_id or str(uuid.uuid4())
     _clean_old_sessions()
-    if session_id not in conversation_sessions:
-        conversation_sessions[session_id] = {
-            'messages': [],
-            'created_at': datetime.now(),
-            'last_activity': datetime.now(),
-            'pmids': {},  # question_id -> pmid list
-            'refusals': set(),  # question_ids that were refused
-        }
-    session = conversation_sessions[session_id]
+    session = await _get_session(session_id)
+    if session is None:
+        with _sessions_lock:
+            session = conversation_sessions.setdefault(session_id, {
+                'messages': [],
+                'created_at': datetime.now(),
+                'last_activity': datetime.now(),
+                'pmids': {},  # question_id -> pmid list
+                'refusals': set(),  # question_ids that were refused
+            })
     # Ensure pmids dict exists for backward compatibility
     if 'pmids' not in session:
         session['pmids'] = {}
@@ -245,13 +683,28 @@ async def query_agent(request: QueryRequest):
     }
     conversation_history.append(user_message)
     session['last_activity'] = datetime.now()
-    question_id = str(uuid.uuid4())
-    def generate():
+    with _sessions_lock:
+        conversation_sessions[session_id] = session
+        conversation_sessions.move_to_end(session_id)
+    question_id = _new_id()
+    async def generate():
+        # Pendant le streaming, _get_session ne recharge pas cette session depuis Redis
+        with _sessions_lock:
+            _streaming_sessions[session_id] = _streaming_sessions.get(session_id, 0) + 1
+        try:
+            async for payload in _generate_answer():
+                yield payload
+        finally:
+            with _sessions_lock:
+                remaining = _streaming_sessions.pop(session_id, 1) - 1
+                if remaining > 0:
+                    _streaming_sessions[session_id] = remaining
+
+    async def _generate_answer():
         # Génère la réponse de l'assistant en streaming (SSE)
-        yield f"data: {json.dumps({'session_id': session_id, 'question_id': question_id, 'chunk': ''})}\n\n"
+        yield {'session_id': session_id, 'question_id': question_id, 'chunk': ''}
         assistant_response = ""
-        is_refusal = False
-        for chunk in ask_question_stream(
+        chunks = ask_question_stream_async(
             request.question,
             language=request.language,
             timezone=request.timezone,
@@ -259,13 +712,16 @@ async def query_agent(request: QueryRequest):
             conversation_history=conversation_history,
             session=session,
             question_id=question_id
-        ):
-            # Detect refusal marker
-            if chunk == "__REFUSAL__":
-                is_refusal = True
-                continue  # Don't include marker in response
+        )
+        # The refusal marker can only be the first chunk: check it once
+        first_chunk = await anext(chunks, None)
+        is_refusal = first_chunk == "__REFUSAL__"
+        if first_chunk is not None and not is_refusal:
+            assistant_response += first_chunk
+            yield {'chunk': first_chunk}
+        async for chunk in coalesce_chunks(chunks):
             assistant_response += chunk
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+            yield {'chunk': chunk}
         
         # Save question and response to log (including refused ones)
         save_question_response(question_id, request.question, assistant_response)
@@ -277,15 +733,14 @@ async def query_agent(request: QueryRequest):
         if is_refusal or has_medical_disclaimer:
             session.setdefault('refusals', set()).add(question_id)
         
-        # Start TTS generation in background thread if requested
+        # Start TTS generation in a background task if requested
         if request.tts and assistant_response:
-            tts_thread = threading.Thread(
-                target=_tts_thread_worker,
-                args=(session, question_id, assistant_response, request.language),
-                daemon=True
+            tts_task = asyncio.create_task(
+                _tts_background_task(session_id, session, question_id, assistant_response, request.language)
             )
-            tts_thread.start()
-            yield f"data: {json.dumps({'tts_pending': question_id})}\n\n"
+            _tts_tasks.add(tts_task)
+            tts_task.add_done_callback(_tts_tasks.discard)
+            yield {'tts_pending': question_id}
         
         # Only add to history if not a refusal
         if not is_refusal:
@@ -299,31 +754,28 @@ async def query_agent(request: QueryRequest):
             # Remove the user message from history since it was refused
             conversation_history.pop()
 
-    return StreamingResponse(
-        generate(), 
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        }
-    )
+        # Persiste la session (Redis) pour les autres workers / redéploiements
+        if session_store.is_enabled():
+            await session_store.save_session(session_id, session, SESSION_TIMEOUT)
+
+    return sse_response(generate())
 
 
 @app.post("/api/tts_result")
-def get_tts_result(
+async def get_tts_result(
     session_id: str = Body(...),
     question_id: str = Body(...)
 ):
     """Return TTS audio if ready, or 202 if still generating."""
-    from fastapi.responses import Response
-    session = conversation_sessions.get(session_id)
+    session = await _get_session(session_id)
     if not session:
         return JSONResponse({"status": "not_found"}, status_code=404)
-    tts_store = session.get('tts_audio', {})
-    if question_id not in tts_store:
+    # Remove after serving (local copy if Redis was unavailable, else Redis)
+    audio_bytes = session.get('tts_audio', {}).pop(question_id, None)
+    if audio_bytes is None:
+        audio_bytes = await session_store.pop_tts_audio(session_id, question_id)
+    if audio_bytes is None:
         return JSONResponse({"status": "pending"}, status_code=202)
-    audio_bytes = tts_store.pop(question_id)  # Remove after serving
     if not audio_bytes:
         return JSONResponse({"status": "failed"}, status_code=500)
     return Response(
@@ -336,7 +788,7 @@ def get_tts_result(
 # Fetch PMIDs for a session/question if available, else fallback to old behavior
 @app.post("/api/pmids")
 # Endpoint pour obtenir les PMIDs pertinents à une question
-def get_pmids_api(
+async def get_pmids_api(
     session_id: str = Body(None),
     question_id: str = Body(None),
     question: str = Body(None),
@@ -344,7 +796,7 @@ def get_pmids_api(
 ):
     # Try to fetch from session memory first (PMIDs already computed during streaming)
     if session_id and question_id:
-        session = conversation_sessions.get(session_id)
+        session = await _get_session(session_id)
         if session:
             # Check if this question was refused
             if question_id in session.get('refusals', set()):
@@ -366,18 +818,8 @@ def get_pmids_api(
     if col is None:
         return {"error": "ChromaDB collection not available"}
     
-    query_emb = client.embeddings.create(
-        model="text-embedding-3-large",
-        input=question
-    ).data[0].embedding
-    results = col.query(
-        query_embeddings=[query_emb],
-        n_results=top_k,
-        include=['documents', 'metadatas']
-    )
-    contexts = results['documents'][0] if results['documents'] and results['documents'][0] else []
-    metadatas = results['metadatas'][0] if results.get('metadatas') and results['metadatas'][0] else []
-    pmids = get_pmids_from_contexts(contexts, metadatas=metadatas)
+    # Attend le lot sans occuper de thread du pool par défaut (utilisé par les flux de traduction)
+    pmids = await asyncio.wait_for(asyncio.wrap_future(pmids_batcher.submit_future((question, top_k))), PMIDS_BATCH_TIMEOUT)
     return {"pmids": pmids}
 
 @app.post("/api/add_comment")
@@ -398,37 +840,41 @@ def like_answer(
     like: bool = Body(...)
 ):
     """Add or update a like/dislike vote for a question. Replaces any previous vote."""
-    with question_log_lock:
-        try:
-            if QUESTION_LOG_PATH.exists():
-                with open(QUESTION_LOG_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                return {"status": "error", "message": "Log file not found"}
-        except Exception:
-            return {"status": "error", "message": "Could not read log file"}
-        for entry in data:
-            if entry.get("question_id") == question_id:
-                entry["likes"] = {
-                    "like": like,
-                    "timestamp": datetime.now().isoformat()
-                }
-                with open(QUESTION_LOG_PATH, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                return {"status": "success", "message": "Vote recorded"}
-        return {"status": "error", "message": "Question ID not found"}    
-    
+    recorded = _patch_question(question_id, {
+        "likes": {
+            "like": like,
+            "timestamp": datetime.now().isoformat()
+        }
+    })
+    if recorded:
+        return {"status": "success", "message": "Vote recorded"}
+    return {"status": "error", "message": "Question ID not found"}
+
 @app.get("/api/download_log")
 # Endpoint pour télécharger le journal des questions (admin seulement)
-def download_question_log(key: str = Query(...)):
+def download_question_log(request: Request, key: str = Query(...), raw: bool = Query(False)):
     if key != "dboubou363":
         return {"status": "error", "message": "Unauthorized"}
-    if not QUESTION_LOG_PATH.exists():
+    if not QUESTION_LOG_PATH.exists() and not LEGACY_QUESTION_LOG_PATH.exists():
         return {"status": "error", "message": "Log file not found"}
-    return FileResponse(
-        path=str(QUESTION_LOG_PATH),
-        filename="question_log.json",
-        media_type="application/json"
+    if raw:
+        return FileResponse(
+            path=str(QUESTION_LOG_PATH),
+            filename="question_log.jsonl",
+            media_type="application/x-ndjson"
+        )
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        # Instantané pré-compressé, envoyé tel quel (sendfile) sans recompression
+        refresh_log_snapshot()
+        return FileResponse(
+            path=str(LOG_SNAPSHOT_PATH),
+            filename="question_log.json",
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip"}
+        )
+    return JSONResponse(
+        fold_question_log(),
+        headers={"Content-Disposition": 'attachment; filename="question_log.json"'}
     )
 
 @app.get("/log_report", response_class=HTMLResponse)
@@ -445,14 +891,60 @@ def serve_log_report(request: Request, key: str = Query(...)):
 def _clean_old_sessions():
     """
     Supprime les sessions de conversation expirées.
+    Les sessions étant triées par activité, le parcours s'arrête à la première
+    session encore active ; le nettoyage est limité à un passage toutes les 30 s.
     """
+    global _last_session_cleanup
     now = datetime.now()
-    expired_sessions = [
-        sid for sid, session in conversation_sessions.items()
-        if now - session['last_activity'] > SESSION_TIMEOUT
-    ]
-    for sid in expired_sessions:
-        del conversation_sessions[sid]
+    if now - _last_session_cleanup < SESSION_CLEANUP_INTERVAL:
+        return
+    _last_session_cleanup = now
+    with _sessions_lock:
+        while conversation_sessions:
+            sid, session = next(iter(conversation_sessions.items()))
+            if now - session['last_activity'] <= SESSION_TIMEOUT:
+                break
+            del conversation_sessions[sid]
+
+async def _get_session(session_id: str) -> Optional[Dict]:
+    """
+    Retourne la session. Avec un session store (Redis), c'est lui qui fait foi :
+    l'historique, les PMIDs et les refus y sont relus à chaque appel (un autre
+    worker a pu les modifier) et recopiés en place dans l'objet local, si la
+    copie stockée est plus récente et qu'aucune réponse de cette session n'est
+    en cours de streaming dans ce processus (elle écrit dans ces conteneurs).
+    Sinon, la session en mémoire.
+    """
+    if not session_store.is_enabled():
+        return conversation_sessions.get(session_id)
+    try:
+        stored = await session_store.load_session(session_id)
+    except Exception as e:
+        print(f"Error loading session from Redis: {e}")
+        stored = None
+    with _sessions_lock:
+        session = conversation_sessions.get(session_id)
+        if stored is None:
+            # Pas encore persistée (première réponse en cours) ou Redis indisponible
+            return session
+        if session is None:
+            session = conversation_sessions[session_id] = stored
+        elif (session_id not in _streaming_sessions
+              and stored['last_activity'] > session['last_activity']):
+            _merge_stored_session(session, stored)
+    return session
+
+def _merge_stored_session(session: Dict, stored: Dict) -> None:
+    """Recopie une session relue de Redis sans remplacer les conteneurs existants."""
+    session.setdefault('messages', [])[:] = stored['messages']
+    pmids = session.setdefault('pmids', {})
+    pmids.clear()
+    pmids.update(stored['pmids'])
+    refusals = session.setdefault('refusals', set())
+    refusals.clear()
+    refusals.update(stored['refusals'])
+    session['created_at'] = stored['created_at']
+    session['last_activity'] = stored['last_activity']
 
 @app.get("/", response_class=HTMLResponse)
 ######################################################
@@ -472,35 +964,32 @@ def health():
     return {"status": "ok"}
 
 @app.get("/api/get_config")
-def get_translations():
+def get_translations(request: Request):
     """
-    Récupère les traductions pour le frontend.
+    Récupère les traductions pour le frontend (préchargées au démarrage).
     """
-    try:
-        translations_path = Path(__file__).parent / "config" / "config.json"
-        with open(translations_path, 'r', encoding='utf-8') as f:
-            translations = json.load(f)
-        return translations
-    except FileNotFoundError:
-        return {"error": "config not found"}
-    except Exception as e:
-        return {"error": f"Error loading config: {str(e)}"}
+    headers = {"ETag": _CONFIG_ETAG, "Cache-Control": "public, max-age=300"}
+    if request.headers.get("if-none-match") == _CONFIG_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(_CONFIG_BYTES, media_type="application/json", headers=headers)
 
 @app.post("/api/reset_session")
 # Endpoint pour réinitialiser une session de conversation
-def reset_session(session_id: str = None):
+async def reset_session(session_id: str = None):
     """Reset a conversation session"""
-    if session_id and session_id in conversation_sessions:
-        del conversation_sessions[session_id]
+    if session_id and await _get_session(session_id) is not None:
+        with _sessions_lock:
+            conversation_sessions.pop(session_id, None)
+        await session_store.delete_session(session_id)
         return {"status": "success", "message": "Session reset"}
     return {"status": "info", "message": "No active session to reset"}
 
 @app.get("/api/session_info")
 # Endpoint pour obtenir les informations d'une session
-def get_session_info(session_id: str):
+async def get_session_info(session_id: str):
     """Get information about a session"""
-    if session_id in conversation_sessions:
-        session = conversation_sessions[session_id]
+    session = await _get_session(session_id)
+    if session is not None:
         return {
             "exists": True,
             "message_count": len(session['messages']),
@@ -520,25 +1009,15 @@ def get_languages():
 # Endpoint pour traduire du texte en streaming
 async def translate_text_endpoint(request: TranslateRequest):
     """Translate text to target language using GPT with streaming."""
-    def generate():
-        translated = ""
-        for chunk in translate_text_stream(
+    async def generate():
+        async for chunk in coalesce_chunks(iterate_in_thread(translate_text_stream(
             text=request.text,
             target_language=request.target_language,
             source_language=request.source_language
-        ):
-            translated += chunk
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+        ))):
+            yield {'chunk': chunk}
 
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        }
-    )
+    return sse_response(generate())
 
 
 @app.post("/api/transcribe_audio")
@@ -578,77 +1057,79 @@ async def translate_audio_endpoint(
     Transcribe audio using Whisper, then translate result to target language.
     Step 1: Whisper transcribes the audio
     Step 2: GPT translates the transcription to the target language
+    For English, Whisper's own translation endpoint runs alongside the
+    transcription and step 2 is skipped.
     """
     audio_bytes = await audio.read()
+    filename = audio.filename or "audio.webm"
     
     # Step 1: Transcribe with Whisper
-    transcribed_text = transcribe_audio_whisper(audio_bytes, filename=audio.filename or "audio.webm")
+    if target_language == "en":
+        transcribed_text, english_text = await asyncio.gather(
+            asyncio.to_thread(transcribe_audio_whisper, audio_bytes, filename=filename),
+            translate_audio_whisper_async(audio_bytes, filename=filename)
+        )
+    else:
+        transcribed_text = await asyncio.to_thread(transcribe_audio_whisper, audio_bytes, filename=filename)
+        english_text = None
     
     if not transcribed_text:
         return JSONResponse({"error": "Could not transcribe audio"}, status_code=400)
     
     # Step 2: Translate the transcribed text
-    def generate():
+    async def generate():
         # First send the transcription
-        yield f"data: {json.dumps({'transcription': transcribed_text, 'chunk': ''})}\n\n"
-        for chunk in translate_text_stream(
+        yield {'transcription': transcribed_text, 'chunk': ''}
+        if english_text is not None:
+            yield {'chunk': english_text}
+            return
+        async for chunk in coalesce_chunks(iterate_in_thread(translate_text_stream(
             text=transcribed_text,
             target_language=target_language,
             source_language=source_language
-        ):
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+        ))):
+            yield {'chunk': chunk}
 
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        }
-    )
+    return sse_response(generate())
 
 
 @app.post("/api/tts")
-async def text_to_speech(
+def text_to_speech(
     text: str = Body(..., embed=True),
     language: str = Body("fr", embed=True)
 ):
     """
     Convert text to speech using OpenAI TTS API.
-    Returns audio/mpeg stream.
+    Returns audio/mpeg stream, forwarded to the client as it is generated.
     """
-    import openai
-    import os
-    from fastapi.responses import Response
-    try:
-        client_openai = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        # Choose voice based on language
-        voice = "nova" if language in ["fr", "es", "it", "pt", "ro"] else "alloy"
-        response = client_openai.audio.speech.create(
+    # Choose voice based on language
+    voice = "nova" if language in ["fr", "es", "it", "pt", "ro"] else "alloy"
+
+    def stream_audio():
+        # The context manager closes the HTTP response when the stream ends,
+        # fails or is dropped (client disconnect closes the generator)
+        with tts_client.audio.speech.with_streaming_response.create(
             model="tts-1",
             voice=voice,
             input=text[:4096],  # TTS API limit
             response_format="mp3"
-        )
-        
-        # Read full audio content
-        audio_bytes = b""
-        for chunk in response.iter_bytes(chunk_size=4096):
-            audio_bytes += chunk
-        
-        return Response(
-            content=audio_bytes,
-            media_type="audio/mpeg",
-            headers={
-                "Content-Length": str(len(audio_bytes)),
-                "Content-Disposition": "inline"
-            }
-        )
+        ) as response:
+            yield from response.iter_bytes(4096)
+
+    # Start the request here so API errors still get a JSON 500
+    audio = stream_audio()
+    try:
+        first_chunk = next(audio, b"")
     except Exception as e:
         print(f"TTS error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
 
+    return StreamingResponse(
+        itertools.chain((first_chunk,), audio),
+        media_type="audio/mpeg",
+        headers={"Content-Disposition": "inline"}
+    )
+
 
 @app.post("/update")
 # Endpoint pour déclencher l'indexation des documents Google Drive
@@ -662,6 +1143,7 @@ def update_pipeline(request: Request):
         print(f"User-Agent: {request.headers.get('user-agent', 'Unknown')}")
         
         result = run_pipeline()
+        clear_pmids_cache()
         
         if result.get("error"):
             print(f"❌ Pipeline error: {result['error']}")
@@ -25,6 +25,10 @@ TARGET_ACCOUNT = os.getenv("INSTAGRAM_TARGET_ACCOUNT", "")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Embedding model (must match core/query_chromadb.py)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+
 VIDEO_DIR = str(PROJECT_ROOT / "chroma_db" / "videos")
 TRANSCRIPTS_DIR = str(PROJECT_ROOT / "transcripts")
 CHROMA_DB_DIR = str(PROJECT_ROOT / "chroma_db")
@@ -39,7 +43,7 @@ os.makedirs(CHROMA_DB_DIR, exist_ok=True)
 client_openai = OpenAI(api_key=OPENAI_API_KEY)
 
 ef = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=OPENAI_API_KEY, model_name="text-embedding-3-large"
+    api_key=OPENAI_API_KEY, model_name=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS
 )
 chroma_client = chromadb.PersistentClient(
     path=CHROMA_DB_DIR,
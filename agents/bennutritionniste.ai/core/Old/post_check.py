@@ -2,23 +2,34 @@ from __future__ import annotations
 
 import re
 from dataclasses import dataclass
-from enum import Enum
-from typing import List, Optional, Dict, Any
+from enum import StrEnum
+from types import MappingProxyType
+from typing import List, Optional, Dict, Any, Mapping, Sequence
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
-class GuardDecision(str, Enum):
+
+class GuardDecision(StrEnum):
     PASS = "pass"
     BLOCK = "block"
     SANITIZE = "sanitize"   # optional: redact parts (here we'll mostly BLOCK)
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class GuardResult:
     decision: GuardDecision
-    reasons: List[str]
-    matched_patterns: List[str]
+    reasons: Sequence[str]
+    matched_patterns: Sequence[str]
     safe_answer: Optional[str] = None
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: Optional[Mapping[str, Any]] = None
+
+
+# Shared read-only metadata (no per-call allocation)
+_META_BLOCK: Mapping[str, Any] = MappingProxyType({"policy": "block_on_any_match"})
+_META_PASS: Mapping[str, Any] = MappingProxyType({"policy": "pass"})
 
 
 SAFE_FALLBACK_FR = """Je peux fournir de l’information générale à visée éducative,
@@ -30,97 +41,160 @@ Ne modifie pas un traitement sans avis médical. En cas d’urgence, contacte le
 """
 
 # Patterns are intentionally explainable (auditable). Tune as needed.
+# Siblings are fused into one alternation and gaps are bounded (.{0,80}?)
+# to keep backtracking proportional to the match, not to the answer length.
 OUTPUT_PATTERNS_FR = {
     # Numerical targets / dosages / quantities
     "numeric_targets_or_dosage": [
-        r"\b\d+(\,\d+)?\s*(kcal|calories)\b",
-        r"\b\d+(\,\d+)?\s*(mg|g|mcg|µg)\b",
-        r"\b\d+(\,\d+)?\s*(g\/kg|mg\/kg)\b",
-        r"\b\d+\s*(tasses|cups?)\b",
-        r"\b\d+\s*(fois par jour|x\/jour|x par jour|\/jour)\b",
-        r"\b(0,\d+|0\.\d+)\s*(g\/kg|mg\/kg)\b",
+        r"\b\d+(?:[,.]\d+)?\s*(?:kcal|calories|g\/kg|mg\/kg|mcg|µg|mg|g)\b",
+        r"\b\d+\s*(?:tasses|cups?|fois par jour|x\/jour|x par jour|\/jour)\b",
     ],
 
     # Meal plans / menus / day structure
     "meal_plan": [
-        r"\bvoici un exemple de menu\b",
-        r"\bmenu\b.*\b(journ[ée]e|jour)\b",
-        r"\bpetit[- ]d[eé]jeuner\b",
-        r"\bd[eé]jeuner\b",
-        r"\bd[iî]ner\b",
-        r"\bcollation(s)?\b",
-        r"\bplan alimentaire\b",
-        r"\bplan de repas\b",
-        r"\bexemple de repas\b",
+        r"\b(?:menu\b.{0,80}?\b(?:journ[ée]e|jour)|petit[- ]d[eé]jeuner|d[eé]jeuner|d[iî]ner"
+        r"|collations?|plan (?:alimentaire|de repas)|exemple de (?:menu|repas))\b",
     ],
 
     # Prescriptive / directive language (strong imperatives)
     "prescriptive_language": [
-        r"\btu devrais\b",
-        r"\btu dois\b",
-        r"\bil faut\b",
-        r"\bje te conseille\b",
-        r"\bje recommande\b",
-        r"\bprends?\b\s+\w+",
-        r"\barr[êe]te\b",
-        r"\b(augmente|r[eé]duis|supprime)\b",
-        r"\bconsomme\b",
-        r"\b[ée]vite\b",
-        r"\bobjectif\b.*\b(kcal|calories|g\/kg|mg)\b",
+        r"\b(?:tu (?:devrais|dois)|il faut|je (?:te conseille|recommande)|arr[êe]te"
+        r"|augmente|r[eé]duis|supprime|consomme|[ée]vite)\b",
+        r"\bprends?\s+\w+",
+        r"\bobjectif\b.{0,80}?\b(?:kcal|calories|g\/kg|mg)\b",
     ],
 
     # Personalized claims (talking about "your case" with advice)
     "personalized_framing": [
-        r"\bdans ton cas\b",
-        r"\bpour toi\b",
-        r"\bselon ton profil\b",
-        r"\bvu que tu\b",
-        r"\bavec ton poids\b",
-        r"\bavec ton âge\b",
+        r"\b(?:dans ton cas|pour toi|selon ton profil|vu que tu|avec ton (?:poids|âge))\b",
     ],
 
     # Clinical advice (high-level filter: not perfect, but useful)
     "clinical_advice": [
-        r"\b(diabetes|diab[eè]te|hypertension|insuline|metformine|statine)\b",
-        r"\btraitement\b",
-        r"\bposologie\b",
-        r"\bdiagnostic\b",
-        r"\bprescri(s|re)\b",
+        r"\b(?:diabetes|diab[eè]te|hypertension|insuline|metformine|statine"
+        r"|traitement|posologie|diagnostic|prescri(?:s|re))\b",
     ],
 }
 
 
-def _find_matches(text: str, pattern_list: List[str]) -> List[str]:
-    hits = []
-    for pat in pattern_list:
-        if re.search(pat, text, flags=re.IGNORECASE):
-            hits.append(pat)
-    return hits
+CATEGORY_REASONS = {
+    "numeric_targets_or_dosage": "Contains numeric targets / dosages / quantities.",
+    "meal_plan": "Contains meal plan / menu-like structure.",
+    "prescriptive_language": "Contains prescriptive or directive language.",
+    "personalized_framing": "Contains personalized framing.",
+    "clinical_advice": "Contains clinical advice language.",
+}
 
+# Compiled once at import: one alternation per category (single scan), plus
+# per-pattern forms only evaluated when the category matches (audit drill-down).
+COMPILED_OUTPUT_PATTERNS_FR: Dict[str, re.Pattern] = {
+    category: re.compile("|".join(f"(?:{p})" for p in pats), re.IGNORECASE)
+    for category, pats in OUTPUT_PATTERNS_FR.items()
+}
+_COMPILED_PATTERN_LISTS_FR: Dict[str, List[re.Pattern]] = {
+    category: [re.compile(p, re.IGNORECASE) for p in pats]
+    for category, pats in OUTPUT_PATTERNS_FR.items()
+}
 
-def output_guard_fr(answer: str) -> GuardResult:
+# All categories in one alternation, one named group per category: a single
+# search over the answer stops at the first hit and tells its category (m.lastgroup).
+# (re2.Set was considered, but RE2's ASCII-only \b misses accented words like "évite".)
+ALL_OUTPUT_PATTERNS_FR: re.Pattern = re.compile(
+    "|".join(f"(?P<{category}>{rx.pattern})" for category, rx in COMPILED_OUTPUT_PATTERNS_FR.items()),
+    re.IGNORECASE
+)
+
+# Literal anchors (casefolded): every match of a category contains at least one
+# of its anchors, so a category without any anchor in the answer is skipped
+# without running its regex.
+ANCHORS_FR: Dict[str, tuple] = {
+    "numeric_targets_or_dosage": tuple("0123456789"),
+    "meal_plan": ("jour", "jeuner", "diner", "dîner", "collation", "plan ", "exemple de "),
+    "prescriptive_language": (
+        "tu d", "il faut", "je te conseille", "je recommande", "arrête", "arrete",
+        "augmente", "réduis", "reduis", "supprime", "consomme", "évite", "evite",
+        "prend", "objectif",
+    ),
+    "personalized_framing": ("dans ton cas", "pour toi", "selon ton profil", "vu que tu", "avec ton "),
+    "clinical_advice": (
+        "diabet", "diabète", "diabete", "hypertension", "insuline", "metformine",
+        "statine", "traitement", "posologie", "diagnostic", "prescri",
+    ),
+}
+AHOCORASICK_MIN_LENGTH = 1000  # en dessous, quelques str.find sont plus rapides
+
+if ahocorasick is not None:
+    _ANCHORS_AC = ahocorasick.Automaton()
+    _anchor_categories: Dict[str, set] = {}
+    for _category, _anchors in ANCHORS_FR.items():
+        for _anchor in _anchors:
+            _anchor_categories.setdefault(_anchor, set()).add(_category)
+    for _anchor, _categories in _anchor_categories.items():
+        _ANCHORS_AC.add_word(_anchor, _categories)
+    _ANCHORS_AC.make_automaton()
+else:
+    _ANCHORS_AC = None
+
+
+def _candidate_categories(text: str) -> List[str]:
+    """Categories whose anchors appear in the casefolded text (in OUTPUT_PATTERNS_FR order)."""
+    norm = text.casefold()
+    if _ANCHORS_AC is not None and len(norm) >= AHOCORASICK_MIN_LENGTH:
+        found = set()
+        for _, categories in _ANCHORS_AC.iter(norm):
+            found |= categories
+            if len(found) == len(ANCHORS_FR):
+                break
+        return [category for category in OUTPUT_PATTERNS_FR if category in found]
+    return [
+        category for category in OUTPUT_PATTERNS_FR
+        if any(anchor in norm for anchor in ANCHORS_FR[category])
+    ]
+
+
+def _matched_categories(text: str, candidates: List[str]) -> List[str]:
+    # Exhaustive (audit): one search per category, overlapping matches included
+    return [category for category in candidates if COMPILED_OUTPUT_PATTERNS_FR[category].search(text)]
+
+
+def _find_matches(text: str, category: str) -> List[str]:
+    return [rx.pattern for rx in _COMPILED_PATTERN_LISTS_FR[category] if rx.search(text)]
+
+
+def output_guard_fr(answer: str, audit: bool = False) -> GuardResult:
     """
     Post-check the LLM answer.
     If unsafe patterns are detected, block and replace with SAFE_FALLBACK_FR.
+
+    By default, stops at the first match (policy is block on any match) and
+    reports that single reason. With audit=True, collects every matching
+    category and pattern (e.g. for logging).
     """
     matched_patterns: List[str] = []
     reasons: List[str] = []
 
-    for category, pats in OUTPUT_PATTERNS_FR.items():
-        hits = _find_matches(answer, pats)
-        if hits:
-            matched_patterns.extend(hits)
-
-            if category == "numeric_targets_or_dosage":
-                reasons.append("Contains numeric targets / dosages / quantities.")
-            elif category == "meal_plan":
-                reasons.append("Contains meal plan / menu-like structure.")
-            elif category == "prescriptive_language":
-                reasons.append("Contains prescriptive or directive language.")
-            elif category == "personalized_framing":
-                reasons.append("Contains personalized framing.")
-            elif category == "clinical_advice":
-                reasons.append("Contains clinical advice language.")
+    candidates = _candidate_categories(answer)
+
+    if audit:
+        for category in _matched_categories(answer, candidates):
+            matched_patterns.extend(_find_matches(answer, category))
+            reasons.append(CATEGORY_REASONS[category])
+    else:
+        m = None
+        if len(candidates) == len(OUTPUT_PATTERNS_FR):
+            m = ALL_OUTPUT_PATTERNS_FR.search(answer)
+            category = m.lastgroup if m else None
+        else:
+            for category in candidates:
+                m = COMPILED_OUTPUT_PATTERNS_FR[category].search(answer)
+                if m:
+                    break
+        if m:
+            matched_patterns.append(next(
+                (rx.pattern for rx in _COMPILED_PATTERN_LISTS_FR[category] if rx.match(answer, m.start())),
+                COMPILED_OUTPUT_PATTERNS_FR[category].pattern
+            ))
+            reasons.append(CATEGORY_REASONS[category])
 
     # Decision policy:
     # BLOCK if any high-risk category appears.
@@ -130,26 +204,20 @@ def output_guard_fr(answer: str) -> GuardResult:
             reasons=reasons,
             matched_patterns=matched_patterns,
             safe_answer=SAFE_FALLBACK_FR,
-            metadata={"policy": "block_on_any_match"}
+            metadata=_META_BLOCK
         )
 
-    return GuardResult(
-        decision=GuardDecision.PASS,
-        reasons=[],
-        matched_patterns=[],
-        safe_answer=None,
-        metadata={"policy": "pass"}
-    )
+    return GuardResult(GuardDecision.PASS, (), (), None, _META_PASS)
 
 
 # Example integration:
-def answer_user_with_postcheck(raw_answer: str):
+def answer_user_with_postcheck(raw_answer: str, audit: bool = False):
     """
     1) Call LLM (assuming refusal_engine already passed).
     2) Post-check answer. If blocked, return fallback.
     """
 
-    guard = output_guard_fr(raw_answer)
+    guard = output_guard_fr(raw_answer, audit=audit)
     if guard.decision == GuardDecision.BLOCK:
         return {
             "answer": guard.safe_answer,
@@ -1,8 +1,10 @@
 import os
 import json
+import functools
+import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import chromadb
 import google.generativeai as genai
 
@@ -17,6 +19,7 @@ load_dotenv(dotenv_path=env_path, override=True)
 chroma_client = None
 collection = None
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+aclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 # Initialize Vertex AI
@@ -26,14 +29,49 @@ index_id = os.getenv("VERTEX_INDEX_ID")
 endpoint_id = os.getenv("VERTEX_ENDPOINT_ID")
 deployed_index_id=os.getenv("VERTEX_DEPLOYED_INDEX_ID")
 
+# Embedding model (must match scripts/index_vertex_ai.py)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+
 # Vertex AI Vector Search client (lazy initialization)
 vertex_ai_index = None
 vertex_ai_endpoint = None
 
+# Short-circuits: questions answered with the not found message without
+# embedding / Vertex / LLM calls, and best-neighbor threshold below which
+# retrieval is considered empty. The threshold follows the index metric
+# (distance_measure_type of scripts/index_vertex_ai.py): DOT_PRODUCT_DISTANCE and
+# COSINE_DISTANCE return a similarity (higher is closer) compared to
+# VERTEX_MIN_SCORE, the L1/L2 metrics a distance compared to VERTEX_MAX_DISTANCE.
+# Disabled unless the matching variable is set.
+TRIVIAL_QUESTIONS = frozenset({"test", "ping"})
+MIN_QUESTION_LENGTH = 3
+VERTEX_DISTANCE_MEASURE = os.getenv("VERTEX_DISTANCE_MEASURE", "DOT_PRODUCT_DISTANCE")
+VERTEX_SIMILARITY_MEASURES = frozenset({"DOT_PRODUCT_DISTANCE", "COSINE_DISTANCE"})
+VERTEX_MIN_SCORE = float(os.getenv("VERTEX_MIN_SCORE")) if os.getenv("VERTEX_MIN_SCORE") else None
+VERTEX_MAX_DISTANCE = float(os.getenv("VERTEX_MAX_DISTANCE")) if os.getenv("VERTEX_MAX_DISTANCE") else None
+
+STYLE_GUIDES_PATH = PROJECT_ROOT / 'config' / 'style_guides.json'
+SYSTEM_PROMPTS_PATH = PROJECT_ROOT / 'config' / 'system_prompts.json'
+
+
+def _mtime_ns(path):
+    """Modification time of `path` (None if missing), used as cache key."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
 def load_style_guides():
-    """Load style guides from JSON file"""
+    """Load style guides from JSON file (cached until the file changes)"""
+    return _load_style_guides_cached(STYLE_GUIDES_PATH, _mtime_ns(STYLE_GUIDES_PATH))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_style_guides_cached(path, mtime_ns):
     try:
-        with open(PROJECT_ROOT / 'config' / 'style_guides.json', 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             style_data = json.load(f)
         
         # Format the style guides for use in prompts
@@ -60,15 +98,112 @@ def load_style_guides():
         return {}, {}
 
 def load_system_prompts():
-    """Load system prompts from JSON file"""
+    """Load system prompts from JSON file (cached until the file changes)"""
+    return _load_system_prompts_cached(SYSTEM_PROMPTS_PATH, _mtime_ns(SYSTEM_PROMPTS_PATH))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_system_prompts_cached(path, mtime_ns):
     try:
-        with open(PROJECT_ROOT / 'config' / 'system_prompts.json', 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except Exception as e:
         print(f"Error loading system prompts: {e}")
         return {}
 
 
+PROMPT_SKELETONS = {
+    "fr": """{base_prompt}
+
+            {style_guide}
+
+            CONTEXTE DISPONIBLE:
+            {{context}}
+
+            QUESTION DE L'UTILISATEUR: {{question}}
+
+            INSTRUCTIONS SPÉCIALES:
+            - Si l'information n'est pas disponible dans le contexte, réponds: "{not_found_msg}"
+            - Applique rigoureusement ta structure narrative et tes expressions caractéristiques
+            - Reste dans ton rôle de Ben avec ton style unique et reconnaissable""",
+
+    "en": """{base_prompt}
+
+            {style_guide}
+
+            AVAILABLE CONTEXT:
+            {{context}}
+
+            USER QUESTION: {{question}}
+
+            SPECIAL INSTRUCTIONS:
+            - If information is not available in the context, respond: "{not_found_msg}"
+            - Strictly apply your narrative structure and characteristic expressions
+            - Stay in your role as Ben with your unique and recognizable style"""
+}
+
+
+def _not_found_message(style_data, language):
+    return style_data.get(language, {}).get(
+        'not_found_message',
+        style_data.get('fr', {}).get('not_found_message', "Information not found in current content.")
+    )
+
+
+def get_not_found_message(language):
+    """Not found message for `language` (from the cached style guides)."""
+    _, style_data = load_style_guides()
+    return _not_found_message(style_data, language)
+
+
+def _is_trivial_question(question):
+    normalized = question.strip().lower().rstrip("?!. ")
+    return len(normalized) < MIN_QUESTION_LENGTH or normalized in TRIVIAL_QUESTIONS
+
+
+def _escape_braces(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def get_prompt_template(language):
+    """
+    Return the prompt for `language` with everything but {context} and
+    {question} filled in (cached per language and config file versions).
+    """
+    return _prompt_template_cached(language, _mtime_ns(STYLE_GUIDES_PATH), _mtime_ns(SYSTEM_PROMPTS_PATH))
+
+
+@functools.lru_cache(maxsize=32)
+def _prompt_template_cached(language, style_mtime_ns, prompts_mtime_ns):
+    style_guides, style_data = _load_style_guides_cached(STYLE_GUIDES_PATH, style_mtime_ns)
+    style_guide = style_guides.get(language, style_guides.get("fr", ""))
+    not_found_msg = _not_found_message(style_data, language)
+    # Use French as fallback for unsupported languages
+    prompt_lang = language if language in PROMPT_SKELETONS else "fr"
+    system_prompts_data = _load_system_prompts_cached(SYSTEM_PROMPTS_PATH, prompts_mtime_ns)
+    base_prompt = system_prompts_data.get(prompt_lang, {}).get('content', '')
+    return PROMPT_SKELETONS[prompt_lang].format(
+        base_prompt=_escape_braces(base_prompt),
+        style_guide=_escape_braces(style_guide),
+        not_found_msg=_escape_braces(not_found_msg)
+    )
+
+
+def build_prompt(context, question, language="fr"):
+    """Fill the cached prompt template with the retrieved context and the question."""
+    return get_prompt_template(language).format(context=context, question=question)
+
+
+@functools.lru_cache(maxsize=1024)
+def _embed_question(question):
+    """Embedding of a question (tuple, cached: repeated questions skip the API call)."""
+    return tuple(client.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=question,
+        dimensions=EMBEDDING_DIMENSIONS
+    ).data[0].embedding)
+
+
 # ============================================================================
 # VERTEX AI VECTOR SEARCH FUNCTIONS
 # ============================================================================
@@ -105,7 +240,7 @@ def get_vertex_ai_index():
 
 
 def query_vertex_ai(query_embedding, top_k=5):
-    """Query Vertex AI Vector Search with an embedding vector."""
+    """Query Vertex AI Vector Search with an embedding vector. Returns [(document, distance)]."""
     try:
         _, endpoint = get_vertex_ai_index()
         
@@ -124,7 +259,7 @@ def query_vertex_ai(query_embedding, top_k=5):
         for neighbor in response[0]:
             # Assuming metadata contains the document text
             doc_text = neighbor.id  # or neighbor.metadata.get('text', '')
-            documents.append(doc_text)
+            documents.append((doc_text, getattr(neighbor, 'distance', None)))
         
         return documents
         
@@ -133,8 +268,30 @@ def query_vertex_ai(query_embedding, top_k=5):
         return None
 
 
+def _is_weak_match(best):
+    """True when the best neighbor is below the threshold of the index metric."""
+    if best is None:
+        return False
+    if VERTEX_DISTANCE_MEASURE in VERTEX_SIMILARITY_MEASURES:
+        return VERTEX_MIN_SCORE is not None and best < VERTEX_MIN_SCORE
+    return VERTEX_MAX_DISTANCE is not None and best > VERTEX_MAX_DISTANCE
+
+
+def _context_from_results(results, language):
+    """Return (context, message): message is set when retrieval should short-circuit the LLM."""
+    if not results:
+        return None, "No relevant information found in Vertex AI Vector Search."
+    if _is_weak_match(results[0][1]):
+        return None, get_not_found_message(language)
+    return "\n\n".join(doc for doc, _ in results), None
+
+
 def ask_question_stream_vertex(question, language="fr", timezone="UTC", locale="fr-FR", top_k=5):
     """Streaming version using Vertex AI Vector Search with OpenAI."""
+    if _is_trivial_question(question):
+        yield get_not_found_message(language)
+        return
+
     _, endpoint = get_vertex_ai_index()
     
     if endpoint is None:
@@ -142,71 +299,20 @@ def ask_question_stream_vertex(question, language="fr", timezone="UTC", locale="
         return
     
     try:
-        # Get embedding for the question
-        query_emb = client.embeddings.create(
-            model="text-embedding-3-large", 
-            input=question
-        ).data[0].embedding
+        # Get embedding for the question (cached)
+        query_emb = list(_embed_question(question))
         
         # Query Vertex AI Vector Search
-        documents = query_vertex_ai(query_emb, top_k=top_k)
+        results = query_vertex_ai(query_emb, top_k=top_k)
         
-        if not documents or len(documents) == 0:
-            yield "No relevant information found in Vertex AI Vector Search."
+        # Build context from results (no LLM call if nothing relevant was found)
+        context, message = _context_from_results(results, language)
+        if message:
+            yield message
             return
         
-        # Build context from results
-        context = "\n\n".join(documents)
-        
-        # Load Style Card from JSON based on language
-        style_guides, style_data = load_style_guides()
-        style_guide = style_guides.get(language, style_guides.get("fr", ""))
-        
-        # Get not found message for the language
-        not_found_msg = style_data.get(language, {}).get('not_found_message', 
-                                                        style_data.get('fr', {}).get('not_found_message', 
-                                                        "Information not found in current content."))
-        
-        # Load system prompts from JSON
-        system_prompts_data = load_system_prompts()
-        
-        # Create dynamic prompts with context and style guide
-        base_prompt_fr = system_prompts_data.get('fr', {}).get('content', '')
-        base_prompt_en = system_prompts_data.get('en', {}).get('content', '')
-        
-        # Build full prompts with style guide and context
-        prompts = {
-            "fr": f"""{base_prompt_fr}
-
-            {style_guide}
-
-            CONTEXTE DISPONIBLE:
-            {context}
-
-            QUESTION DE L'UTILISATEUR: {question}
-
-            INSTRUCTIONS SPÉCIALES:
-            - Si l'information n'est pas disponible dans le contexte, réponds: "{not_found_msg}"
-            - Applique rigoureusement ta structure narrative et tes expressions caractéristiques
-            - Reste dans ton rôle de Ben avec ton style unique et reconnaissable""",
-
-            "en": f"""{base_prompt_en}
-
-            {style_guide}
-
-            AVAILABLE CONTEXT:
-            {context}
-
-            USER QUESTION: {question}
-
-            SPECIAL INSTRUCTIONS:
-            - If information is not available in the context, respond: "{not_found_msg}"
-            - Strictly apply your narrative structure and characteristic expressions
-            - Stay in your role as Ben with your unique and recognizable style"""
-        }
-        
-        # Use French as fallback for unsupported languages
-        prompt = prompts.get(language, prompts["fr"]) if language in ["fr", "en"] else prompts["fr"]
+        # Prompt template precomputed per language; only context and question vary
+        prompt = build_prompt(context, question, language)
 
         # Get streaming response from GPT
         stream = client.chat.completions.create(
@@ -235,6 +341,10 @@ def ask_question_stream_vertex(question, language="fr", timezone="UTC", locale="
 
 def ask_question_stream_vertex_gemini(question, language="fr", timezone="UTC", locale="fr-FR", top_k=5, model_name="gemini-2.5-flash"):
     """Streaming version using Vertex AI Vector Search with Gemini."""
+    if _is_trivial_question(question):
+        yield get_not_found_message(language)
+        return
+
     _, endpoint = get_vertex_ai_index()
     
     if endpoint is None:
@@ -242,76 +352,120 @@ def ask_question_stream_vertex_gemini(question, language="fr", timezone="UTC", l
         return
     
     try:
-        # Get embedding for the question using OpenAI (for consistency)
-        query_emb = client.embeddings.create(
-            model="text-embedding-3-large",
-            input=question
-        ).data[0].embedding
+        # Get embedding for the question using OpenAI (for consistency, cached)
+        query_emb = list(_embed_question(question))
 
         # Query Vertex AI Vector Search
-        documents = query_vertex_ai(query_emb, top_k=top_k)
-        
-        if not documents or len(documents) == 0:
-            yield "No relevant information found in Vertex AI Vector Search."
+        results = query_vertex_ai(query_emb, top_k=top_k)
+
+        # Build context from results (no LLM call if nothing relevant was found)
+        context, message = _context_from_results(results, language)
+        if message:
+            yield message
             return
 
-        # Build context from results
-        context = "\n\n".join(documents)
+        # Prompt template precomputed per language; only context and question vary
+        prompt = build_prompt(context, question, language)
 
-        # Load Style Card and system prompts
-        style_guides, style_data = load_style_guides()
-        style_guide = style_guides.get(language, style_guides.get("fr", ""))
-        not_found_msg = style_data.get(language, {}).get(
-            'not_found_message',
-            style_data.get('fr', {}).get('not_found_message', "Information not found in current content.")
-        )
+        # Configure model (temperature to mirror OpenAI setup)
+        model = genai.GenerativeModel(model_name, generation_config={
+            "temperature": 0.3
+        })
 
-        system_prompts_data = load_system_prompts()
-        base_prompt_fr = system_prompts_data.get('fr', {}).get('content', '')
-        base_prompt_en = system_prompts_data.get('en', {}).get('content', '')
+        # Stream tokens
+        response = model.generate_content(prompt, stream=True)
 
-        prompts = {
-            "fr": f"""{base_prompt_fr}
+        first_chunk = True
+        for chunk in response:
+            text = getattr(chunk, "text", None)
+            if text:
+                if first_chunk:
+                    text = text.lstrip()
+                    first_chunk = False
+                if text:
+                    yield text
 
-            {style_guide}
+    except Exception as e:
+        yield f"Error processing your question (Vertex AI + Gemini): {str(e)}"
 
-            CONTEXTE DISPONIBLE:
-            {context}
 
-            QUESTION DE L'UTILISATEUR: {question}
+# ============================================================================
+# ASYNC VARIANTS (embedding, prompt loading and Vertex query overlapped)
+# ============================================================================
 
-            INSTRUCTIONS SPÉCIALES:
-            - Si l'information n'est pas disponible dans le contexte, réponds: "{not_found_msg}"
-            - Applique rigoureusement ta structure narrative et tes expressions caractéristiques
-            - Reste dans ton rôle de Ben avec ton style unique et reconnaissable""",
+async def _build_vertex_prompt_async(question, language="fr", top_k=5):
+    """
+    Embed the question (cached) while the prompt template loads, then query Vertex AI
+    (sync SDK, run in a thread). Returns (prompt, message); message replaces
+    the LLM answer (errors, trivial question, nothing relevant found).
+    """
+    if _is_trivial_question(question):
+        return None, await asyncio.to_thread(get_not_found_message, language)
+
+    _, endpoint = await asyncio.to_thread(get_vertex_ai_index)
+    if endpoint is None:
+        return None, "Error: Vertex AI Vector Search is not available. Please configure VERTEX_INDEX_ID and VERTEX_ENDPOINT_ID."
 
-            "en": f"""{base_prompt_en}
+    # Embedding through the cached helper (in a thread), overlapped with the template load
+    emb_task = asyncio.create_task(asyncio.to_thread(_embed_question, question))
+    template_task = asyncio.create_task(asyncio.to_thread(get_prompt_template, language))
+    query_emb = list(await emb_task)
 
-            {style_guide}
+    results = await asyncio.to_thread(query_vertex_ai, query_emb, top_k)
+    template = await template_task
+    context, message = _context_from_results(results, language)
+    if message:
+        return None, message
+    return template.format(context=context, question=question), None
 
-            AVAILABLE CONTEXT:
-            {context}
 
-            USER QUESTION: {question}
+async def ask_question_stream_vertex_async(question, language="fr", timezone="UTC", locale="fr-FR", top_k=5):
+    """Async streaming version of ask_question_stream_vertex (Vertex AI + OpenAI)."""
+    try:
+        prompt, message = await _build_vertex_prompt_async(question, language, top_k)
+        if message:
+            yield message
+            return
 
-            SPECIAL INSTRUCTIONS:
-            - If information is not available in the context, respond: "{not_found_msg}"
-            - Strictly apply your narrative structure and characteristic expressions
-            - Stay in your role as Ben with your unique and recognizable style"""
-        }
+        stream = await aclient.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            stream=True
+        )
 
-        prompt = prompts.get(language, prompts["fr"]) if language in ["fr", "en"] else prompts["fr"]
+        first_chunk = True
+        async for chunk in stream:
+            if chunk.choices[0].delta.content is not None:
+                content = chunk.choices[0].delta.content
+                # Strip leading whitespace from first chunk only
+                if first_chunk:
+                    content = content.lstrip()
+                    first_chunk = False
+                if content:
+                    yield content
+
+    except Exception as e:
+        yield f"Error processing your question (Vertex AI): {str(e)}"
+
+
+async def ask_question_stream_vertex_gemini_async(question, language="fr", timezone="UTC", locale="fr-FR", top_k=5, model_name="gemini-2.5-flash"):
+    """Async streaming version of ask_question_stream_vertex_gemini (Vertex AI + Gemini)."""
+    try:
+        prompt, message = await _build_vertex_prompt_async(question, language, top_k)
+        if message:
+            yield message
+            return
 
-        # Configure model (temperature to mirror OpenAI setup)
         model = genai.GenerativeModel(model_name, generation_config={
             "temperature": 0.3
         })
-
-        # Stream tokens
-        response = model.generate_content(prompt, stream=True)
+        response = await model.generate_content_async(prompt, stream=True)
 
         first_chunk = True
-        for chunk in response:
+        async for chunk in response:
             text = getattr(chunk, "text", None)
             if text:
                 if first_chunk:
@@ -322,4 +476,3 @@ def ask_question_stream_vertex_gemini(question, language="fr", timezone="UTC", l
 
     except Exception as e:
         yield f"Error processing your question (Vertex AI + Gemini): {str(e)}"
-
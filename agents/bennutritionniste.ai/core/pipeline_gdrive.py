@@ -1,18 +1,28 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
-from openai import OpenAI
+from core import openai_client
 import chromadb
 from chromadb.config import Settings
 from chromadb.utils import embedding_functions
 import json
 import os
 import io
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from pathlib import Path
 from dotenv import load_dotenv
 import PyPDF2
 import docx
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+try:
+    import pypdfium2 as pdfium  # PDFium (C++): much faster text extraction than PyPDF2
+except ImportError:
+    pdfium = None
 from datetime import datetime
 
 # Load environment variables
@@ -25,6 +35,10 @@ GDRIVE_CREDENTIALS_PATH = os.getenv("GDRIVE_CREDENTIALS_PATH", "")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Embedding model (must match core/query_chromadb.py)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+
 DOCUMENTS_DIR = str(PROJECT_ROOT / "chroma_db" / "documents")
 EXTRACTED_DIR = str(PROJECT_ROOT / "extracted_texts")
 CHROMA_DB_DIR = str(PROJECT_ROOT / "chroma_db")
@@ -34,11 +48,38 @@ os.makedirs(DOCUMENTS_DIR, exist_ok=True)
 os.makedirs(EXTRACTED_DIR, exist_ok=True)
 os.makedirs(CHROMA_DB_DIR, exist_ok=True)
 
+# Text chunking: by tokens when tiktoken is available, else by characters
+CHUNK_TOKENS = 512
+CHUNK_OVERLAP_TOKENS = 50
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+_token_encoding = None
+_token_encoding_failed = False
+
+# Chunks per collection.add() call (one embedding request per batch)
+ADD_BATCH_SIZE = 256
+
+# Keep a copy of downloaded files in DOCUMENTS_DIR (debug); by default files are parsed in memory
+KEEP_DOWNLOADED_FILES = os.getenv("KEEP_DOWNLOADED_FILES", "").lower() in ("1", "true", "yes")
+
+# Supported document types (Drive query built once)
+SUPPORTED_MIME_TYPES = (
+    'application/pdf',
+    'application/vnd.google-apps.document',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'text/plain'
+)
+MIME_QUERY = "(" + " or ".join(f"mimeType='{mt}'" for mt in SUPPORTED_MIME_TYPES) + ")"
+LIST_PAGE_SIZE = 1000  # Drive API maximum
+
+# Documents processed in parallel by run_pipeline (download + embedding are I/O bound)
+PIPELINE_MAX_WORKERS = 8
+
 # Clients
-client_openai = OpenAI(api_key=OPENAI_API_KEY)
+client_openai = openai_client.client
 
 ef = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=OPENAI_API_KEY, model_name="text-embedding-3-large"
+    api_key=OPENAI_API_KEY, model_name=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS
 )
 chroma_client = chromadb.PersistentClient(
     path=CHROMA_DB_DIR,
@@ -51,13 +92,21 @@ collection = chroma_client.get_or_create_collection(
     name="gdrive_documents", embedding_function=ef
 )
 
+# Serializes ChromaDB writes from the pipeline worker threads
+collection_write_lock = threading.Lock()
+# PDFium is not thread-safe (not even across documents): one extraction at a time
+_pdfium_lock = threading.Lock()
+
 # Google Drive authentication
 drive_service = None
+drive_credentials = None
 gdrive_authenticated = False
+# googleapiclient services are not thread-safe: one per worker thread
+_thread_local = threading.local()
 
 def authenticate_gdrive():
     """Authenticate with Google Drive using service account"""
-    global drive_service, gdrive_authenticated
+    global drive_service, drive_credentials, gdrive_authenticated
     try:
         print(f"Attempting Google Drive authentication...")
         
@@ -71,6 +120,7 @@ def authenticate_gdrive():
         )
         
         drive_service = build('drive', 'v3', credentials=credentials)
+        drive_credentials = credentials
         
         # Test connection
         drive_service.files().list(pageSize=1).execute()
@@ -96,46 +146,57 @@ def list_files_in_folder(folder_id=None, limit=None):
     folder_id = folder_id or GDRIVE_FOLDER_ID
     
     try:
-        query = f"'{folder_id}' in parents and trashed=false"
-        
-        # Supported document types
-        mime_types = [
-            'application/pdf',
-            'application/vnd.google-apps.document',
-            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            'text/plain'
-        ]
-        
-        mime_query = " or ".join([f"mimeType='{mt}'" for mt in mime_types])
-        query += f" and ({mime_query})"
+        query = f"'{folder_id}' in parents and trashed=false and {MIME_QUERY}"
         
-        results = drive_service.files().list(
-            q=query,
-            pageSize=limit or 100,
-            fields="files(id, name, mimeType, modifiedTime, size)"
-        ).execute()
+        # Follow nextPageToken so folders larger than one page are fully listed
+        files = []
+        page_token = None
+        while True:
+            results = drive_service.files().list(
+                q=query,
+                pageSize=min(limit, LIST_PAGE_SIZE) if limit else LIST_PAGE_SIZE,
+                pageToken=page_token,
+                fields="nextPageToken, files(id, name, mimeType, modifiedTime, size)"
+            ).execute()
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token or (limit and len(files) >= limit):
+                break
+        if limit:
+            files = files[:limit]
         
-        files = results.get('files', [])
         print(f"📁 Found {len(files)} documents in folder")
         return files
     except Exception as e:
         print(f"❌ Error listing files: {str(e)}")
         return []
 
+def get_drive_service():
+    """Return the Drive service for the current thread (built on first use in worker threads)"""
+    if threading.current_thread() is threading.main_thread():
+        return drive_service
+    service = getattr(_thread_local, "drive_service", None)
+    if service is None or getattr(_thread_local, "credentials", None) is not drive_credentials:
+        service = build('drive', 'v3', credentials=drive_credentials)
+        _thread_local.drive_service = service
+        _thread_local.credentials = drive_credentials
+    return service
+
 def download_file(file_id, file_name, mime_type):
     """Download a file from Google Drive"""
     try:
         file_path = os.path.join(DOCUMENTS_DIR, file_name)
         
         # Google Docs need to be exported
+        service = get_drive_service()
         if mime_type == 'application/vnd.google-apps.document':
-            request = drive_service.files().export_media(
+            request = service.files().export_media(
                 fileId=file_id,
                 mimeType='application/pdf'
             )
             file_path = file_path.replace('.gdoc', '.pdf')
         else:
-            request = drive_service.files().get_media(fileId=file_id)
+            request = service.files().get_media(fileId=file_id)
         
         fh = io.FileIO(file_path, 'wb')
         downloader = MediaIoBaseDownload(fh, request)
@@ -150,21 +211,57 @@ def download_file(file_id, file_name, mime_type):
         print(f"❌ Error downloading {file_name}: {str(e)}")
         return None
 
+def fetch_bytes(file_id, mime_type):
+    """Download a file from Google Drive into memory (Google Docs are exported as PDF)"""
+    service = get_drive_service()
+    if mime_type == 'application/vnd.google-apps.document':
+        request = service.files().export_media(fileId=file_id, mimeType='application/pdf')
+    else:
+        request = service.files().get_media(fileId=file_id)
+    
+    buffer = io.BytesIO()
+    downloader = MediaIoBaseDownload(buffer, request)
+    done = False
+    while not done:
+        status, done = downloader.next_chunk()
+    buffer.seek(0)
+    return buffer
+
+def _extract_text_pdfium(pdf_path):
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            parts = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                parts.append(textpage.get_text_range().replace("\r\n", "\n"))
+                textpage.close()
+                page.close()
+            return "\n".join(parts).strip()
+        finally:
+            pdf.close()
+
 def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file"""
+    """Extract text from PDF file (path or binary file-like object), with PDFium when available"""
+    if pdfium is not None:
+        try:
+            return _extract_text_pdfium(pdf_path)
+        except Exception as e:
+            print(f"⚠️  PDFium extraction failed, falling back to PyPDF2: {str(e)}")
+            if hasattr(pdf_path, 'seek'):
+                pdf_path.seek(0)
     try:
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+        pdf_reader = PyPDF2.PdfReader(pdf_path)
+        text = ""
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n"
         return text.strip()
     except Exception as e:
         print(f"❌ Error extracting text from PDF: {str(e)}")
         return ""
 
 def extract_text_from_docx(docx_path):
-    """Extract text from DOCX file"""
+    """Extract text from DOCX file (path or binary file-like object)"""
     try:
         doc = docx.Document(docx_path)
         text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
@@ -174,8 +271,10 @@ def extract_text_from_docx(docx_path):
         return ""
 
 def extract_text_from_txt(txt_path):
-    """Extract text from TXT file"""
+    """Extract text from TXT file (path or binary file-like object)"""
     try:
+        if hasattr(txt_path, 'read'):
+            return txt_path.read().decode('utf-8').strip()
         with open(txt_path, 'r', encoding='utf-8') as file:
             return file.read().strip()
     except Exception as e:
@@ -183,8 +282,8 @@ def extract_text_from_txt(txt_path):
         return ""
 
 def extract_text_from_file(file_path, mime_type):
-    """Extract text based on file type"""
-    if mime_type == 'application/pdf' or file_path.endswith('.pdf'):
+    """Extract text based on file type (file_path may be a path or a binary file-like object)"""
+    if mime_type == 'application/pdf' or (isinstance(file_path, str) and file_path.endswith('.pdf')):
         return extract_text_from_pdf(file_path)
     elif mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
         return extract_text_from_docx(file_path)
@@ -194,8 +293,68 @@ def extract_text_from_file(file_path, mime_type):
         print(f"⚠️  Unsupported file type: {mime_type}")
         return ""
 
-def process_document(file_info):
-    """Process a single document: download, extract text, and index"""
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Split text into chunks of at most chunk_size characters overlapping by
+    `overlap`, cutting preferably at a paragraph break ("\n\n") in the second
+    half of the window so chunks hold whole paragraphs.
+    """
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            cut = text.rfind("\n\n", start + chunk_size // 2, end)
+            if cut != -1:
+                end = cut
+        chunk = text[start:end]
+        if chunk.strip():
+            chunks.append(chunk)
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+def get_indexed_file_ids():
+    """Return the set of Drive file ids already indexed in ChromaDB (one query)"""
+    try:
+        existing = collection.get(include=["metadatas"])
+    except Exception as e:
+        print(f"❌ Error reading indexed file ids: {str(e)}")
+        return set()
+    return {m["file_id"] for m in existing["metadatas"] if m and "file_id" in m}
+
+def get_token_encoding():
+    """cl100k_base encoding, loaded on first use (None if tiktoken or its data is unavailable)"""
+    global _token_encoding, _token_encoding_failed
+    if _token_encoding is None and tiktoken is not None and not _token_encoding_failed:
+        try:
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"⚠️  tiktoken encoding unavailable, using character chunks: {str(e)}")
+            _token_encoding_failed = True
+    return _token_encoding
+
+def chunk_text_tokens(text, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split text into windows of chunk_tokens tokens (cl100k_base) overlapping by overlap_tokens"""
+    token_encoding = get_token_encoding()
+    tokens = token_encoding.encode(text)
+    step = chunk_tokens - overlap_tokens
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunk = token_encoding.decode(tokens[start:start + chunk_tokens])
+        if chunk.strip():
+            chunks.append(chunk)
+        if start + chunk_tokens >= len(tokens):
+            break
+    return chunks
+
+def process_document(file_info, known_ids=None):
+    """
+    Process a single document: download, extract text, and index.
+    `known_ids` is the set of already indexed file ids (see get_indexed_file_ids).
+    """
     file_id = file_info['id']
     file_name = file_info['name']
     mime_type = file_info['mimeType']
@@ -203,21 +362,26 @@ def process_document(file_info):
     print(f"📄 Processing: {file_name}")
     
     # Check if already indexed
-    try:
-        existing = collection.get(where={"file_id": file_id})
-        if existing['ids']:
-            print(f"⏭️  Already indexed: {file_name}")
-            return True
-    except:
-        pass
+    if known_ids is None:
+        known_ids = get_indexed_file_ids()
+    if file_id in known_ids:
+        print(f"⏭️  Already indexed: {file_name}")
+        return True
     
-    # Download file
-    file_path = download_file(file_id, file_name, mime_type)
-    if not file_path:
+    # Download file into memory
+    try:
+        buffer = fetch_bytes(file_id, mime_type)
+    except Exception as e:
+        print(f"❌ Error downloading {file_name}: {str(e)}")
         return False
+    # Google Docs are exported as PDF
+    content_type = 'application/pdf' if mime_type == 'application/vnd.google-apps.document' else mime_type
+    if KEEP_DOWNLOADED_FILES:
+        with open(os.path.join(DOCUMENTS_DIR, file_name.replace('.gdoc', '.pdf')), 'wb') as f:
+            f.write(buffer.getbuffer())
     
     # Extract text
-    text = extract_text_from_file(file_path, mime_type)
+    text = extract_text_from_file(buffer, content_type)
     if not text:
         print(f"⚠️  No text extracted from {file_name}")
         return False
@@ -230,28 +394,29 @@ def process_document(file_info):
     print(f"✅ Extracted {len(text)} characters from {file_name}")
     
     # Chunk text and add to ChromaDB
-    chunk_size = 1000
-    overlap = 100
-    chunks = []
+    chunks = chunk_text_tokens(text) if get_token_encoding() is not None else chunk_text(text)
     
-    for i in range(0, len(text), chunk_size - overlap):
-        chunk = text[i:i + chunk_size]
-        if chunk.strip():
-            chunks.append(chunk)
-    
-    # Add chunks to ChromaDB
-    for i, chunk in enumerate(chunks):
-        collection.add(
-            documents=[chunk],
-            metadatas=[{
-                "source": file_name,
-                "file_id": file_id,
-                "chunk": i,
-                "mime_type": mime_type,
-                "indexed_at": datetime.now().isoformat()
-            }],
-            ids=[f"{file_id}_chunk_{i}"]
-        )
+    # Add chunks to ChromaDB in batches (the embedding function embeds each batch in one request)
+    indexed_at = datetime.now().isoformat()
+    metadatas = [{
+        "source": file_name,
+        "file_id": file_id,
+        "chunk": i,
+        "mime_type": mime_type,
+        "indexed_at": indexed_at
+    } for i in range(len(chunks))]
+    ids = [f"{file_id}_chunk_{i}" for i in range(len(chunks))]
+    for start in range(0, len(chunks), ADD_BATCH_SIZE):
+        end = start + ADD_BATCH_SIZE
+        # Embed outside the lock so worker threads overlap their API calls
+        embeddings = ef(chunks[start:end])
+        with collection_write_lock:
+            collection.add(
+                documents=chunks[start:end],
+                embeddings=embeddings,
+                metadatas=metadatas[start:end],
+                ids=ids[start:end]
+            )
     
     print(f"✅ Indexed {len(chunks)} chunks from {file_name}")
     return True
@@ -279,11 +444,19 @@ def run_pipeline(limit=None, folder_id=None):
         print("⚠️  No documents found in folder")
         return {"processed": 0, "authenticated": True}
     
-    # Process each file
+    # Already indexed files, fetched once for the whole run
+    known_ids = get_indexed_file_ids()
+    
+    # Process files in parallel (downloads and embedding calls overlap)
     success_count = 0
-    for file_info in tqdm(files, desc="Processing documents"):
-        if process_document(file_info):
-            success_count += 1
+    with ThreadPoolExecutor(max_workers=min(PIPELINE_MAX_WORKERS, len(files))) as executor:
+        futures = {executor.submit(process_document, file_info, known_ids): file_info for file_info in files}
+        for future in tqdm(as_completed(futures), total=len(files), desc="Processing documents"):
+            try:
+                if future.result():
+                    success_count += 1
+            except Exception as e:
+                print(f"❌ Error processing {futures[future]['name']}: {str(e)}")
     
     print(f"✅ Pipeline completed: {success_count}/{len(files)} documents processed")
     
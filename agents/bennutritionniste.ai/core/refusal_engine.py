@@ -2,10 +2,16 @@
 
 import re
 import json
+import threading
 from pathlib import Path
 from dataclasses import dataclass, asdict
 from enum import Enum
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
 
 
 class Decision(str, Enum):
@@ -51,6 +57,50 @@ def get_refusal_response(response_type: str, language: str = "fr") -> str:
 
 # Cache for loaded patterns
 _refusal_patterns_cache = None
+# Compiled once at load time: one OR-joined alternation per (language, category)
+# and the individual patterns, used only to report exact hits for the audit trail.
+_COMPILED_PATTERNS: Dict[str, Dict[str, re.Pattern]] = {}
+_NAMED_PATTERNS: Dict[str, Dict[str, List[Tuple[str, re.Pattern]]]] = {}
+# All categories of a language in one alternation: a single scan rules out the
+# common no-risk question before any per-category scan
+_LANGUAGE_ALTERNATIONS: Dict[str, re.Pattern] = {}
+# First rule of the decision cascade: a hit refuses whatever else matched, so
+# the remaining categories are not evaluated
+_EARLY_EXIT_CATEGORIES = ("medication",)
+# Optional Hyperscan database per language: all patterns of all categories in a
+# single DFA, ids index into _HS_PATTERN_IDS[lang] = [(category, pattern, compiled), ...]
+_HS_DATABASES: Dict[str, Any] = {}
+_HS_PATTERN_IDS: Dict[str, List[Tuple[str, str, re.Pattern]]] = {}
+# Scratch space is not shareable between concurrent scans
+_hs_local = threading.local()
+
+
+def _build_hyperscan_database(lang: str) -> None:
+    entries = [
+        (category, p, rx)
+        for category, named in _NAMED_PATTERNS[lang].items()
+        for p, rx in named
+    ]
+    if not entries:
+        return
+    # Hyperscan has no Unicode \b (needed for "médicament", "évite"...): compile in
+    # prefilter mode, which may over-match, and confirm each candidate with re.
+    flags = (hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_UTF8
+             | hyperscan.HS_FLAG_UCP | hyperscan.HS_FLAG_PREFILTER)
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[p.encode("utf-8") for _, p, _ in entries],
+            ids=list(range(len(entries))),
+            elements=len(entries),
+            flags=flags,
+        )
+    except Exception as e:
+        # Unsupported construct (e.g. backreference): keep the re alternations
+        print(f"[REFUSAL_ENGINE] Hyperscan unavailable for '{lang}', using re: {e}")
+        return
+    _HS_DATABASES[lang] = db
+    _HS_PATTERN_IDS[lang] = entries
 
 def load_refusal_patterns():
     """Load refusal patterns from JSON file"""
@@ -60,23 +110,102 @@ def load_refusal_patterns():
     
     try:
         with open(PROJECT_ROOT / 'knowledge-bases' / 'common' / 'refusal_patterns.json', 'r', encoding='utf-8') as f:
-            _refusal_patterns_cache = json.load(f)
-        return _refusal_patterns_cache
+            patterns = json.load(f)
     except Exception as e:
         raise Exception(f"Error loading refusal patterns: {e}")
 
+    for lang, categories in patterns.items():
+        _COMPILED_PATTERNS[lang] = {
+            category: re.compile("|".join(f"(?:{p})" for p in pats), re.IGNORECASE)
+            for category, pats in categories.items() if pats
+        }
+        _NAMED_PATTERNS[lang] = {
+            category: [(p, re.compile(p, re.IGNORECASE)) for p in pats]
+            for category, pats in categories.items() if pats
+        }
+        all_patterns = [p for pats in categories.values() for p in pats]
+        if all_patterns:
+            _LANGUAGE_ALTERNATIONS[lang] = re.compile("|".join(f"(?:{p})" for p in all_patterns), re.IGNORECASE)
+        if hyperscan is not None:
+            _build_hyperscan_database(lang)
+    _refusal_patterns_cache = patterns
+    return _refusal_patterns_cache
+
 def get_patterns_for_language(language: str = "fr") -> Dict[str, List[str]]:
     """Get patterns for a specific language"""
     all_patterns = load_refusal_patterns()
     return all_patterns.get(language, all_patterns.get("fr", {}))
 
+def get_compiled_patterns_for_language(language: str = "fr"):
+    """Get (alternation per category, [(pattern, compiled)] per category) for a language"""
+    load_refusal_patterns()
+    if language not in _COMPILED_PATTERNS:
+        language = "fr"
+    return _COMPILED_PATTERNS.get(language, {}), _NAMED_PATTERNS.get(language, {})
+
+
+def _match_patterns(text: str, alternation: re.Pattern, named: List[Tuple[str, re.Pattern]]) -> List[str]:
+    # Single scan for the whole category; the per-pattern loop only runs on a hit
+    if alternation.search(text) is None:
+        return []
+    return [pat for pat, rx in named if rx.search(text)]
+
+
+def _match_categories(text: str, language: str) -> Dict[str, List[str]]:
+    """Match all categories with the compiled alternations: {category: [patterns]}"""
+    alternations, named_patterns = get_compiled_patterns_for_language(language)
+    gate = _LANGUAGE_ALTERNATIONS.get(language if language in _COMPILED_PATTERNS else "fr")
+    if gate is None or gate.search(text) is None:
+        return {}
+    for category in _EARLY_EXIT_CATEGORIES:
+        if category in alternations:
+            hits = _match_patterns(text, alternations[category], named_patterns[category])
+            if hits:
+                return {category: hits}
+    matched: Dict[str, List[str]] = {}
+    for category, alternation in alternations.items():
+        if category in _EARLY_EXIT_CATEGORIES:
+            continue
+        hits = _match_patterns(text, alternation, named_patterns[category])
+        if hits:
+            matched[category] = hits
+    return matched
+
+
+def _scan_hyperscan(text: str, language: str) -> Optional[Dict[str, List[str]]]:
+    """Match all categories in one Hyperscan pass; None if no database for this language"""
+    load_refusal_patterns()
+    if language not in _HS_DATABASES:
+        language = "fr"
+    db = _HS_DATABASES.get(language)
+    if db is None:
+        return None
+    scratch = getattr(_hs_local, language, None)
+    if scratch is None:
+        scratch = hyperscan.Scratch(db)
+        setattr(_hs_local, language, scratch)
+
+    ids: List[int] = []
+    def on_match(pattern_id, start, end, flags, context):
+        ids.append(pattern_id)
+
+    db.scan(text.encode("utf-8", errors="replace"), match_event_handler=on_match, scratch=scratch)
+
+    # Confirm the early-exit categories first: a confirmed hit decides alone
+    entries = _HS_PATTERN_IDS[language]
+    ids.sort()
+    for category in _EARLY_EXIT_CATEGORIES:
+        hits = [entries[i][1] for i in ids if entries[i][0] == category and entries[i][2].search(text)]
+        if hits:
+            return {category: hits}
 
-def _match_patterns(text: str, patterns: List[str]) -> List[str]:
-    hits = []
-    for pat in patterns:
-        if re.search(pat, text, flags=re.IGNORECASE):
-            hits.append(pat)
-    return hits
+    # Hits arrive by end offset: sorted by id to keep the JSON category/pattern order
+    matched: Dict[str, List[str]] = {}
+    for pattern_id in ids:
+        category, pat, rx = entries[pattern_id]
+        if category not in _EARLY_EXIT_CATEGORIES and rx.search(text):
+            matched.setdefault(category, []).append(pat)
+    return matched
 
 
 def refusal_engine(question: str, language: str = "fr") -> RefusalResult:
@@ -91,14 +220,12 @@ def refusal_engine(question: str, language: str = "fr") -> RefusalResult:
     matched: Dict[str, List[str]] = {}
     reasons: List[str] = []
 
-    # Get patterns for the specified language
-    patterns = get_patterns_for_language(language)
-
-    # Evaluate categories
-    for category, pats in patterns.items():
-        hits = _match_patterns(combined, pats)
-        if hits:
-            matched[category] = hits
+    # Evaluate categories: one Hyperscan pass when available, else compiled alternations
+    hs_matched = _scan_hyperscan(combined, language) if hyperscan is not None else None
+    if hs_matched is not None:
+        matched = hs_matched
+    else:
+        matched = _match_categories(combined, language)
     
     if matched:
         print(f"[REFUSAL_ENGINE] Matched categories: {list(matched.keys())}")
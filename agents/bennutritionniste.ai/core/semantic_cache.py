@@ -0,0 +1,74 @@
+# =====================================================
+# Semantic Cache - Cache sémantique des réponses
+# Réutilise la réponse d'une question quasi identique déjà posée
+# =====================================================
+
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    In-memory cache of (question embedding -> answer) pairs.
+
+    Lookups compare the query embedding against every cached embedding
+    (cosine similarity, one matrix-vector product) and return the best
+    entry above `threshold`. Embeddings are stored as int8 with one float32
+    scale per row (4x smaller than float32). The cache is a
+    fixed-size ring buffer: once `capacity` is reached the oldest entry is
+    overwritten.
+    """
+
+    def __init__(self, dim: int, capacity: int = 1000, threshold: float = 0.95, ttl: float = 24 * 3600):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._vectors = np.zeros((capacity, dim), dtype=np.int8)
+        self._scales = np.zeros(capacity, dtype=np.float32)
+        self._entries = [None] * capacity  # (namespace, answer, payload, timestamp)
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, namespace: str = ""):
+        """
+        Return (answer, payload) for the most similar cached question in
+        `namespace`, or None if nothing is above the similarity threshold.
+        """
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            if not self._size:
+                return None
+            scores = (self._vectors[:self._size] @ query) * self._scales[:self._size]
+            candidates = np.flatnonzero(scores >= self.threshold)
+            for idx in candidates[np.argsort(-scores[candidates])]:
+                entry_namespace, answer, payload, timestamp = self._entries[idx]
+                if entry_namespace == namespace and now - timestamp <= self.ttl:
+                    return answer, payload
+        return None
+
+    def add(self, embedding, answer: str, payload=None, namespace: str = ""):
+        """Store an answer (and optional payload, e.g. PMIDs) for a question embedding."""
+        vector = self._normalize(embedding)
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        with self._lock:
+            self._vectors[self._next] = np.rint(vector / scale)
+            self._scales[self._next] = scale
+            self._entries[self._next] = (namespace, answer, payload, time.time())
+            self._next = (self._next + 1) % len(self._entries)
+            self._size = min(self._size + 1, len(self._entries))
+
+    def clear(self):
+        """Forget every cached answer (e.g. after the collection has been re-indexed)."""
+        with self._lock:
+            self._entries = [None] * len(self._entries)
+            self._next = 0
+            self._size = 0
@@ -0,0 +1,118 @@
+# =====================================================
+# Session Store - Persistance des sessions de conversation
+# Sauvegarde optionnelle dans Redis (activée si REDIS_URL est défini), qui est
+# alors la référence partagée par tous les workers (client asynchrone)
+# =====================================================
+
+import os
+import json
+from datetime import datetime
+from pathlib import Path
+from dotenv import load_dotenv
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+PROJECT_ROOT = Path(__file__).parent.parent
+load_dotenv(dotenv_path=PROJECT_ROOT / '.env')
+
+SESSION_KEY_PREFIX = "sess:"
+TTS_KEY_PREFIX = "tts:"
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+redis_client = aioredis.from_url(REDIS_URL) if aioredis is not None and REDIS_URL else None
+
+
+def is_enabled() -> bool:
+    """Return True when sessions are persisted to Redis."""
+    return redis_client is not None
+
+
+async def save_session(session_id: str, session: dict, ttl) -> None:
+    """
+    Persist the serializable part of a session (history, PMIDs, refusals)
+    with an expiration of `ttl` (timedelta). TTS audio is stored separately
+    (save_tts_audio).
+    """
+    if redis_client is None:
+        return
+    data = {
+        "messages": session.get("messages", []),
+        "created_at": session["created_at"].isoformat(),
+        "last_activity": session["last_activity"].isoformat(),
+        "pmids": dict(session.get("pmids", {})),
+        "refusals": list(session.get("refusals", ())),
+    }
+    try:
+        await redis_client.set(
+            SESSION_KEY_PREFIX + session_id,
+            json.dumps(data, ensure_ascii=False),
+            ex=int(ttl.total_seconds())
+        )
+    except Exception as e:
+        print(f"Error saving session to Redis: {e}")
+
+
+async def load_session(session_id: str):
+    """
+    Load a session persisted by save_session, or None if unknown/expired.
+    Redis errors are raised so callers can fall back to their local copy.
+    """
+    if redis_client is None:
+        return None
+    raw = await redis_client.get(SESSION_KEY_PREFIX + session_id)
+    if raw is None:
+        return None
+    data = json.loads(raw)
+    return {
+        "messages": data.get("messages", []),
+        "created_at": datetime.fromisoformat(data["created_at"]),
+        "last_activity": datetime.fromisoformat(data["last_activity"]),
+        "pmids": data.get("pmids", {}),
+        "refusals": set(data.get("refusals", [])),
+    }
+
+
+async def delete_session(session_id: str) -> None:
+    """Remove a persisted session."""
+    if redis_client is None:
+        return
+    try:
+        await redis_client.delete(SESSION_KEY_PREFIX + session_id)
+    except Exception as e:
+        print(f"Error deleting session from Redis: {e}")
+
+
+async def save_tts_audio(session_id: str, question_id: str, audio_bytes: bytes, ttl) -> bool:
+    """
+    Store the TTS audio of an answer so /api/tts_result can serve it from any
+    worker. Empty bytes mean the generation failed. Returns False on error.
+    """
+    if redis_client is None:
+        return False
+    try:
+        await redis_client.set(
+            f"{TTS_KEY_PREFIX}{session_id}:{question_id}",
+            audio_bytes,
+            ex=int(ttl.total_seconds())
+        )
+        return True
+    except Exception as e:
+        print(f"Error saving TTS audio to Redis: {e}")
+        return False
+
+
+async def pop_tts_audio(session_id: str, question_id: str):
+    """Fetch and remove a stored TTS audio, or None if not ready (or on error)."""
+    if redis_client is None:
+        return None
+    key = f"{TTS_KEY_PREFIX}{session_id}:{question_id}"
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            audio_bytes, _ = await pipe.get(key).delete(key).execute()
+        return audio_bytes
+    except Exception as e:
+        print(f"Error loading TTS audio from Redis: {e}")
+        return None
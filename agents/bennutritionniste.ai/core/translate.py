@@ -3,17 +3,15 @@
 # Utilise OpenAI Whisper pour audio et GPT pour texte
 # =====================================================
 
-import os
-import tempfile
+import asyncio
+import mimetypes
 from pathlib import Path
-from openai import OpenAI
 from dotenv import load_dotenv
+from core.openai_client import client, aclient
 
 PROJECT_ROOT = Path(__file__).parent.parent
 load_dotenv(dotenv_path=PROJECT_ROOT / '.env')
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 # Supported translation languages
 SUPPORTED_LANGUAGES = {
     "fr": "French",
@@ -90,6 +88,12 @@ def translate_text_stream(text: str, target_language: str, source_language: str
             yield chunk.choices[0].delta.content
 
 
+def _audio_file(audio_bytes: bytes, filename: str) -> tuple:
+    """(filename, bytes, content type) upload for the Whisper API, which detects the format from the filename."""
+    name = filename if Path(filename).suffix else "audio.webm"
+    return name, audio_bytes, mimetypes.guess_type(name)[0] or "audio/webm"
+
+
 def transcribe_audio_whisper(audio_bytes: bytes, filename: str = "audio.webm", language: str = None) -> str:
     """
     Transcribe audio using OpenAI Whisper API.
@@ -102,25 +106,17 @@ def transcribe_audio_whisper(audio_bytes: bytes, filename: str = "audio.webm", l
     Returns:
         str: Transcribed text
     """
-    suffix = Path(filename).suffix or ".webm"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
-
-    try:
-        with open(tmp_path, "rb") as audio_file:
-            params = {
-                "model": "whisper-1",
-                "file": audio_file,
-                "response_format": "text"
-            }
-            if language:
-                params["language"] = language
-            
-            transcript = client.audio.transcriptions.create(**params)
-        return transcript.strip()
-    finally:
-        os.unlink(tmp_path)
+    audio_file = _audio_file(audio_bytes, filename)
+    params = {
+        "model": "whisper-1",
+        "file": audio_file,
+        "response_format": "text"
+    }
+    if language:
+        params["language"] = language
+
+    transcript = client.audio.transcriptions.create(**params)
+    return transcript.strip()
 
 
 def translate_audio_whisper(audio_bytes: bytes, filename: str = "audio.webm") -> str:
@@ -135,21 +131,42 @@ def translate_audio_whisper(audio_bytes: bytes, filename: str = "audio.webm") ->
     Returns:
         str: Translated English text
     """
-    suffix = Path(filename).suffix or ".webm"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
-
-    try:
-        with open(tmp_path, "rb") as audio_file:
-            translation = client.audio.translations.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="text"
-            )
-        return translation.strip()
-    finally:
-        os.unlink(tmp_path)
+    translation = client.audio.translations.create(
+        model="whisper-1",
+        file=_audio_file(audio_bytes, filename),
+        response_format="text"
+    )
+    return translation.strip()
+
+
+async def translate_audio_whisper_async(audio_bytes: bytes, filename: str = "audio.webm") -> str:
+    """Async version of translate_audio_whisper (does not block the event loop)."""
+    translation = await aclient.audio.translations.create(
+        model="whisper-1",
+        file=_audio_file(audio_bytes, filename),
+        response_format="text"
+    )
+    return translation.strip()
+
+
+async def translate_audio_whisper_batch(items, max_concurrency: int = 5) -> list:
+    """
+    Translate several audios to English concurrently.
+
+    Args:
+        items: List of (audio_bytes, filename) pairs
+        max_concurrency: Maximum number of Whisper requests in flight
+
+    Returns:
+        list: Translated English texts, in the order of items
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _translate_one(audio_bytes, filename):
+        async with semaphore:
+            return await translate_audio_whisper_async(audio_bytes, filename)
+
+    return await asyncio.gather(*(_translate_one(audio_bytes, filename) for audio_bytes, filename in items))
 
 
 def get_supported_languages() -> dict:
@@ -1,49 +1,100 @@
 import os
-from docx import Document
+import zipfile
+from multiprocessing import Pool
+from lxml import etree
 from pathlib import Path
 
 # Get project root directory
 PROJECT_ROOT = Path(__file__).parent.parent
 
+# WordprocessingML namespace of word/document.xml
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Markup compatibility namespace: Word writes text boxes twice, in mc:Choice
+# and again in mc:Fallback (for older readers); only the first copy is read
+MC_NS = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+
+def iter_docx_paragraphs(docx_path):
+    """
+    Yield the non-empty paragraphs of a Word document, streamed from its XML
+    (body, table cells and text boxes). A paragraph nested in another one (text
+    box) is yielded on its own, before the paragraph that contains it.
+    """
+    with zipfile.ZipFile(docx_path) as archive, archive.open("word/document.xml") as xml:
+        parts_stack = []  # text parts of each open w:p, innermost last
+        fallback_depth = 0
+        tags = (W_NS + "t", W_NS + "tab", W_NS + "br", W_NS + "p", MC_NS + "Fallback")
+        for event, element in etree.iterparse(xml, events=("start", "end"), tag=tags):
+            if element.tag == MC_NS + "Fallback":
+                fallback_depth += 1 if event == "start" else -1
+            elif fallback_depth:
+                continue
+            elif event == "start":
+                if element.tag == W_NS + "p":
+                    parts_stack.append([])
+            elif element.tag == W_NS + "t":
+                if parts_stack:
+                    parts_stack[-1].append(element.text or "")
+            elif element.tag == W_NS + "p":
+                text = "".join(parts_stack.pop())
+                if text.strip():
+                    yield text
+                if not parts_stack:
+                    # Drop the parsed paragraph (and the ones before it) to keep memory flat
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+            elif parts_stack and element.getparent().tag == W_NS + "r":  # tab/break in a run (not a tab stop)
+                parts_stack[-1].append("\t" if element.tag == W_NS + "tab" else "\n")
+
 def extract_text_from_docx(docx_path):
     """Extract text from a Word document"""
-    doc = Document(docx_path)
-    full_text = []
-    for para in doc.paragraphs:
-        if para.text.strip():
-            full_text.append(para.text)
-    return '\n'.join(full_text)
+    return '\n'.join(iter_docx_paragraphs(docx_path))
+
+def _extract_one(args):
+    """Extract one .docx to .txt (runs in a worker process); returns the log line"""
+    folder_path, output_folder, filename = args
+    file_path = os.path.join(folder_path, filename)
+    # Save as txt file, paragraphs written as they are parsed
+    txt_filename = os.path.splitext(filename)[0] + ".txt"
+    txt_path = os.path.join(output_folder, txt_filename)
+    try:
+        characters = 0
+        with open(txt_path, 'w', encoding='utf-8') as f:
+            for paragraph in iter_docx_paragraphs(file_path):
+                if characters:
+                    f.write('\n')
+                    characters += 1
+                f.write(paragraph)
+                characters += len(paragraph)
+        
+        if not characters:
+            os.remove(txt_path)
+            return f"  ⚠️ No text found"
+        
+        return f"  ✅ Saved to {txt_filename} ({characters} characters)"
+        
+    except Exception as e:
+        if os.path.exists(txt_path):
+            os.remove(txt_path)
+        return f"  ❌ Error: {str(e)}"
 
 def extract_all_documents(folder_path, output_folder=str(PROJECT_ROOT / "transcripts")):
-    """Extract text from all .docx files and save as .txt"""
+    """Extract text from all .docx files and save as .txt (one worker process per core)"""
     os.makedirs(output_folder, exist_ok=True)
     
     docx_files = [f for f in os.listdir(folder_path) if f.endswith('.docx') and not f.startswith('~$')]
     
     print(f"Found {len(docx_files)} documents\n")
+    if not docx_files:
+        return
     
-    for filename in docx_files:
-        file_path = os.path.join(folder_path, filename)
-        print(f"Processing: {filename}")
-        
-        try:
-            text = extract_text_from_docx(file_path)
-            
-            if not text.strip():
-                print(f"  ⚠️ No text found")
-                continue
-            
-            # Save as txt file
-            txt_filename = os.path.splitext(filename)[0] + ".txt"
-            txt_path = os.path.join(output_folder, txt_filename)
-            
-            with open(txt_path, 'w', encoding='utf-8') as f:
-                f.write(text)
-            
-            print(f"  ✅ Saved to {txt_filename} ({len(text)} characters)")
-            
-        except Exception as e:
-            print(f"  ❌ Error: {str(e)}")
+    # Parsing .docx is CPU-bound: spread the files over the cores
+    workers = max(1, min(len(docx_files), (os.cpu_count() or 2) - 1))
+    with Pool(workers) as pool:
+        tasks = [(folder_path, output_folder, filename) for filename in docx_files]
+        for filename, status in zip(docx_files, pool.imap(_extract_one, tasks)):
+            print(f"Processing: {filename}")
+            print(status)
 
 if __name__ == "__main__":
     transcript_folder = r"documents\AI - Ben Nutritionniste"
@@ -1,10 +1,20 @@
 import os
-import json
+import hashlib
+import sqlite3
+import orjson
 from dotenv import load_dotenv
 from google.cloud import aiplatform
 from google.cloud.aiplatform import MatchingEngineIndex, MatchingEngineIndexEndpoint
+import httpx
+import numpy as np
 from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 
 # Get project root directory
@@ -14,7 +24,39 @@ env_path = PROJECT_ROOT / '.env'
 load_dotenv(dotenv_path=env_path, override=True)
 
 # Initialize clients
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# The SDK retries 429/5xx with exponential backoff, honouring Retry-After; the
+# concurrent embedding batches share one pool of HTTP/2 keep-alive connections
+client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=5,
+    http_client=httpx.Client(
+        http2=True,
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+    )
+)
+
+# Embedding model (must match core/query_chromadb.py)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+# Texts sent per embeddings request; chunks of all files are batched together
+EMBEDDING_BATCH_SIZE = 256
+# Embeddings requests in flight at once
+EMBEDDING_CONCURRENCY = int(os.getenv("OPENAI_EMBED_CONCURRENCY", "8"))
+# Local cache of chunk embeddings (content hash -> float32 vector): re-indexing
+# only embeds new or modified chunks
+EMBEDDING_CACHE_PATH = str(PROJECT_ROOT / "embed_cache.db")
+# Keys per SELECT ... IN (...) lookup (SQLite bound-parameter limit)
+EMBEDDING_CACHE_LOOKUP_SIZE = 500
+
+# Text chunking: by tokens at paragraph/sentence boundaries when tiktoken is
+# available, else by characters
+CHUNK_TOKENS = 300
+CHUNK_OVERLAP_TOKENS = 20
+MIN_CHUNK_TOKENS = 100
+CHUNK_SEPARATORS = ("\n\n", "\n", ". ", " ")
+_token_encoding = None
+_token_encoding_failed = False
 
 # Vertex AI configuration
 PROJECT_ID = os.getenv("GCP_PROJECT_ID")
@@ -22,30 +64,137 @@ REGION = os.getenv("GCP_REGION", "us-east4")
 INDEX_DISPLAY_NAME = os.getenv("VERTEX_INDEX_NAME")
 ENDPOINT_DISPLAY_NAME = os.getenv("VERTEX_ENDPOINT_NAME")
 DEPLOYED_INDEX_ID = os.getenv("VERTEX_DEPLOYED_INDEX_ID")
+# Embeddings per JSONL file saved to GCS, and files uploaded at once
+GCS_BATCH_SIZE = 1000
+GCS_UPLOAD_CONCURRENCY = 16
 
 # Initialize Vertex AI
 aiplatform.init(project=PROJECT_ID, location=REGION)
 
 
-def get_embeddings(texts):
-    """Get embeddings from OpenAI"""
+def _embed_batch(texts):
+    resp = client.embeddings.create(model=EMBEDDING_MODEL, input=texts, dimensions=EMBEDDING_DIMENSIONS)
+    return np.asarray([e.embedding for e in resp.data], dtype=np.float32)
+
+def open_embedding_cache():
+    """Open (and create if needed) the local SQLite embedding cache"""
+    cache = sqlite3.connect(EMBEDDING_CACHE_PATH)
+    cache.execute("PRAGMA journal_mode=WAL")
+    cache.execute("PRAGMA synchronous=NORMAL")
+    cache.execute("CREATE TABLE IF NOT EXISTS emb(hash BLOB PRIMARY KEY, vec BLOB)")
+    return cache
+
+def embedding_cache_key(text):
+    """Cache key of a chunk: hash of its text and of the embedding model settings"""
+    return hashlib.blake2b(f"{EMBEDDING_MODEL}\0{EMBEDDING_DIMENSIONS}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+def get_embeddings(texts, batch_size=None):
+    """
+    Get embeddings as a float32 matrix, one row per text (input order kept).
+    Texts found in the local cache are not sent again; the others are
+    requested from OpenAI by concurrent batches and added to the cache.
+    """
     if isinstance(texts, str):
         texts = [texts]
-    resp = client.embeddings.create(model="text-embedding-3-large", input=texts)
-    return [e.embedding for e in resp.data]
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    keys = [embedding_cache_key(text) for text in texts]
+    embeddings = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    with closing(open_embedding_cache()) as cache:
+        cached = {}
+        for start in range(0, len(keys), EMBEDDING_CACHE_LOOKUP_SIZE):
+            lookup = keys[start:start + EMBEDDING_CACHE_LOOKUP_SIZE]
+            placeholders = ",".join("?" * len(lookup))
+            cached.update(cache.execute(f"SELECT hash, vec FROM emb WHERE hash IN ({placeholders})", lookup))
+        missing = []
+        for row, key in enumerate(keys):
+            if key in cached:
+                embeddings[row] = np.frombuffer(cached[key], dtype=np.float32)
+            else:
+                missing.append(row)
+        
+        starts = range(0, len(missing), batch_size)
+        batches = ([texts[row] for row in missing[start:start + batch_size]] for start in starts)
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as pool:
+            for start, batch in zip(starts, pool.map(_embed_batch, batches)):
+                rows = missing[start:start + len(batch)]
+                embeddings[rows] = batch
+                # Saved batch by batch so an interrupted run keeps what it paid for
+                with cache:
+                    cache.executemany("INSERT OR REPLACE INTO emb(hash, vec) VALUES (?, ?)",
+                                      [(keys[row], embeddings[row].tobytes()) for row in rows])
+    return embeddings
 
 
 def chunk_text(text, chunk_size=500, overlap=50):
     """Split text into overlapping chunks"""
-    chunks = []
+    windows = (text[start:start + chunk_size] for start in range(0, len(text), chunk_size - overlap))
+    return [chunk for chunk in windows if chunk.strip()]
+
+def get_token_encoding():
+    """Tokenizer of the embedding model, loaded on first use (None if tiktoken or its data is unavailable)"""
+    global _token_encoding, _token_encoding_failed
+    if _token_encoding is None and tiktoken is not None and not _token_encoding_failed:
+        try:
+            _token_encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+        except KeyError:
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"⚠️  tiktoken encoding unavailable, using character chunks: {str(e)}")
+            _token_encoding_failed = True
+    return _token_encoding
+
+def _split_on_separators(text, token_encoding, max_tokens, separators):
+    """Cut text at the coarsest separator giving pieces of at most max_tokens: [(piece, n_tokens)]"""
+    tokens = token_encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return [(text, len(tokens))]
+    if not separators:
+        return [(token_encoding.decode(tokens[i:i + max_tokens]), len(tokens[i:i + max_tokens]))
+                for i in range(0, len(tokens), max_tokens)]
+    separator, finer = separators[0], separators[1:]
+    parts = text.split(separator)
+    pieces = []
+    for i, part in enumerate(parts):
+        if i < len(parts) - 1:
+            part += separator
+        if part:
+            pieces.extend(_split_on_separators(part, token_encoding, max_tokens, finer))
+    return pieces
+
+def chunk_text_tokens(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, min_tokens=MIN_CHUNK_TOKENS):
+    """
+    Split text into chunks of at most max_tokens tokens, cutting at paragraph,
+    line, sentence then word boundaries. Consecutive pieces are packed up to
+    max_tokens, each chunk repeats up to overlap_tokens of the previous one,
+    and a last chunk under min_tokens is merged into the previous chunk.
+    """
+    pieces = _split_on_separators(text, get_token_encoding(), max_tokens, CHUNK_SEPARATORS)
+    spans = []  # (first, last + 1) piece indices of each chunk
     start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        if chunk.strip():
-            chunks.append(chunk)
-        start = end - overlap
-    return chunks
+    size = 0
+    for end, (_, n_tokens) in enumerate(pieces):
+        if end > start and size + n_tokens > max_tokens:
+            spans.append((start, end))
+            # The next chunk starts with the tail of this one
+            while start < end and (size > overlap_tokens or size + n_tokens > max_tokens):
+                size -= pieces[start][1]
+                start += 1
+        size += n_tokens
+    if pieces:
+        spans.append((start, len(pieces)))
+    if len(spans) > 1 and sum(n for _, n in pieces[spans[-1][0]:]) < min_tokens:
+        _, last_end = spans.pop()
+        spans[-1] = (spans[-1][0], last_end)
+    chunks = ("".join(piece for piece, _ in pieces[first:last]) for first, last in spans)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def load_chunks(file_path):
+    """Read a text file and split it into chunks: (text, chunks)"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if get_token_encoding() is not None:
+        return text, chunk_text_tokens(text)
+    return text, chunk_text(text, chunk_size=500, overlap=50)
 
 
 def create_index():
@@ -54,7 +203,7 @@ def create_index():
         # Create index configuration
         index = aiplatform.MatchingEngineIndex.create_tree_ah_index(
             display_name=INDEX_DISPLAY_NAME,
-            dimensions=3072,  # text-embedding-3-large dimension
+            dimensions=EMBEDDING_DIMENSIONS,
             approximate_neighbors_count=10,
             distance_measure_type="DOT_PRODUCT_DISTANCE",
             description="Vector index for Ben Nutritionniste transcripts",
@@ -104,15 +253,17 @@ def prepare_embeddings_for_vertex(folder_path=str(PROJECT_ROOT / "transcripts"))
     print(f"Found {len(txt_files)} documents to process\n")
     
     embeddings_data = []
+    chunk_texts = []
     
-    for filename in txt_files:
-        file_path = os.path.join(folder_path, filename)
+    # Read and chunk the files in parallel, then handle them in listing order
+    with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, 16)) as pool:
+        loaded = [pool.submit(load_chunks, os.path.join(folder_path, f)) for f in txt_files]
+    
+    for filename, future in zip(txt_files, loaded):
         print(f"Processing: {filename}")
         
         try:
-            # Read text file
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
+            text, chunks = future.result()
             
             if not text.strip():
                 print(f"  ⚠️ No text found in {filename}")
@@ -120,19 +271,14 @@ def prepare_embeddings_for_vertex(folder_path=str(PROJECT_ROOT / "transcripts"))
             
             print(f"  Extracted {len(text)} characters")
             
-            # Split into chunks
-            chunks = chunk_text(text, chunk_size=500, overlap=50)
             print(f"  Created {len(chunks)} chunks")
             
-            # Get embeddings for chunks
-            embeddings = get_embeddings(chunks)
-            
-            # Prepare data in Vertex AI format
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            # Prepare data in Vertex AI format (embedded below, together with the other files)
+            for i, chunk in enumerate(chunks):
                 doc_id = f"{filename}_chunk{i}"
+                chunk_texts.append(chunk)
                 embeddings_data.append({
                     "id": doc_id,
-                    "embedding": embedding,
                     "restricts": [{
                         "namespace": "source",
                         "allow_list": [filename]
@@ -145,9 +291,30 @@ def prepare_embeddings_for_vertex(folder_path=str(PROJECT_ROOT / "transcripts"))
         except Exception as e:
             print(f"  ❌ Error processing {filename}: {str(e)}")
     
+    if chunk_texts:
+        print(f"\nEmbedding {len(chunk_texts)} chunks...")
+        try:
+            embeddings = get_embeddings(chunk_texts)
+        except Exception as e:
+            print(f"❌ Error getting embeddings: {str(e)}")
+            return None
+        for item, embedding in zip(embeddings_data, embeddings):
+            item["embedding"] = embedding
+    
     return embeddings_data
 
 
+def upload_embeddings_batch(bucket, blob_name, batch):
+    """Upload one batch of embeddings to GCS as a JSONL file"""
+    # Create JSONL content (one JSON per line, float32 rows serialized as-is)
+    jsonl_content = b"\n".join(orjson.dumps({
+        "id": item["id"],
+        "embedding": item["embedding"]
+    }, option=orjson.OPT_SERIALIZE_NUMPY) for item in batch)
+    bucket.blob(blob_name).upload_from_string(jsonl_content, content_type='application/json')
+    return len(batch)
+
+
 def save_embeddings_to_gcs(embeddings_data, bucket_name, directory="embeddings"):
     """Save embeddings to Google Cloud Storage in batches"""
     try:
@@ -156,26 +323,15 @@ def save_embeddings_to_gcs(embeddings_data, bucket_name, directory="embeddings")
         storage_client = storage.Client(project=PROJECT_ID)
         bucket = storage_client.bucket(bucket_name)
         
-        # Split embeddings into batches and save as separate files
-        batch_size = 100
-        batch_count = 0
-        
-        for i in range(0, len(embeddings_data), batch_size):
-            batch = embeddings_data[i:i + batch_size]
-            
-            # Create JSONL content (one JSON per line)
-            jsonl_content = "\n".join([json.dumps({
-                "id": item["id"],
-                "embedding": item["embedding"]
-            }) for item in batch])
-            
-            # Upload batch file
-            blob_name = f"{directory}/batch_{batch_count:04d}.json"
-            blob = bucket.blob(blob_name)
-            blob.upload_from_string(jsonl_content, content_type='application/json')
-            batch_count += 1
-            
-            print(f"  Uploaded batch {batch_count} ({len(batch)} embeddings)")
+        # Split embeddings into batches saved as separate files, uploaded concurrently
+        with ThreadPoolExecutor(max_workers=GCS_UPLOAD_CONCURRENCY) as pool:
+            uploads = [
+                pool.submit(upload_embeddings_batch, bucket, f"{directory}/batch_{batch_count:04d}.json",
+                            embeddings_data[i:i + GCS_BATCH_SIZE])
+                for batch_count, i in enumerate(range(0, len(embeddings_data), GCS_BATCH_SIZE))
+            ]
+            for batch_count, upload in enumerate(uploads, 1):
+                print(f"  Uploaded batch {batch_count} ({upload.result()} embeddings)")
         
         gcs_uri = f"gs://{bucket_name}/{directory}"
         print(f"✅ All embeddings saved to: {gcs_uri}")
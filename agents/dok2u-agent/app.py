@@ -4,23 +4,46 @@
 # =====================================================
 from logging import config
 from fastapi import FastAPI, Body, Query, Request, UploadFile, File, Form
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from core.query_chromadb import ask_question_stream, get_collection, get_pmids_from_contexts, is_substantial_question, client
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+try:
+    from sse_starlette.sse import EventSourceResponse
+except ImportError:
+    EventSourceResponse = None
+from core.query_chromadb import ask_question_stream_async, get_collection, get_pmids_batch, clear_pmids_cache, is_substantial_question, client
+from core.micro_batcher import MicroBatcher
 from core.pipeline_gdrive import run_pipeline
-from core.translate import translate_text_stream, transcribe_audio_whisper, translate_audio_whisper, get_supported_languages
+from core.translate import translate_text_stream, transcribe_audio_whisper, translate_audio_whisper_async, get_supported_languages
 from dotenv import load_dotenv
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Set
+from collections import OrderedDict
+from contextlib import contextmanager
 import json
+import re
+import orjson
 import uuid
 from datetime import datetime, timedelta
+import itertools
 import threading
+import queue
+import time
+import atexit
+import asyncio
 import os
 
+try:
+    import fcntl  # verrous flock inter-processus (POSIX uniquement)
+except ImportError:
+    fcntl = None
+
  # Chargement des variables d'environnement depuis le bon emplacement
 # =====================================================
 # Configuration & Constantes
@@ -53,17 +76,122 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory=str(PROJECT_ROOT / "static")), name="static")
 templates = Jinja2Templates(directory=str(PROJECT_ROOT / "templates"))
 
-conversation_sessions: Dict[str, Dict] = {}
+# Sessions ordonnées par dernière activité (la plus ancienne en tête)
+conversation_sessions: "OrderedDict[str, Dict]" = OrderedDict()
 SESSION_TIMEOUT = timedelta(hours=2)
+SESSION_CLEANUP_INTERVAL = timedelta(seconds=30)
+_last_session_cleanup = datetime.min
+SSE_PING_INTERVAL = 15  # secondes entre deux keep-alive SSE
+# En-têtes des réponses SSE (désactive la mise en cache et le buffering des proxys)
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Connection": "keep-alive",
+}
+SSE_COALESCE_MIN_CHARS = 32  # taille minimale d'un chunk SSE regroupé
+SSE_COALESCE_MAX_DELAY = 0.02  # secondes d'attente maximale avant envoi d'un chunk partiel
+
+# Les requêtes /api/pmids concurrentes (fenêtre de 20 ms) partagent un appel
+# d'embedding et une requête ChromaDB
+pmids_batcher = MicroBatcher(get_pmids_batch, window=0.02, max_batch=32)
+PMIDS_BATCH_TIMEOUT = 30.0  # secondes d'attente maximale d'un lot /api/pmids
+
 
+# Configurations des agents servies par /api/get_config : lues une fois au démarrage
+AGENT_CONFIG_PATHS = {
+    "main": PROJECT_ROOT / "knowledge-bases" / "common" / "config.json",
+    "nutria": PROJECT_ROOT / "knowledge-bases" / "nutria" / "config.json",
+    "translator": PROJECT_ROOT / "knowledge-bases" / "translator" / "config.json",
+}
+_AGENT_CONFIG_BYTES: Dict[str, bytes] = {}
+for _agent, _path in AGENT_CONFIG_PATHS.items():
+    try:
+        _AGENT_CONFIG_BYTES[_agent] = _path.read_bytes()
+    except FileNotFoundError:
+        print(f"Config not found: {_path}")
 
-QUESTION_LOG_PATH = PROJECT_ROOT / "question_log.json"
-question_log_lock = threading.Lock()
+
+# Journal append-only (JSON Lines) : une ligne par question, plus des lignes "patch"
+# pour les commentaires et votes, repliées à la lecture par fold_question_log().
+# Les écritures sont faites par lots par un thread d'arrière-plan (_log_writer_worker)
+# via un descripteur O_APPEND ; entre processus (plusieurs workers uvicorn), les
+# ajouts prennent un flock partagé sur QUESTION_LOG_LOCK_PATH et seule la compaction
+# le prend en exclusif.
+QUESTION_LOG_PATH = PROJECT_ROOT / "question_log.jsonl"
+QUESTION_LOG_LOCK_PATH = PROJECT_ROOT / "question_log.jsonl.lock"
+LEGACY_QUESTION_LOG_PATH = PROJECT_ROOT / "question_log.json"
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 0.2  # secondes
+LOG_COMPACT_THRESHOLD = 500  # nombre de patches avant réécriture compacte du journal
+_log_fd: Optional[int] = None  # descripteur O_APPEND du journal (thread d'écriture)
+_log_lock_fd: Optional[int] = None  # descripteur du fichier de verrou flock
+_log_queue = queue.SimpleQueue()
+_question_ids: Set[str] = set()  # questions connues de ce worker (journal lu + questions en file)
+_question_scan_offset = 0  # position lue dans le journal, écritures des autres workers comprises
+_question_scan_inode: Optional[int] = None
+_question_scan_lock = threading.Lock()
+_log_patch_count = 0  # patches écrits depuis la dernière compaction
+# Journal replié en mémoire, mis à jour à partir de la dernière position lue
+_folded_entries: Dict[str, Dict] = {}
+_folded_offset = 0
+_folded_inode: Optional[int] = None
+_folded_lock = threading.Lock()
 
 ######################################################
 # Fonctions utilitaires
 ######################################################
 
+def _new_id():
+    """Identifiant court (24 caractères hex) pour les question_id, moins coûteux que str(uuid.uuid4())."""
+    return os.urandom(12).hex()
+
+
+# Phrases suggérant de consulter un professionnel (réponse sans PMIDs)
+_DISCLAIMER_PATTERNS = (
+    # Patterns français
+    'consulter un professionnel',
+    'consulte un professionnel',
+    'consultez un professionnel',
+    'consulter votre médecin',
+    'consultez votre médecin',
+    'parler à un médecin',
+    'parlez à un médecin',
+    'voir un médecin',
+    'voyez un médecin',
+    'demander conseil à un professionnel',
+    'demandez conseil à un professionnel',
+    'avis médical',
+    'consultation médicale',
+    'professionnel de santé',
+    'professionnel de la santé',
+    'nutritionniste',
+    'diététicien',
+    # Patterns anglais
+    'consult a professional',
+    'consult your doctor',
+    'see a doctor',
+    'talk to a doctor',
+    'speak to a doctor',
+    'seek medical advice',
+    'medical consultation',
+    'health professional',
+    'healthcare professional',
+    'nutritionist',
+    'dietitian',
+)
+
+# Automate Aho-Corasick : un seul passage sur la réponse, quel que soit le nombre de phrases.
+# Sans pyahocorasick, une alternation regex compilée (un seul passage également).
+if ahocorasick is not None:
+    _DISCLAIMER_AC = ahocorasick.Automaton()
+    for _pattern in _DISCLAIMER_PATTERNS:
+        _DISCLAIMER_AC.add_word(_pattern, _pattern)
+    _DISCLAIMER_AC.make_automaton()
+else:
+    _DISCLAIMER_AC = None
+_DISCLAIMER_RE = re.compile("|".join(map(re.escape, _DISCLAIMER_PATTERNS)))
+
+
 def contains_medical_disclaimer(response_text):
     """
     Détecte si la réponse contient des phrases suggérant de consulter un professionnel.
@@ -71,58 +199,230 @@ def contains_medical_disclaimer(response_text):
     """
     if not response_text:
         return False
-    
     response_lower = response_text.lower()
-    
-    # Patterns français
-    french_patterns = [
-        'consulter un professionnel',
-        'consulte un professionnel',
-        'consultez un professionnel',
-        'consulter votre médecin',
-        'consultez votre médecin',
-        'parler à un médecin',
-        'parlez à un médecin',
-        'voir un médecin',
-        'voyez un médecin',
-        'demander conseil à un professionnel',
-        'demandez conseil à un professionnel',
-        'avis médical',
-        'consultation médicale',
-        'professionnel de santé',
-        'professionnel de la santé',
-        'nutritionniste',
-        'diététicien',
-    ]
-    
-    # Patterns anglais
-    english_patterns = [
-        'consult a professional',
-        'consult your doctor',
-        'see a doctor',
-        'talk to a doctor',
-        'speak to a doctor',
-        'seek medical advice',
-        'medical consultation',
-        'health professional',
-        'healthcare professional',
-        'nutritionist',
-        'dietitian',
-    ]
-    
-    all_patterns = french_patterns + english_patterns
-    
-    # Vérifier si au moins un pattern est présent
-    for pattern in all_patterns:
-        if pattern in response_lower:
-            return True
-    
-    return False
+    if _DISCLAIMER_AC is not None:
+        return next(_DISCLAIMER_AC.iter(response_lower), None) is not None
+    return _DISCLAIMER_RE.search(response_lower) is not None
+
+
+def _load_question_index():
+    """
+    Construit l'ensemble des question_id du journal JSONL.
+    Migre l'ancien journal question_log.json s'il existe encore.
+    """
+    global _log_patch_count
+    if not QUESTION_LOG_PATH.exists() and LEGACY_QUESTION_LOG_PATH.exists():
+        with _log_file_lock(exclusive=True):
+            # Revérifié sous verrou : un autre worker a pu migrer entre-temps
+            if not QUESTION_LOG_PATH.exists():
+                try:
+                    with open(LEGACY_QUESTION_LOG_PATH, 'r', encoding='utf-8') as f:
+                        legacy = json.load(f)
+                    with open(QUESTION_LOG_PATH, 'ab') as f:
+                        for entry in legacy:
+                            f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8'))
+                except Exception as e:
+                    print(f"Error migrating legacy question log: {e}")
+    _log_patch_count += _scan_question_log()
+
+
+def _scan_question_log():
+    """
+    Ajoute à _question_ids les questions écrites dans le journal depuis la
+    dernière lecture, y compris par les autres workers (relecture complète si
+    le journal a été remplacé par une compaction). Retourne le nombre de
+    patches lus.
+    """
+    global _question_scan_offset, _question_scan_inode
+    with _question_scan_lock:
+        try:
+            f = open(QUESTION_LOG_PATH, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != _question_scan_inode or stat.st_size < _question_scan_offset:
+                _question_scan_offset = 0
+                _question_scan_inode = stat.st_ino
+            f.seek(_question_scan_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # lignes complètes uniquement
+        _question_scan_offset += end
+    patches = 0
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "patch" in record:
+            patches += 1
+        elif "question_id" in record:
+            _question_ids.add(record["question_id"])
+    return patches
+
+
+def _apply_log_lines(entries, lines):
+    """Applique des lignes du journal à `entries` (question_id -> entrée) : ajouts et patches."""
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "patch" in record:
+            target = entries.get(record["patch"])
+            if target is not None:
+                target.update({k: v for k, v in record.items() if k != "patch"})
+        elif "question_id" in record:
+            entries[record["question_id"]] = record
+    return entries
+
+
+def _fold_log_lines(lines):
+    """Replie les lignes du journal : applique chaque patch à l'entrée de sa question."""
+    return list(_apply_log_lines({}, lines).values())
+
+
+@contextmanager
+def _log_file_lock(exclusive=False):
+    """
+    Verrou flock inter-processus sur le journal : partagé pour les ajouts,
+    exclusif pour la migration et la compaction. Sans fcntl (Windows), ne fait rien.
+    """
+    global _log_lock_fd
+    if fcntl is None:
+        yield
+        return
+    if _log_lock_fd is None:
+        _log_lock_fd = os.open(QUESTION_LOG_LOCK_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+    fcntl.flock(_log_lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(_log_lock_fd, fcntl.LOCK_UN)
+
+
+def _open_log_fd():
+    """(Ré)ouvre le descripteur O_APPEND du journal."""
+    global _log_fd
+    if _log_fd is not None:
+        os.close(_log_fd)
+    _log_fd = os.open(QUESTION_LOG_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+
+def _log_fd_is_stale():
+    """True si le journal a été remplacé (compaction par un autre processus) depuis l'ouverture de _log_fd."""
+    try:
+        return os.stat(QUESTION_LOG_PATH).st_ino != os.fstat(_log_fd).st_ino
+    except FileNotFoundError:
+        return True
+
+
+def _compact_question_log():
+    """
+    Réécrit le journal sous forme canonique (une ligne par question, patches
+    intégrés) via un fichier temporaire sous flock exclusif.
+    """
+    global _log_patch_count
+    tmp_path = QUESTION_LOG_PATH.with_suffix('.jsonl.tmp')
+    with _log_file_lock(exclusive=True):
+        with open(QUESTION_LOG_PATH, 'rb') as f:
+            entries = _fold_log_lines(f)
+        with open(tmp_path, 'wb') as f:
+            for entry in entries:
+                f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8'))
+        os.replace(tmp_path, QUESTION_LOG_PATH)
+        _open_log_fd()
+    _question_ids.update(entry["question_id"] for entry in entries)
+    _log_patch_count = 0
+
+
+def _write_log_batch(records):
+    """Ajoute un lot d'enregistrements en fin de journal (un os.write, un fsync) et met à jour l'index."""
+    global _log_patch_count
+    lines = [(json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8') for record in records]
+    data = memoryview(b"".join(lines))
+    with _log_file_lock():
+        if _log_fd is None or _log_fd_is_stale():
+            _open_log_fd()
+        while data:
+            data = data[os.write(_log_fd, data):]
+        os.fsync(_log_fd)
+    for record in records:
+        if "patch" in record:
+            _log_patch_count += 1
+        else:
+            _question_ids.add(record["question_id"])
+    if _log_patch_count >= LOG_COMPACT_THRESHOLD:
+        _compact_question_log()
+
+
+def _log_writer_worker():
+    """
+    Thread d'arrière-plan : regroupe les enregistrements en attente (jusqu'à
+    LOG_BATCH_SIZE ou LOG_FLUSH_INTERVAL secondes) et les écrit en un seul appel.
+    Les threading.Event reçus servent de barrière de vidage.
+    """
+    while True:
+        batch, barriers = [], []
+        item = _log_queue.get()
+        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        while True:
+            if isinstance(item, threading.Event):
+                barriers.append(item)
+                break
+            batch.append(item)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= LOG_BATCH_SIZE or remaining <= 0:
+                break
+            try:
+                item = _log_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                _write_log_batch(batch)
+            except Exception as e:
+                print(f"Error writing question log: {e}")
+        for barrier in barriers:
+            barrier.set()
+
+
+def flush_question_log(timeout=5.0):
+    """Attend que tous les enregistrements déjà en file soient écrits sur disque."""
+    barrier = threading.Event()
+    _log_queue.put(barrier)
+    return barrier.wait(timeout)
+
+
+def fold_question_log():
+    """
+    Matérialise le journal JSONL en liste d'entrées, en appliquant les
+    enregistrements "patch" (commentaires, votes) à leur question.
+    """
+    global _folded_offset, _folded_inode
+    flush_question_log()
+    with _folded_lock:
+        if not QUESTION_LOG_PATH.exists():
+            return []
+        with open(QUESTION_LOG_PATH, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != _folded_inode or stat.st_size < _folded_offset:
+                # Journal remplacé (compaction) : relecture complète
+                _folded_entries.clear()
+                _folded_offset = 0
+                _folded_inode = stat.st_ino
+            f.seek(_folded_offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # lignes complètes uniquement
+        _apply_log_lines(_folded_entries, data[:end].splitlines())
+        _folded_offset += end
+        return [dict(entry) for entry in _folded_entries.values()]
 
 
 def save_question_response(question_id, question, response):
     """
     Sauvegarde une question et sa réponse dans le fichier journal.
+    L'écriture est faite par le thread d'arrière-plan ; cet appel ne bloque pas.
     """
     entry = {
         "question_id": question_id,
@@ -131,44 +431,120 @@ def save_question_response(question_id, question, response):
         "timestamp": datetime.now().isoformat(),
         "comments": []
     }
-    with question_log_lock:
-        try:
-            if QUESTION_LOG_PATH.exists():
-                with open(QUESTION_LOG_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                data = []
-        except Exception:
-            data = []
-        data.append(entry)
-        with open(QUESTION_LOG_PATH, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    _question_ids.add(question_id)
+    _log_queue.put(entry)
+
+def _patch_question(question_id, fields):
+    """Met en file un enregistrement patch pour une question existante. Retourne False si inconnue."""
+    if question_id not in _question_ids:
+        # Question peut-être enregistrée par un autre worker : lit la fin du journal
+        _scan_question_log()
+        if question_id not in _question_ids:
+            return False
+    _log_queue.put({"patch": question_id, **fields})
+    return True
 
 def add_comment_to_question(question_id, comment):
-    """Add a comment to a question by id."""
     """
     Ajoute un commentaire à une question par son identifiant.
     """
-    with question_log_lock:
-        try:
-            if QUESTION_LOG_PATH.exists():
-                with open(QUESTION_LOG_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                return False
-        except Exception:
-            return False
-        for entry in data:
-            if entry.get("question_id") == question_id:
-                # Remplace tous les commentaires par le nouveau commentaire
-                entry["comments"] = [{
-                    "comment": comment,
-                    "timestamp": datetime.now().isoformat()
-                }]
-                with open(QUESTION_LOG_PATH, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                return True
-        return False
+    # Remplace tous les commentaires par le nouveau commentaire
+    return _patch_question(question_id, {
+        "comments": [{
+            "comment": comment,
+            "timestamp": datetime.now().isoformat()
+        }]
+    })
+
+
+_SENTINEL = object()
+
+async def iterate_in_thread(iterator):
+    """
+    Adapte un itérateur synchrone (bloquant) en itérateur asynchrone.
+    Chaque next() est exécuté dans le pool de threads par défaut, ce qui évite
+    à Starlette de faire un aller-retour par chunk pour un générateur synchrone.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterator)
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, _SENTINEL)
+        if item is _SENTINEL:
+            break
+        yield item
+
+
+async def coalesce_chunks(chunks, min_chars=SSE_COALESCE_MIN_CHARS, max_delay=SSE_COALESCE_MAX_DELAY):
+    """
+    Regroupe les tokens d'un flux asynchrone en chunks d'au moins `min_chars`
+    caractères, sans retenir un token plus de `max_delay` secondes.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = chunks.__aiter__()
+    buffer, size, deadline = [], 0, None
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(chunks.__anext__())
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # Délai écoulé : envoie ce qui est déjà reçu
+                yield "".join(buffer)
+                buffer, size = [], 0
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= min_chars:
+                yield "".join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def _sse_frames(events):
+    """Encode chaque payload en événement SSE (`data: ...`)."""
+    async for payload in events:
+        yield b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+async def _sse_events(events):
+    """Encode chaque payload pour EventSourceResponse, qui gère le framing."""
+    async for payload in events:
+        yield {"data": orjson.dumps(payload).decode()}
+
+
+def sse_response(events):
+    """
+    Construit la réponse SSE à partir d'un itérateur asynchrone de payloads JSON.
+    Utilise EventSourceResponse (keep-alive, en-têtes anti-buffering) si
+    sse-starlette est installé, sinon un StreamingResponse équivalent.
+    """
+    if EventSourceResponse is not None:
+        # sep="\n" : le frontend découpe les messages sur "\n\n"
+        return EventSourceResponse(_sse_events(events), ping=SSE_PING_INTERVAL, sep="\n")
+    return StreamingResponse(
+        _sse_frames(events),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+_load_question_index()
+threading.Thread(target=_log_writer_worker, name="question-log-writer", daemon=True).start()
+atexit.register(flush_question_log)
 
 
 ######################################################
@@ -218,13 +594,13 @@ async def query_agent(request: QueryRequest):
     }
     conversation_history.append(user_message)
     session['last_activity'] = datetime.now()
-    question_id = str(uuid.uuid4())
-    def generate():
+    conversation_sessions.move_to_end(session_id)
+    question_id = _new_id()
+    async def generate():
         # Génère la réponse de l'assistant en streaming (SSE)
-        yield f"data: {json.dumps({'session_id': session_id, 'question_id': question_id, 'chunk': ''})}\n\n"
+        yield {'session_id': session_id, 'question_id': question_id, 'chunk': ''}
         assistant_response = ""
-        is_refusal = False
-        for chunk in ask_question_stream(
+        chunks = ask_question_stream_async(
             request.question,
             language=request.language,
             timezone=request.timezone,
@@ -232,13 +608,16 @@ async def query_agent(request: QueryRequest):
             conversation_history=conversation_history,
             session=session,
             question_id=question_id
-        ):
-            # Detect refusal marker
-            if chunk == "__REFUSAL__":
-                is_refusal = True
-                continue  # Don't include marker in response
+        )
+        # The refusal marker can only be the first chunk: check it once
+        first_chunk = await anext(chunks, None)
+        is_refusal = first_chunk == "__REFUSAL__"
+        if first_chunk is not None and not is_refusal:
+            assistant_response += first_chunk
+            yield {'chunk': first_chunk}
+        async for chunk in coalesce_chunks(chunks):
             assistant_response += chunk
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+            yield {'chunk': chunk}
         
         # Save question and response to log (including refused ones)
         save_question_response(question_id, request.question, assistant_response)
@@ -262,21 +641,13 @@ async def query_agent(request: QueryRequest):
             # Remove the user message from history since it was refused
             conversation_history.pop()
 
-    return StreamingResponse(
-        generate(), 
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        }
-    )
+    return sse_response(generate())
 
 
 # Fetch PMIDs for a session/question if available, else fallback to old behavior
 @app.post("/api/pmids")
 # Endpoint pour obtenir les PMIDs pertinents à une question
-def get_pmids_api(
+async def get_pmids_api(
     session_id: str = Body(None),
     question_id: str = Body(None),
     question: str = Body(None),
@@ -306,18 +677,8 @@ def get_pmids_api(
     if col is None:
         return {"error": "ChromaDB collection not available"}
     
-    query_emb = client.embeddings.create(
-        model="text-embedding-3-large",
-        input=question
-    ).data[0].embedding
-    results = col.query(
-        query_embeddings=[query_emb],
-        n_results=top_k,
-        include=['documents', 'metadatas']
-    )
-    contexts = results['documents'][0] if results['documents'] and results['documents'][0] else []
-    metadatas = results['metadatas'][0] if results.get('metadatas') and results['metadatas'][0] else []
-    pmids = get_pmids_from_contexts(contexts, metadatas=metadatas)
+    # Attend le lot sans occuper de thread du pool
+    pmids = await asyncio.wait_for(asyncio.wrap_future(pmids_batcher.submit_future((question, top_k))), PMIDS_BATCH_TIMEOUT)
     return {"pmids": pmids}
 
 @app.post("/api/add_comment")
@@ -339,37 +700,26 @@ def like_answer(
     like: bool = Body(...)
 ):
     """Add or update a like/dislike vote for a question. Replaces any previous vote."""
-    with question_log_lock:
-        try:
-            if QUESTION_LOG_PATH.exists():
-                with open(QUESTION_LOG_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            else:
-                return {"status": "error", "message": "Log file not found"}
-        except Exception:
-            return {"status": "error", "message": "Could not read log file"}
-        for entry in data:
-            if entry.get("question_id") == question_id:
-                entry["likes"] = {
-                    "like": like,
-                    "timestamp": datetime.now().isoformat()
-                }
-                with open(QUESTION_LOG_PATH, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-                return {"status": "success", "message": "Vote recorded"}
-        return {"status": "error", "message": "Question ID not found"}    
+    if _patch_question(question_id, {"likes": {"like": like, "timestamp": datetime.now().isoformat()}}):
+        return {"status": "success", "message": "Vote recorded"}
+    return {"status": "error", "message": "Question ID not found"}
     
 @app.get("/api/download_log")
 # Endpoint pour télécharger le journal des questions (admin seulement)
-def download_question_log(key: str = Query(...)):
+def download_question_log(key: str = Query(...), raw: bool = Query(False)):
     if key != "dboubou363":
         return {"status": "error", "message": "Unauthorized"}
     if not QUESTION_LOG_PATH.exists():
         return {"status": "error", "message": "Log file not found"}
-    return FileResponse(
-        path=str(QUESTION_LOG_PATH),
-        filename="question_log.json",
-        media_type="application/json"
+    if raw:
+        return FileResponse(
+            path=str(QUESTION_LOG_PATH),
+            filename="question_log.jsonl",
+            media_type="application/x-ndjson"
+        )
+    return JSONResponse(
+        fold_question_log(),
+        headers={"Content-Disposition": 'attachment; filename="question_log.json"'}
     )
 
 @app.get("/log_report", response_class=HTMLResponse)
@@ -386,14 +736,21 @@ def serve_log_report(request: Request, key: str = Query(...)):
 def _clean_old_sessions():
     """
     Supprime les sessions de conversation expirées.
+    Les sessions étant triées par activité, le parcours s'arrête à la première
+    session encore active ; le nettoyage est limité à un passage toutes les 30 s.
     """
+    global _last_session_cleanup
     now = datetime.now()
-    expired_sessions = [
-        sid for sid, session in conversation_sessions.items()
-        if now - session['last_activity'] > SESSION_TIMEOUT
-    ]
+    if now - _last_session_cleanup < SESSION_CLEANUP_INTERVAL:
+        return
+    _last_session_cleanup = now
+    expired_sessions = []
+    for sid, session in conversation_sessions.items():
+        if now - session['last_activity'] <= SESSION_TIMEOUT:
+            break
+        expired_sessions.append(sid)
     for sid in expired_sessions:
-        del conversation_sessions[sid]
+        conversation_sessions.pop(sid, None)
 
 @app.get("/", response_class=HTMLResponse)
 ######################################################
@@ -439,45 +796,24 @@ def deep_merge(base_config: dict, override_config: dict) -> dict:
 @app.get("/api/get_config")
 def get_translations(agent: Optional[str] = None):
     """
-    Get configuration with optional agent-specific overrides.
+    Get agent-specific configuration.
     
     Args:
-        agent: Optional agent name ('nutria' or 'translator')
+        agent: Agent name ('main', 'nutria' or 'translator')
         
     Returns:
-        Configuration dictionary (merged if agent specified)
+        Configuration JSON, served from the bytes read at startup
     """
-    try:
-
-        # If no agent specified, return shared config
-        if not agent:
-            return {"error": "agent not specified"}
-        
-        # Load agent-specific configuration
-        agent_config_path = None
-                # Load shared configuration
-        if agent == "main":
-            agent_config_path = Path(__file__).parent / "knowledge-bases" / "common" / "config.json"
-        if agent == "nutria":
-            agent_config_path = Path(__file__).parent / "knowledge-bases" / "nutria" / "config.json"
-        elif agent == "translator":
-            agent_config_path = Path(__file__).parent / "knowledge-bases" / "translator" / "config.json"
-        else:
-            # Unknown agent, return shared config
-            return {"error": "agent not found"}
-        
-        # Load and merge agent config
-        if agent_config_path and agent_config_path.exists():
-            with open(agent_config_path, 'r', encoding='utf-8') as f:
-                agent_config = json.load(f)
-
-        
-        return agent_config
-        
-    except FileNotFoundError:
+    # If no agent specified, return shared config
+    if not agent:
+        return {"error": "agent not specified"}
+    if agent not in AGENT_CONFIG_PATHS:
+        # Unknown agent, return shared config
+        return {"error": "agent not found"}
+    config_bytes = _AGENT_CONFIG_BYTES.get(agent)
+    if config_bytes is None:
         return {"error": "config not found"}
-    except Exception as e:
-        return {"error": f"Error loading config: {str(e)}"}
+    return Response(config_bytes, media_type="application/json")
 
 @app.post("/api/reset_session")
 # Endpoint pour réinitialiser une session de conversation
@@ -513,20 +849,20 @@ def get_languages():
 # Endpoint pour traduire du texte en streaming
 async def translate_text_endpoint(request: TranslateRequest):
     """Translate text to target language using GPT with streaming."""
-    question_id = str(uuid.uuid4())
+    question_id = _new_id()
     
-    def generate():
+    async def generate():
         # Send question_id in first chunk
-        yield f"data: {json.dumps({'question_id': question_id, 'chunk': ''})}\n\n"
+        yield {'question_id': question_id, 'chunk': ''}
         
         translated = ""
-        for chunk in translate_text_stream(
+        async for chunk in coalesce_chunks(iterate_in_thread(translate_text_stream(
             text=request.text,
             target_language=request.target_language,
             source_language=request.source_language
-        ):
+        ))):
             translated += chunk
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+            yield {'chunk': chunk}
         
         # Save translation to log
         save_question_response(
@@ -535,15 +871,7 @@ async def translate_text_endpoint(request: TranslateRequest):
             translated
         )
 
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        }
-    )
+    return sse_response(generate())
 
 
 @app.post("/api/transcribe_audio")
@@ -583,77 +911,79 @@ async def translate_audio_endpoint(
     Transcribe audio using Whisper, then translate result to target language.
     Step 1: Whisper transcribes the audio
     Step 2: GPT translates the transcription to the target language
+    For English, Whisper's own translation endpoint runs alongside the
+    transcription and step 2 is skipped.
     """
     audio_bytes = await audio.read()
+    filename = audio.filename or "audio.webm"
     
     # Step 1: Transcribe with Whisper
-    transcribed_text = transcribe_audio_whisper(audio_bytes, filename=audio.filename or "audio.webm")
+    if target_language == "en":
+        transcribed_text, english_text = await asyncio.gather(
+            asyncio.to_thread(transcribe_audio_whisper, audio_bytes, filename=filename),
+            translate_audio_whisper_async(audio_bytes, filename=filename)
+        )
+    else:
+        transcribed_text = await asyncio.to_thread(transcribe_audio_whisper, audio_bytes, filename=filename)
+        english_text = None
     
     if not transcribed_text:
         return JSONResponse({"error": "Could not transcribe audio"}, status_code=400)
     
     # Step 2: Translate the transcribed text
-    def generate():
+    async def generate():
         # First send the transcription
-        yield f"data: {json.dumps({'transcription': transcribed_text, 'chunk': ''})}\n\n"
-        for chunk in translate_text_stream(
+        yield {'transcription': transcribed_text, 'chunk': ''}
+        if english_text is not None:
+            yield {'chunk': english_text}
+            return
+        async for chunk in coalesce_chunks(iterate_in_thread(translate_text_stream(
             text=transcribed_text,
             target_language=target_language,
             source_language=source_language
-        ):
-            yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+        ))):
+            yield {'chunk': chunk}
 
-    return StreamingResponse(
-        generate(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        }
-    )
+    return sse_response(generate())
 
 
 @app.post("/api/tts")
-async def text_to_speech(
+def text_to_speech(
     text: str = Body(..., embed=True),
     language: str = Body("fr", embed=True)
 ):
     """
     Convert text to speech using OpenAI TTS API.
-    Returns audio/mpeg stream.
+    Returns audio/mpeg stream, forwarded to the client as it is generated.
     """
-    import openai
-    import os
-    from fastapi.responses import Response
-    try:
-        client_openai = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        # Choose voice based on language
-        voice = "nova" if language in ["fr", "es", "it", "pt", "ro"] else "alloy"
-        response = client_openai.audio.speech.create(
+    # Choose voice based on language
+    voice = "nova" if language in ["fr", "es", "it", "pt", "ro"] else "alloy"
+
+    def stream_audio():
+        # The context manager closes the HTTP response when the stream ends,
+        # fails or is dropped (client disconnect closes the generator)
+        with client.audio.speech.with_streaming_response.create(
             model="tts-1",
             voice=voice,
             input=text[:4096],  # TTS API limit
             response_format="mp3"
-        )
-        
-        # Read full audio content
-        audio_bytes = b""
-        for chunk in response.iter_bytes(chunk_size=4096):
-            audio_bytes += chunk
-        
-        return Response(
-            content=audio_bytes,
-            media_type="audio/mpeg",
-            headers={
-                "Content-Length": str(len(audio_bytes)),
-                "Content-Disposition": "inline"
-            }
-        )
+        ) as response:
+            yield from response.iter_bytes(8192)
+
+    # Start the request here so API errors still get a JSON 500
+    audio = stream_audio()
+    try:
+        first_chunk = next(audio, b"")
     except Exception as e:
         print(f"TTS error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
 
+    return StreamingResponse(
+        itertools.chain((first_chunk,), audio),
+        media_type="audio/mpeg",
+        headers={"Content-Disposition": "inline"}
+    )
+
 
 @app.post("/update")
 # Endpoint pour déclencher l'indexation des documents Google Drive
@@ -667,6 +997,7 @@ def update_pipeline(request: Request):
         print(f"User-Agent: {request.headers.get('user-agent', 'Unknown')}")
         
         result = run_pipeline()
+        clear_pmids_cache()
         
         if result.get("error"):
             print(f"❌ Pipeline error: {result['error']}")
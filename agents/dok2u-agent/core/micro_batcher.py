@@ -0,0 +1,59 @@
+# =====================================================
+# Micro Batcher - Regroupement de requêtes concurrentes
+# Les appels arrivant dans une courte fenêtre sont traités en un seul lot
+# =====================================================
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Coalesces calls to `submit()` / `submit_future()` made within `window` seconds (up to
+    `max_batch` items) into a single `process_batch(items)` call, run on a
+    background thread. `process_batch` must return one result per item.
+    """
+
+    def __init__(self, process_batch, window: float = 0.02, max_batch: int = 32):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        threading.Thread(target=self._worker, name="micro-batcher", daemon=True).start()
+
+    def submit(self, item, timeout: float = 30.0):
+        """Queue an item and block until its batch has been processed."""
+        return self.submit_future(item).result(timeout=timeout)
+
+    def submit_future(self, item) -> Future:
+        """
+        Queue an item without blocking and return the Future of its result
+        (async callers: `await asyncio.wrap_future(batcher.submit_future(item))`).
+        """
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
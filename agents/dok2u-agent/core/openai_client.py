@@ -0,0 +1,25 @@
+# =====================================================
+# OpenAI Client - Clients partagés par tous les modules
+# Un seul pool de connexions HTTP/2 (keep-alive) pour le chat, les embeddings,
+# la traduction et la synthèse vocale
+# =====================================================
+
+import os
+from pathlib import Path
+import httpx
+from dotenv import load_dotenv
+from openai import OpenAI, AsyncOpenAI
+
+PROJECT_ROOT = Path(__file__).parent.parent
+load_dotenv(dotenv_path=PROJECT_ROOT / '.env')
+
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.Client(http2=True, limits=HTTP_LIMITS)
+)
+aclient = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.AsyncClient(http2=True, limits=HTTP_LIMITS)
+)
@@ -1,7 +1,7 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
-from openai import OpenAI
+from core import openai_client
 import chromadb
 from chromadb.config import Settings
 from chromadb.utils import embedding_functions
@@ -26,6 +26,12 @@ KNOWLEDGE_BASE = os.getenv("KNOWLEDGE_BASE", "nutria")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Embedding model (must match core/query_chromadb.py)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+# Chunks per collection.add() call (one embedding request per batch)
+ADD_BATCH_SIZE = 200
+
 # Knowledge base paths
 KB_PATH = PROJECT_ROOT / "knowledge-bases" / KNOWLEDGE_BASE
 DOCUMENTS_DIR = str(KB_PATH / "documents")
@@ -38,10 +44,10 @@ os.makedirs(EXTRACTED_DIR, exist_ok=True)
 os.makedirs(CHROMA_DB_DIR, exist_ok=True)
 
 # Clients
-client_openai = OpenAI(api_key=OPENAI_API_KEY)
+client_openai = openai_client.client
 
 ef = embedding_functions.OpenAIEmbeddingFunction(
-    api_key=OPENAI_API_KEY, model_name="text-embedding-3-large"
+    api_key=OPENAI_API_KEY, model_name=EMBEDDING_MODEL, dimensions=EMBEDDING_DIMENSIONS
 )
 chroma_client = chromadb.PersistentClient(
     path=CHROMA_DB_DIR,
@@ -235,25 +241,23 @@ def process_document(file_info):
     # Chunk text and add to ChromaDB
     chunk_size = 1000
     overlap = 100
-    chunks = []
-    
-    for i in range(0, len(text), chunk_size - overlap):
-        chunk = text[i:i + chunk_size]
-        if chunk.strip():
-            chunks.append(chunk)
+    windows = (text[i:i + chunk_size] for i in range(0, len(text), chunk_size - overlap))
+    chunks = [chunk for chunk in windows if chunk.strip()]
     
-    # Add chunks to ChromaDB
-    for i, chunk in enumerate(chunks):
+    # Add chunks to ChromaDB, ADD_BATCH_SIZE chunks per call
+    indexed_at = datetime.now().isoformat()
+    for start in range(0, len(chunks), ADD_BATCH_SIZE):
+        batch = chunks[start:start + ADD_BATCH_SIZE]
         collection.add(
-            documents=[chunk],
+            documents=batch,
             metadatas=[{
                 "source": file_name,
                 "file_id": file_id,
                 "chunk": i,
                 "mime_type": mime_type,
-                "indexed_at": datetime.now().isoformat()
-            }],
-            ids=[f"{file_id}_chunk_{i}"]
+                "indexed_at": indexed_at
+            } for i in range(start, start + len(batch))],
+            ids=[f"{file_id}_chunk_{i}" for i in range(start, start + len(batch))]
         )
     
     print(f"✅ Indexed {len(chunks)} chunks from {file_name}")
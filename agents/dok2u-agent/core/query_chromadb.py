@@ -1,15 +1,26 @@
 
 import os
+import asyncio
 import json
+import functools
+import hashlib
 import re
+import sys
+import threading
+from array import array
+from collections import OrderedDict
 from pathlib import Path
 from dotenv import load_dotenv
-from openai import OpenAI
 import chromadb
 from chromadb.config import Settings
 import google.generativeai as genai
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
 # Refusal engine import
 from core.refusal_engine import validate_user_query
+from core.openai_client import client, aclient
 
 # Get project root directory
 PROJECT_ROOT = Path(__file__).parent.parent
@@ -18,34 +29,92 @@ load_dotenv(dotenv_path=PROJECT_ROOT / '.env')
 # Initialize ChromaDB client (local storage)
 chroma_client = None
 collection = None
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
 # Get knowledge base name from environment or use default
 KNOWLEDGE_BASE = os.getenv("KNOWLEDGE_BASE", "nutria")
 
+# Embedding model shared with scripts/index_chromadb.py and core/pipeline_gdrive.py
+# (changing it requires re-indexing the collection with the same settings)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
 
+# Embeddings of normalized questions (LRU), shared by /query and /api/pmids
+# Stored as packed float32 arrays (4 bytes per dimension instead of a tuple of floats)
+EMBEDDING_CACHE_SIZE = 4096
+_embedding_cache: "OrderedDict[str, array]" = OrderedDict()
+_embedding_cache_lock = threading.Lock()
+
+# Optional on-disk embedding cache shared by all workers of the host
+# (enabled when EMBEDDING_CACHE_DIR is set and diskcache is installed)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "")
+embedding_disk_cache = diskcache.Cache(EMBEDDING_CACHE_DIR) if diskcache is not None and EMBEDDING_CACHE_DIR else None
+
+# PMID results of /api/pmids recomputations, keyed by (normalized question, top_k)
+PMIDS_CACHE_SIZE = 2048
+_pmids_cache: "OrderedDict[tuple, list]" = OrderedDict()
+_pmids_cache_lock = threading.Lock()
+
+# Token budget of the retrieved context in the prompt (estimated at ~4 characters per token)
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "3000"))
+
+# HNSW parameters of the transcripts collection (Chroma defaults: M=16,
+# construction_ef=100, search_ef=10 before 1.0 and 100 since), also used by
+# scripts/index_chromadb.py. hnswlib searches with max(ef, n_results), so a
+# fixed ef covers the usual top_k values. L2 space like the existing indexes.
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "64"))
+HNSW_METADATA = {
+    "hnsw:space": "l2",
+    "hnsw:M": 24,
+    "hnsw:construction_ef": 128,
+    "hnsw:search_ef": HNSW_SEARCH_EF,
+}
+
+# PMIDs kept per session (most recent questions only)
+SESSION_PMIDS_MAX_ENTRIES = 32
+
+
+
+STYLE_GUIDES_PATH = PROJECT_ROOT / 'config' / 'style_guides.json'
+SYSTEM_PROMPTS_PATH = PROJECT_ROOT / 'config' / 'system_prompts.json'
+PROMPTS_PATH = PROJECT_ROOT / 'config' / 'prompts.json'
+
+
+def _mtime_ns(path):
+    """Modification time of `path` (None if missing), used as cache key."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _escape_braces(text):
+    return text.replace("{", "{{").replace("}", "}}")
 
 def load_style_guides():
-    """Load style guides from JSON file"""
+    """Load style guides from JSON file (cached until the file changes)"""
+    return _load_style_guides_cached(STYLE_GUIDES_PATH, _mtime_ns(STYLE_GUIDES_PATH))
+
+@functools.lru_cache(maxsize=8)
+def _load_style_guides_cached(path, mtime_ns):
     try:
-        with open(PROJECT_ROOT / 'config' / 'style_guides.json', 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             style_data = json.load(f)
         
         # Format the style guides for use in prompts
         formatted_guides = {}
         for lang, data in style_data.items():
-            guide = f"# {data['title']}\n\n"
-            guide += f"\n## {data['characteristic_expressions']['title']}\n"
-            for phrase in data['characteristic_expressions']['phrases']:
-                guide += f"- \"{phrase}\"\n"
-            guide += f"\n## {data['tone_and_voice']['title']}\n"
-            for char in data['tone_and_voice']['characteristics']:
-                guide += f"- {char}\n"
-            guide += f"\n## {data['key_messages']['title']}\n"
-            for msg in data['key_messages']['messages']:
-                guide += f"- \"{msg}\"\n"
-            formatted_guides[lang] = guide
+            expressions = data['characteristic_expressions']
+            tone = data['tone_and_voice']
+            key_messages = data['key_messages']
+            formatted_guides[lang] = "".join([
+                f"# {data['title']}\n\n",
+                f"\n## {expressions['title']}\n",
+                *(f"- \"{phrase}\"\n" for phrase in expressions['phrases']),
+                f"\n## {tone['title']}\n",
+                *(f"- {char}\n" for char in tone['characteristics']),
+                f"\n## {key_messages['title']}\n",
+                *(f"- \"{msg}\"\n" for msg in key_messages['messages']),
+            ])
         
         return formatted_guides, style_data
     except Exception as e:
@@ -53,9 +122,13 @@ def load_style_guides():
         return {}, {}
 
 def load_system_prompts():
-    """Load system prompts from JSON file"""
+    """Load system prompts from JSON file (cached until the file changes)"""
+    return _load_system_prompts_cached(SYSTEM_PROMPTS_PATH, _mtime_ns(SYSTEM_PROMPTS_PATH))
+
+@functools.lru_cache(maxsize=8)
+def _load_system_prompts_cached(path, mtime_ns):
     try:
-        with open(PROJECT_ROOT / 'config' / 'system_prompts.json', 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except Exception as e:
         print(f"Error loading system prompts: {e}")
@@ -68,26 +141,38 @@ def load_prompts(kb_name=None):
     Args:
         kb_name: Name of the knowledge base (default: from KNOWLEDGE_BASE env var)
     """
+    prompts_path = _prompts_path(kb_name)
+    return _load_prompts_cached(prompts_path, _mtime_ns(prompts_path))
+
+def _prompts_path(kb_name=None):
     if kb_name is None:
         kb_name = KNOWLEDGE_BASE
-    
+    prompts_path = PROJECT_ROOT / "knowledge-bases" / kb_name / 'prompts.json'
+    # Fallback to config folder if not found in KB (for backward compatibility)
+    if not prompts_path.exists():
+        prompts_path = PROMPTS_PATH
+    return prompts_path
+
+@functools.lru_cache(maxsize=8)
+def _load_prompts_cached(path, mtime_ns):
     try:
-        kb_path = PROJECT_ROOT / "knowledge-bases" / kb_name
-        prompts_path = kb_path / 'prompts.json'
-        
-        # Fallback to config folder if not found in KB (for backward compatibility)
-        if not prompts_path.exists():
-            prompts_path = PROJECT_ROOT / 'config' / 'prompts.json'
-            
-        with open(prompts_path, 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
     except Exception as e:
         print(f"Error loading prompts: {e}")
         return {}
 
-def build_prompt_from_template(language, context, question, history_text=""):
-    """Build a complete prompt from the JSON template"""
-    prompts_data = load_prompts()
+def get_prompt_template(language, kb_name=None):
+    """
+    Return the prompt template for `language` with everything but {context},
+    {history} and {question} filled in (cached until prompts.json changes)
+    """
+    prompts_path = _prompts_path(kb_name)
+    return _prompt_template_cached(language, prompts_path, _mtime_ns(prompts_path))
+
+@functools.lru_cache(maxsize=32)
+def _prompt_template_cached(language, path, mtime_ns):
+    prompts_data = _load_prompts_cached(path, mtime_ns)
     lang_data = prompts_data.get(language, prompts_data.get("fr", {}))
     
     if not lang_data:
@@ -98,45 +183,101 @@ def build_prompt_from_template(language, context, question, history_text=""):
     tone = comm_style.get('tone_and_voice', {})
     recurring = comm_style.get('recurring_messages', {})
     
-    tone_content = f"## {tone.get('title', '')}\n"
-    for char in tone.get('characteristics', []):
-        tone_content += f"- {char}\n"
-    
-    recurring_content = f"\n## {recurring.get('title', '')}\n"
-    for msg in recurring.get('messages', []):
-        recurring_content += f"- « {msg} »\n"
-    
-    communication_style_content = tone_content + recurring_content
+    communication_style_content = "".join([
+        f"## {tone.get('title', '')}\n",
+        *(f"- {char}\n" for char in tone.get('characteristics', [])),
+        f"\n## {recurring.get('title', '')}\n",
+        *(f"- « {msg} »\n" for msg in recurring.get('messages', [])),
+    ])
     
     # Build absolute rules content
     rules = lang_data.get('absolute_rules', {})
-    rules_content = ""
-    for rule in rules.get('rules', []):
-        rules_content += f"- {rule}\n"
+    rules_content = "".join(f"- {rule}\n" for rule in rules.get('rules', []))
     
     # Build behavioral constraints content
     constraints = lang_data.get('behavioral_constraints', {})
-    constraints_content = ""
-    for constraint in constraints.get('constraints', []):
-        constraints_content += f"- {constraint}\n"
+    constraints_content = "".join(f"- {constraint}\n" for constraint in constraints.get('constraints', []))
     
-    # Build the final prompt using the template
+    # Fill the static sections, keep the per-request placeholders
     template = lang_data.get('template', '')
-    prompt = template.format(
-        system_role=lang_data.get('system_role', ''),
-        important_notice=lang_data.get('important_notice', ''),
-        communication_style_title=comm_style.get('title', ''),
-        communication_style_content=communication_style_content,
-        absolute_rules_title=rules.get('title', ''),
-        absolute_rules_content=rules_content,
-        behavioral_constraints_title=constraints.get('title', ''),
-        behavioral_constraints_content=constraints_content,
-        context=context,
-        history=history_text,
-        question=question
+    return template.format(
+        system_role=_escape_braces(lang_data.get('system_role', '')),
+        important_notice=_escape_braces(lang_data.get('important_notice', '')),
+        communication_style_title=_escape_braces(comm_style.get('title', '')),
+        communication_style_content=_escape_braces(communication_style_content),
+        absolute_rules_title=_escape_braces(rules.get('title', '')),
+        absolute_rules_content=_escape_braces(rules_content),
+        behavioral_constraints_title=_escape_braces(constraints.get('title', '')),
+        behavioral_constraints_content=_escape_braces(constraints_content),
+        context="{context}",
+        history="{history}",
+        question="{question}"
     )
-    
-    return prompt
+
+def build_prompt_from_template(language, context, question, history_text=""):
+    """Build a complete prompt from the JSON template"""
+    template = get_prompt_template(language)
+    if template is None:
+        return None
+    return template.format(context=context, history=history_text, question=question)
+
+def _normalize_question(question):
+    return " ".join(question.lower().split())
+
+def _embedding_disk_key(normalized_question):
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\0{EMBEDDING_DIMENSIONS}\0{normalized_question}".encode("utf-8")).hexdigest()
+
+def embed_queries(questions):
+    """Get the embeddings of several user questions in one OpenAI call, reusing cached results"""
+    normalized = [_normalize_question(q) for q in questions]
+    with _embedding_cache_lock:
+        missing = [q for q in dict.fromkeys(normalized) if q not in _embedding_cache]
+    fresh = {}
+    if missing and embedding_disk_cache is not None:
+        for q in missing:
+            emb = embedding_disk_cache.get(_embedding_disk_key(q))
+            if emb is not None:
+                fresh[q] = array("f", emb)
+        missing = [q for q in missing if q not in fresh]
+    if missing:
+        data = client.embeddings.create(model=EMBEDDING_MODEL, input=missing, dimensions=EMBEDDING_DIMENSIONS).data
+        computed = {q: array("f", item.embedding) for q, item in zip(missing, data)}
+        if embedding_disk_cache is not None:
+            for q, emb in computed.items():
+                embedding_disk_cache.set(_embedding_disk_key(q), emb)
+        fresh.update(computed)
+    with _embedding_cache_lock:
+        _embedding_cache.update(fresh)
+        embeddings = []
+        for q in normalized:
+            if q in fresh:
+                embeddings.append(list(fresh[q]))
+            else:
+                _embedding_cache.move_to_end(q)
+                embeddings.append(list(_embedding_cache[q]))
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    return embeddings
+
+def embed_query(question):
+    """Get the embedding of a user question, reusing cached results for repeated questions"""
+    return embed_queries([question])[0]
+
+def tune_search_ef(col):
+    """Set the HNSW search ef of an existing collection to HNSW_SEARCH_EF"""
+    metadata = col.metadata or {}
+    configuration = getattr(col, "configuration", None) or {}
+    current = (configuration.get("hnsw") or {}).get("ef_search", metadata.get("hnsw:search_ef"))
+    if current == HNSW_SEARCH_EF:
+        return
+    try:
+        try:
+            col.modify(configuration={"hnsw": {"ef_search": HNSW_SEARCH_EF}})
+        except TypeError:
+            # Chroma < 1.0: HNSW parameters live in the collection metadata
+            col.modify(metadata={**metadata, "hnsw:search_ef": HNSW_SEARCH_EF})
+    except Exception as e:
+        print(f"Could not set HNSW search_ef: {e}")
 
 def get_collection(kb_name=None):
     """
@@ -174,11 +315,12 @@ def get_collection(kb_name=None):
             try:
                 collection = chroma_client.get_collection(name="transcripts")
                 print(f"Collection 'transcripts' loaded from '{kb_name}' with {collection.count()} documents")
+                tune_search_ef(collection)
             except:
                 print(f"Creating new transcripts collection for '{kb_name}'...")
                 collection = chroma_client.create_collection(
                     name="transcripts",
-                    metadata={"kb_name": kb_name}
+                    metadata={"kb_name": kb_name, **HNSW_METADATA}
                 )
                 print("Empty collection created")
                 
@@ -187,6 +329,13 @@ def get_collection(kb_name=None):
             return None
     return collection
 
+# Phrases génériques qui ne méritent pas de PMIDs (comparées à la question entière),
+# regroupées par type de réponse directe
+GREETING_PHRASES = frozenset({'bonjour', 'salut', 'hello', 'hi'})
+THANKS_PHRASES = frozenset({'merci', 'merci beaucoup', 'thanks', 'thank you'})
+HELP_PHRASES = frozenset({'pose une question', 'aide moi', 'help', 'ask a question', 'ask question'})
+GENERIC_PHRASES = GREETING_PHRASES | THANKS_PHRASES | HELP_PHRASES
+
 def is_substantial_question(question):
     """
     Vérifie si la question est suffisamment substantielle pour mériter des PMIDs.
@@ -196,34 +345,72 @@ def is_substantial_question(question):
         return False
     
     # Compter les mots significatifs (au moins 3 caractères)
-    words = [w for w in question.split() if len(w) >= 3]
-    if len(words) < 3:
+    if sum(1 for w in question.split() if len(w) >= 3) < 3:
         return False
     
-    # Liste de phrases génériques qui ne méritent pas de PMIDs
-    generic_phrases = [
-        'pose une question',
-        'aide moi',
-        'bonjour',
-        'salut',
-        'merci',
-        'hello',
-        'hi',
-        'help',
-        'ask a question',
-        'ask question',
-    ]
-    
     question_lower = question.lower().strip()
-    for phrase in generic_phrases:
-        if question_lower == phrase or question_lower == phrase + '?':
-            return False
-    
-    return True
+    if question_lower.endswith('?'):
+        question_lower = question_lower[:-1]
+    return question_lower not in GENERIC_PHRASES
+
+_PMID_RE = re.compile(r'PMID:\s*\d+')
+
+# source -> PMIDs of its chunk_0, built on first use from a single ChromaDB read
+_source_pmids_index = None
+_source_pmids_lock = threading.Lock()
+
+# Réponses directes aux messages sans contenu (salutations, remerciements, « help »)
+GREETING_MESSAGES = {
+    "greeting": {
+        "fr": "Bonjour ! Pose-moi ta question et je te répondrai à partir de mes connaissances.",
+        "en": "Hello! Ask me your question and I'll answer it from my knowledge base.",
+    },
+    "thanks": {
+        "fr": "Avec plaisir ! N'hésite pas si tu as une autre question.",
+        "en": "You're welcome! Feel free to ask if you have another question.",
+    },
+    "help": {
+        "fr": "Pose-moi ta question en une phrase et je te répondrai à partir de mes connaissances.",
+        "en": "Ask me your question in a sentence and I'll answer it from my knowledge base.",
+    },
+}
+
+def _normalize_generic_phrase(question):
+    return " ".join(question.lower().split()).rstrip('?!. ')
+
+def is_trivial_greeting(question):
+    """True when the whole question is a generic phrase (greeting, thanks, help...)"""
+    return _normalize_generic_phrase(question) in GENERIC_PHRASES
+
+def get_greeting_message(language, question=""):
+    """Canned reply matching the kind of generic phrase (same key of style_guides.json if defined)"""
+    phrase = _normalize_generic_phrase(question)
+    kind = "thanks" if phrase in THANKS_PHRASES else "help" if phrase in HELP_PHRASES else "greeting"
+    _, style_data = load_style_guides()
+    messages = GREETING_MESSAGES[kind]
+    return style_data.get(language, {}).get(kind) or messages.get(language, messages["fr"])
 
 def extract_pmids_from_text(text):
     """Extrait toutes les références PMID d'un texte."""
-    return re.findall(r'PMID:\s*\d+', text)
+    return _PMID_RE.findall(text)
+
+def _load_source_pmid_index():
+    """Map each indexed source to the PMIDs found in its first chunk"""
+    global _source_pmids_index
+    with _source_pmids_lock:
+        if _source_pmids_index is None:
+            col = get_collection()
+            if col is None:
+                return {}
+            results = col.get(where={"chunk_index": 0}, include=['documents', 'metadatas'])
+            index = {}
+            for doc, meta in zip(results.get('documents') or [], results.get('metadatas') or []):
+                if doc and isinstance(meta, dict) and 'source' in meta:
+                    found = extract_pmids_from_text(doc)
+                    if found:
+                        index[meta['source']] = found
+            _source_pmids_index = index
+        return _source_pmids_index
 
 def get_pmids_from_contexts(contexts, metadatas=None):
     """Extract PMIDs from contexts. If metadatas with 'source' info is provided,
@@ -233,52 +420,122 @@ def get_pmids_from_contexts(contexts, metadatas=None):
     # First, check the matched chunks themselves
     for doc in contexts:
         pmids.update(extract_pmids_from_text(doc))
-    # If metadatas available, look up chunk_0 of each unique source for PMIDs
+    # If metadatas available, use the PMIDs of chunk_0 of each source
     if metadatas and not pmids:
-        col = get_collection()
-        if col:
-            sources = set()
-            for meta in metadatas:
-                if isinstance(meta, dict) and 'source' in meta:
-                    sources.add(meta['source'])
-            chunk0_ids = [src + '_chunk0' for src in sources]
-            if chunk0_ids:
-                try:
-                    results = col.get(ids=chunk0_ids, include=['documents'])
-                    for doc in results.get('documents', []):
-                        if doc:
-                            pmids.update(extract_pmids_from_text(doc))
-                except Exception as e:
-                    print(f'Error fetching chunk_0 for PMIDs: {e}')
+        try:
+            source_pmids = _load_source_pmid_index()
+        except Exception as e:
+            print(f'Error fetching chunk_0 for PMIDs: {e}')
+            source_pmids = {}
+        for meta in metadatas:
+            if isinstance(meta, dict) and 'source' in meta:
+                pmids.update(source_pmids.get(meta['source'], ()))
     return list(pmids)
 
+def store_session_pmids(session, question_id, pmids):
+    """
+    Store the PMIDs of a question in the session, keeping only the most recent
+    questions. PMID strings are interned: the same references recur across
+    questions and sessions and are then held only once.
+    """
+    session_pmids = session.setdefault('pmids', {})
+    session_pmids[question_id] = [sys.intern(p) for p in pmids]
+    while len(session_pmids) > SESSION_PMIDS_MAX_ENTRIES:
+        session_pmids.pop(next(iter(session_pmids)), None)
+
+def clear_pmids_cache():
+    """Forget cached PMID results (e.g. after the collection has been re-indexed)"""
+    global _source_pmids_index
+    with _pmids_cache_lock:
+        _pmids_cache.clear()
+    with _source_pmids_lock:
+        _source_pmids_index = None
+
+def get_pmids_batch(requests):
+    """
+    Compute PMIDs for several (question, top_k) requests with a single
+    embedding call and a single ChromaDB query. Returns one PMID list per request.
+    Results are cached per (normalized question, top_k).
+    """
+    keys = [(_normalize_question(question), top_k) for question, top_k in requests]
+    with _pmids_cache_lock:
+        cached = {key: _pmids_cache[key] for key in keys if key in _pmids_cache}
+        for key in cached:
+            _pmids_cache.move_to_end(key)
+    missing = [key for key in dict.fromkeys(keys) if key not in cached]
+    if missing:
+        col = get_collection()
+        embeddings = embed_queries([question for question, _ in missing])
+        results = col.query(
+            query_embeddings=embeddings,
+            n_results=max(top_k for _, top_k in missing),
+            include=['documents', 'metadatas']
+        )
+        documents = results.get('documents') or []
+        metadatas = results.get('metadatas') or []
+        for i, key in enumerate(missing):
+            top_k = key[1]
+            contexts = (documents[i] if i < len(documents) and documents[i] else [])[:top_k]
+            metas = (metadatas[i] if i < len(metadatas) and metadatas[i] else [])[:top_k]
+            cached[key] = get_pmids_from_contexts(contexts, metadatas=metas)
+        with _pmids_cache_lock:
+            for key in missing:
+                _pmids_cache[key] = cached[key]
+            while len(_pmids_cache) > PMIDS_CACHE_SIZE:
+                _pmids_cache.popitem(last=False)
+    return [list(cached[key]) for key in keys]
+
+def select_contexts(documents, metadatas=None):
+    """
+    Drop duplicate chunks and stop once MAX_CONTEXT_TOKENS is reached (the
+    best match is always kept). Returns the kept documents and their metadatas.
+    """
+    metadatas = metadatas or []
+    seen = set()
+    contexts, kept_metadatas = [], []
+    total_tokens = 0
+    for i, doc in enumerate(documents):
+        if doc in seen:
+            continue
+        tokens = len(doc) // 4
+        if contexts and total_tokens + tokens > MAX_CONTEXT_TOKENS:
+            break
+        seen.add(doc)
+        contexts.append(doc)
+        kept_metadatas.append(metadatas[i] if i < len(metadatas) else None)
+        total_tokens += tokens
+    return contexts, kept_metadatas
+
+def build_history_text(conversation_history):
+    """Format the recent turns of the conversation (excluding the current question) for the prompt"""
+    if not conversation_history or len(conversation_history) < 2:
+        return ""
+    return "\n\nHISTORIQUE DE LA CONVERSATION:\n" + "".join(
+        f"{'Utilisateur' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+        for msg in conversation_history[-7:-1]
+    )
+
 def ask_question_stream(question, language="fr", timezone="UTC", locale="fr-FR", top_k=5, conversation_history=None, session=None, question_id=None):
     """Streaming version of ask_question with language support and conversation history"""
-    # Use conversation_history if provided, otherwise empty list
-    if conversation_history is None:
-        conversation_history = []
-
-    # Build history_text for refusal_engine
-    history_text = ""
-    if conversation_history and len(conversation_history) > 1:
-        history_text = "\n\nHISTORIQUE DE LA CONVERSATION:\n"
-        recent_history = conversation_history[-7:-1] if len(conversation_history) > 1 else []
-        for msg in recent_history:
-            role_label = "Utilisateur" if msg['role'] == 'user' else "Assistant"
-            history_text += f"{role_label}: {msg['content']}\n"
+    history_text = build_history_text(conversation_history)
 
     # context is not available yet (need ChromaDB), so pass empty string for now
     refusal_result = validate_user_query(question, llm_call_fn=None, language=language)
     if refusal_result and refusal_result.get("decision") == "refuse":
         # Store empty PMIDs list in session for refusal
         if session is not None and question_id is not None:
-            if 'pmids' not in session:
-                session['pmids'] = {}
-            session['pmids'][question_id] = []
+            store_session_pmids(session, question_id, [])
         yield "__REFUSAL__"
         yield refusal_result["answer"]
         return
 
+    # Greetings and generic phrases: canned reply, no embedding / ChromaDB / LLM call
+    if is_trivial_greeting(question):
+        if session is not None and question_id is not None:
+            store_session_pmids(session, question_id, [])
+        yield get_greeting_message(language, question)
+        return
+
     col = get_collection()
     if col is None:
         yield "Error: ChromaDB collection is not available. Please run 'python index_chromadb.py' first to index your documents."
@@ -286,10 +543,7 @@ def ask_question_stream(question, language="fr", timezone="UTC", locale="fr-FR",
 
     try:
         # Get embedding for the question
-        query_emb = client.embeddings.create(
-            model="text-embedding-3-large", 
-            input=question
-        ).data[0].embedding
+        query_emb = embed_query(question)
 
         # Query ChromaDB
         results = col.query(
@@ -303,23 +557,18 @@ def ask_question_stream(question, language="fr", timezone="UTC", locale="fr-FR",
             return
 
         # Build context from results
-        contexts = []
-        for i, doc in enumerate(results['documents'][0]):
-            contexts.append(doc)
+        contexts, metadatas = select_contexts(results['documents'][0], (results.get('metadatas') or [[]])[0])
         context = "\n\n".join(contexts)
 
         # Extraire les PMIDs du contexte (with source metadata lookup)
         # Only extract PMIDs for substantial questions (not for generic/short questions)
         pmids = []
         if is_substantial_question(question):
-            metadatas = results.get('metadatas', [[]])[0]
             pmids = get_pmids_from_contexts(contexts, metadatas=metadatas)
         
         # Save PMIDs in session if provided
         if session is not None and question_id is not None:
-            if 'pmids' not in session:
-                session['pmids'] = {}
-            session['pmids'][question_id] = pmids
+            store_session_pmids(session, question_id, pmids)
 
         # Build prompt using template from JSON
         prompt = build_prompt_from_template(language, context, question, history_text)
@@ -344,24 +593,80 @@ def ask_question_stream(question, language="fr", timezone="UTC", locale="fr-FR",
         )
 
         first_chunk = True
-        answer = ""
         for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                # Strip leading whitespace from first chunk only
-                if first_chunk:
-                    content = content.lstrip()
-                    first_chunk = False
-                if content:
-                    answer += content
-                    yield content
+            content = chunk.choices[0].delta.content
+            if content is None:
+                continue
+            # Strip leading whitespace from first chunk only
+            if first_chunk:
+                content = content.lstrip()
+                first_chunk = False
+            if content:
+                yield content
 
     except Exception as e:
         yield f"Error processing your question: {str(e)}"
 
 
+def build_gemini_prompt(language, context, question):
+    """Build the Gemini prompt from the style guides and system prompts"""
+    # Load Style Card and system prompts
+    style_guides, style_data = load_style_guides()
+    style_guide = style_guides.get(language, style_guides.get("fr", ""))
+    not_found_msg = style_data.get(language, {}).get(
+        'not_found_message',
+        style_data.get('fr', {}).get('not_found_message', "Information not found in current content.")
+    )
+
+    system_prompts_data = load_system_prompts()
+    base_prompt_fr = system_prompts_data.get('fr', {}).get('content', '')
+    base_prompt_en = system_prompts_data.get('en', {}).get('content', '')
+
+    prompts = {
+        "fr": f"""{base_prompt_fr}
+
+            {style_guide}
+
+            CONTEXTE DISPONIBLE:
+            {context}
+
+            QUESTION DE L'UTILISATEUR: {question}
+
+            INSTRUCTIONS SPÉCIALES:
+            - Si l'information n'est pas disponible dans le contexte, réponds: "{not_found_msg}"
+            - Applique rigoureusement ta structure narrative et tes expressions caractéristiques
+            - Reste dans ton rôle de Ben avec ton style unique et reconnaissable""",
+
+        "en": f"""{base_prompt_en}
+
+            {style_guide}
+
+            AVAILABLE CONTEXT:
+            {context}
+
+            USER QUESTION: {question}
+
+            SPECIAL INSTRUCTIONS:
+            - If information is not available in the context, respond: "{not_found_msg}"
+            - Strictly apply your narrative structure and characteristic expressions
+            - Stay in your role as Ben with your unique and recognizable style"""
+    }
+
+    return prompts.get(language, prompts["fr"]) if language in ["fr", "en"] else prompts["fr"]
+
+
 def ask_question_stream_gemini(question, language="fr", timezone="UTC", locale="fr-FR", top_k=5, model_name="gemini-2.5-flash"):
     """Streaming answer using Gemini, mirroring ask_question_stream flow."""
+    refusal_result = validate_user_query(question, llm_call_fn=None, language=language)
+    if refusal_result and refusal_result.get("decision") == "refuse":
+        yield "__REFUSAL__"
+        yield refusal_result["answer"]
+        return
+
+    if is_trivial_greeting(question):
+        yield get_greeting_message(language, question)
+        return
+
     col = get_collection()
 
     if col is None:
@@ -370,10 +675,7 @@ def ask_question_stream_gemini(question, language="fr", timezone="UTC", locale="
 
     try:
         # Get embedding for the question using OpenAI (keeps Chroma flow unchanged)
-        query_emb = client.embeddings.create(
-            model="text-embedding-3-large",
-            input=question
-        ).data[0].embedding
+        query_emb = embed_query(question)
 
         # Query ChromaDB
         results = col.query(
@@ -386,65 +688,190 @@ def ask_question_stream_gemini(question, language="fr", timezone="UTC", locale="
             return
 
         # Build context from results
-        contexts = []
-        for i, doc in enumerate(results['documents'][0]):
-            contexts.append(doc)
+        contexts, _ = select_contexts(results['documents'][0])
         context = "\n\n".join(contexts)
 
-        # Load Style Card and system prompts
-        style_guides, style_data = load_style_guides()
-        style_guide = style_guides.get(language, style_guides.get("fr", ""))
-        not_found_msg = style_data.get(language, {}).get(
-            'not_found_message',
-            style_data.get('fr', {}).get('not_found_message', "Information not found in current content.")
+        prompt = build_gemini_prompt(language, context, question)
+
+        # Configure model (temperature to mirror OpenAI setup)
+        model = genai.GenerativeModel(model_name, generation_config={
+            "temperature": 0.3
+        })
+
+        # Stream tokens
+        response = model.generate_content(prompt, stream=True)
+
+        first_chunk = True
+        for chunk in response:
+            text = getattr(chunk, "text", None)
+            if text:
+                if first_chunk:
+                    text = text.lstrip()
+                    first_chunk = False
+                if text:
+                    yield text
+
+    except Exception as e:
+        yield f"Error processing your question (Gemini): {str(e)}"
+
+
+async def aget_collection():
+    """get_collection for async callers: only the first load runs in a thread"""
+    if collection is not None:
+        return collection
+    return await asyncio.to_thread(get_collection)
+
+async def aembed_query(question):
+    """Async embed_query (AsyncOpenAI), sharing the same caches"""
+    normalized = _normalize_question(question)
+    with _embedding_cache_lock:
+        if normalized in _embedding_cache:
+            _embedding_cache.move_to_end(normalized)
+            return list(_embedding_cache[normalized])
+    emb = None
+    if embedding_disk_cache is not None:
+        emb = embedding_disk_cache.get(_embedding_disk_key(normalized))
+        if emb is not None:
+            emb = array("f", emb)
+    if emb is None:
+        resp = await aclient.embeddings.create(model=EMBEDDING_MODEL, input=[normalized], dimensions=EMBEDDING_DIMENSIONS)
+        emb = array("f", resp.data[0].embedding)
+        if embedding_disk_cache is not None:
+            embedding_disk_cache.set(_embedding_disk_key(normalized), emb)
+    with _embedding_cache_lock:
+        _embedding_cache[normalized] = emb
+        while len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    return list(emb)
+
+async def ask_question_stream_async(question, language="fr", timezone="UTC", locale="fr-FR", top_k=5, conversation_history=None, session=None, question_id=None):
+    """
+    Async version of ask_question_stream: the embedding, ChromaDB query and
+    answer are awaited without holding a worker thread, and the answer is
+    streamed with AsyncOpenAI.
+    """
+    history_text = build_history_text(conversation_history)
+
+    # Cheap checks first: refused or trivial questions never pay for an embedding
+    refusal_result = validate_user_query(question, llm_call_fn=None, language=language)
+    if refusal_result and refusal_result.get("decision") == "refuse":
+        # Store empty PMIDs list in session for refusal
+        if session is not None and question_id is not None:
+            store_session_pmids(session, question_id, [])
+        yield "__REFUSAL__"
+        yield refusal_result["answer"]
+        return
+
+    # Greetings and generic phrases: canned reply, no embedding / ChromaDB / LLM call
+    if is_trivial_greeting(question):
+        if session is not None and question_id is not None:
+            store_session_pmids(session, question_id, [])
+        yield get_greeting_message(language, question)
+        return
+
+    col = await aget_collection()
+    if col is None:
+        yield "Error: ChromaDB collection is not available. Please run 'python index_chromadb.py' first to index your documents."
+        return
+
+    try:
+        query_emb = await aembed_query(question)
+
+        # Query ChromaDB
+        results = await asyncio.to_thread(
+            col.query,
+            query_embeddings=[query_emb],
+            n_results=top_k,
+            include=['documents', 'metadatas']
         )
 
-        system_prompts_data = load_system_prompts()
-        base_prompt_fr = system_prompts_data.get('fr', {}).get('content', '')
-        base_prompt_en = system_prompts_data.get('en', {}).get('content', '')
+        if not results['documents'] or not results['documents'][0]:
+            yield "No relevant information found. Please make sure you have indexed some transcripts."
+            return
 
-        prompts = {
-            "fr": f"""{base_prompt_fr}
+        # Build context from results
+        contexts, metadatas = select_contexts(results['documents'][0], (results.get('metadatas') or [[]])[0])
+        context = "\n\n".join(contexts)
 
-            {style_guide}
+        # Only extract PMIDs for substantial questions (may read ChromaDB on first use)
+        pmids = []
+        if is_substantial_question(question):
+            pmids = await asyncio.to_thread(get_pmids_from_contexts, contexts, metadatas)
 
-            CONTEXTE DISPONIBLE:
-            {context}
+        # Save PMIDs in session if provided
+        if session is not None and question_id is not None:
+            store_session_pmids(session, question_id, pmids)
 
-            QUESTION DE L'UTILISATEUR: {question}
+        prompt = build_prompt_from_template(language, context, question, history_text)
+        if not prompt:
+            yield "Error: Unable to load prompt template."
+            return
 
-            INSTRUCTIONS SPÉCIALES:
-            - Si l'information n'est pas disponible dans le contexte, réponds: "{not_found_msg}"
-            - Applique rigoureusement ta structure narrative et tes expressions caractéristiques
-            - Reste dans ton rôle de Ben avec ton style unique et reconnaissable""",
+        stream = await aclient.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            stream=True
+        )
 
-            "en": f"""{base_prompt_en}
+        first_chunk = True
+        async for chunk in stream:
+            content = chunk.choices[0].delta.content
+            if content is None:
+                continue
+            # Strip leading whitespace from first chunk only
+            if first_chunk:
+                content = content.lstrip()
+                first_chunk = False
+            if content:
+                yield content
 
-            {style_guide}
+    except Exception as e:
+        yield f"Error processing your question: {str(e)}"
 
-            AVAILABLE CONTEXT:
-            {context}
 
-            USER QUESTION: {question}
+async def ask_question_stream_gemini_async(question, language="fr", timezone="UTC", locale="fr-FR", top_k=5, model_name="gemini-2.5-flash"):
+    """Async version of ask_question_stream_gemini"""
+    refusal_result = validate_user_query(question, llm_call_fn=None, language=language)
+    if refusal_result and refusal_result.get("decision") == "refuse":
+        yield "__REFUSAL__"
+        yield refusal_result["answer"]
+        return
 
-            SPECIAL INSTRUCTIONS:
-            - If information is not available in the context, respond: "{not_found_msg}"
-            - Strictly apply your narrative structure and characteristic expressions
-            - Stay in your role as Ben with your unique and recognizable style"""
-        }
+    if is_trivial_greeting(question):
+        yield get_greeting_message(language, question)
+        return
+
+    col = await aget_collection()
+    if col is None:
+        yield "Error: ChromaDB collection is not available. Please run 'python index_chromadb.py' first to index your documents."
+        return
 
-        prompt = prompts.get(language, prompts["fr"]) if language in ["fr", "en"] else prompts["fr"]
+    try:
+        query_emb = await aembed_query(question)
+
+        results = await asyncio.to_thread(
+            col.query,
+            query_embeddings=[query_emb],
+            n_results=top_k
+        )
+
+        if not results['documents'] or not results['documents'][0]:
+            yield "No relevant information found. Please make sure you have indexed some transcripts."
+            return
+
+        contexts, _ = select_contexts(results['documents'][0])
+        prompt = build_gemini_prompt(language, "\n\n".join(contexts), question)
 
-        # Configure model (temperature to mirror OpenAI setup)
         model = genai.GenerativeModel(model_name, generation_config={
             "temperature": 0.3
         })
-
-        # Stream tokens
-        response = model.generate_content(prompt, stream=True)
+        response = await model.generate_content_async(prompt, stream=True)
 
         first_chunk = True
-        for chunk in response:
+        async for chunk in response:
             text = getattr(chunk, "text", None)
             if text:
                 if first_chunk:
@@ -455,3 +882,29 @@ def ask_question_stream_gemini(question, language="fr", timezone="UTC", locale="
 
     except Exception as e:
         yield f"Error processing your question (Gemini): {str(e)}"
+
+
+def warm_collection():
+    """
+    Open the collection and run one query so the HNSW index is loaded in
+    memory before the first user question (avoids the cold-start latency cliff).
+    """
+    try:
+        col = get_collection()
+        if col is None:
+            return
+        sample = col.get(limit=1, include=["embeddings"])["embeddings"]
+        if sample is not None and len(sample) and len(sample[0]) != EMBEDDING_DIMENSIONS:
+            print(f"❌ ChromaDB collection holds {len(sample[0])}-dimension embeddings but "
+                  f"EMBEDDING_MODEL={EMBEDDING_MODEL} / EMBEDDING_DIMENSIONS={EMBEDDING_DIMENSIONS}: "
+                  f"every query will fail until the settings match the index or it is re-indexed")
+            return
+        probe = [1.0] + [0.0] * (EMBEDDING_DIMENSIONS - 1)
+        col.query(query_embeddings=[probe], n_results=1, include=[])
+        _load_source_pmid_index()
+    except Exception as e:
+        print(f"ChromaDB warm-up failed: {e}")
+
+
+if os.environ.get("WARM_CHROMA_ON_IMPORT", "1") == "1":
+    warm_collection()
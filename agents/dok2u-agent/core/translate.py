@@ -4,16 +4,18 @@
 # =====================================================
 
 import os
+import asyncio
+import mimetypes
 import json
-import tempfile
+import functools
 from pathlib import Path
-from openai import OpenAI
 from dotenv import load_dotenv
+from core.openai_client import client, aclient
 
 PROJECT_ROOT = Path(__file__).parent.parent
 load_dotenv(dotenv_path=PROJECT_ROOT / '.env')
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+TRANSLATOR_PROMPTS_PATH = PROJECT_ROOT / "knowledge-bases" / "translator" / "prompts.json"
 
 # Supported translation languages
 SUPPORTED_LANGUAGES = {
@@ -47,9 +49,18 @@ SUPPORTED_LANGUAGES = {
 }
 
 
+def _mtime_ns(path):
+    """Modification time of `path` (None if missing), used as cache key."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
 def load_translator_prompts(language: str = "en") -> dict:
     """
-    Load translator prompts from prompts.json file.
+    Load translator prompts from prompts.json file (cached until the file changes).
+    The returned dict is shared between calls and must not be modified.
     
     Args:
         language: Language code ('en' or 'fr')
@@ -57,9 +68,13 @@ def load_translator_prompts(language: str = "en") -> dict:
     Returns:
         dict: Prompts for the specified language
     """
-    prompts_path = PROJECT_ROOT / "knowledge-bases" / "translator" / "prompts.json"
+    return _load_translator_prompts_cached(language, TRANSLATOR_PROMPTS_PATH, _mtime_ns(TRANSLATOR_PROMPTS_PATH))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_translator_prompts_cached(language, path, mtime_ns):
     try:
-        with open(prompts_path, 'r', encoding='utf-8') as f:
+        with open(path, 'r', encoding='utf-8') as f:
             prompts = json.load(f)
         return prompts.get(language, prompts.get("en", {}))
     except FileNotFoundError:
@@ -71,6 +86,11 @@ def load_translator_prompts(language: str = "en") -> dict:
         }
 
 
+# Warm the cache for the two prompt languages
+load_translator_prompts("en")
+load_translator_prompts("fr")
+
+
 def translate_text_stream(text: str, target_language: str, source_language: str = "auto", prompt_language: str = "en"):
     """
     Translate text to target language using GPT-4o-mini with streaming.
@@ -117,6 +137,12 @@ def translate_text_stream(text: str, target_language: str, source_language: str
             yield chunk.choices[0].delta.content
 
 
+def _audio_file(audio_bytes: bytes, filename: str) -> tuple:
+    """(filename, bytes, content type) upload for the Whisper API, which detects the format from the filename."""
+    name = filename if Path(filename).suffix else "audio.webm"
+    return name, audio_bytes, mimetypes.guess_type(name)[0] or "audio/webm"
+
+
 def transcribe_audio_whisper(audio_bytes: bytes, filename: str = "audio.webm", language: str = None) -> str:
     """
     Transcribe audio using OpenAI Whisper API.
@@ -129,28 +155,20 @@ def transcribe_audio_whisper(audio_bytes: bytes, filename: str = "audio.webm", l
     Returns:
         str: Transcribed text
     """
-    suffix = Path(filename).suffix or ".webm"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
-
-    try:
-        with open(tmp_path, "rb") as audio_file:
-            # Build transcription parameters
-            params = {
-                "model": "whisper-1",
-                "file": audio_file,
-                "response_format": "text"
-            }
-            # Add language parameter if specified
-            if language:
-                params["language"] = language
-                print(f"Transcribing with language hint: {SUPPORTED_LANGUAGES.get(language, language)}")
-            
-            transcript = client.audio.transcriptions.create(**params)
-        return transcript.strip()
-    finally:
-        os.unlink(tmp_path)
+    audio_file = _audio_file(audio_bytes, filename)
+    # Build transcription parameters
+    params = {
+        "model": "whisper-1",
+        "file": audio_file,
+        "response_format": "text"
+    }
+    # Add language parameter if specified
+    if language:
+        params["language"] = language
+        print(f"Transcribing with language hint: {SUPPORTED_LANGUAGES.get(language, language)}")
+
+    transcript = client.audio.transcriptions.create(**params)
+    return transcript.strip()
 
 
 def translate_audio_whisper(audio_bytes: bytes, filename: str = "audio.webm") -> str:
@@ -165,21 +183,42 @@ def translate_audio_whisper(audio_bytes: bytes, filename: str = "audio.webm") ->
     Returns:
         str: Translated English text
     """
-    suffix = Path(filename).suffix or ".webm"
-    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
+    translation = client.audio.translations.create(
+        model="whisper-1",
+        file=_audio_file(audio_bytes, filename),
+        response_format="text"
+    )
+    return translation.strip()
 
-    try:
-        with open(tmp_path, "rb") as audio_file:
-            translation = client.audio.translations.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="text"
-            )
-        return translation.strip()
-    finally:
-        os.unlink(tmp_path)
+
+async def translate_audio_whisper_async(audio_bytes: bytes, filename: str = "audio.webm") -> str:
+    """Async version of translate_audio_whisper (does not block the event loop)."""
+    translation = await aclient.audio.translations.create(
+        model="whisper-1",
+        file=_audio_file(audio_bytes, filename),
+        response_format="text"
+    )
+    return translation.strip()
+
+
+async def translate_audio_whisper_batch(items, max_concurrency: int = 5) -> list:
+    """
+    Translate several audios to English concurrently.
+
+    Args:
+        items: List of (audio_bytes, filename) pairs
+        max_concurrency: Maximum number of Whisper requests in flight
+
+    Returns:
+        list: Translated English texts, in the order of items
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _translate_one(audio_bytes, filename):
+        async with semaphore:
+            return await translate_audio_whisper_async(audio_bytes, filename)
+
+    return await asyncio.gather(*(_translate_one(audio_bytes, filename) for audio_bytes, filename in items))
 
 
 def get_supported_languages() -> dict:
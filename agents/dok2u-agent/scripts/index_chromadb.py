@@ -1,10 +1,22 @@
 import os
+import hashlib
+import sqlite3
 import sys
+import queue
+import threading
 from dotenv import load_dotenv
 import chromadb
 from chromadb.config import Settings
+import httpx
+import numpy as np
 from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 
 # Get project root directory
@@ -14,7 +26,51 @@ env_path = PROJECT_ROOT / '.env'
 load_dotenv(dotenv_path=env_path, override=True)
 
 # Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# The SDK retries 429/5xx with exponential backoff, honouring Retry-After; the
+# concurrent embedding batches share one pool of HTTP/2 keep-alive connections
+client = OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=5,
+    http_client=httpx.Client(
+        http2=True,
+        timeout=httpx.Timeout(60.0, connect=10.0),
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+    )
+)
+
+# Embedding model (must match core/query_chromadb.py)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+# Texts sent per embeddings request; chunks of all files are batched together
+EMBEDDING_BATCH_SIZE = 256
+# Embeddings requests in flight at once
+EMBEDDING_CONCURRENCY = int(os.getenv("OPENAI_EMBED_CONCURRENCY", "8"))
+# Local cache of chunk embeddings (content hash -> float32 vector): re-indexing
+# only embeds new or modified chunks
+EMBEDDING_CACHE_PATH = str(PROJECT_ROOT / "embed_cache.db")
+# Keys per SELECT ... IN (...) lookup (SQLite bound-parameter limit)
+EMBEDDING_CACHE_LOOKUP_SIZE = 500
+# HNSW parameters of the transcripts collection (must match core/query_chromadb.py).
+# L2 space like the existing indexes: OpenAI embeddings have unit length, so L2
+# and cosine rank the neighbours identically
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "64"))
+HNSW_METADATA = {
+    "hnsw:space": "l2",
+    "hnsw:M": 24,
+    "hnsw:construction_ef": 128,
+    "hnsw:search_ef": HNSW_SEARCH_EF,
+}
+# Chunks per collection.add() call
+CHROMA_BATCH_SIZE = 200
+
+# Text chunking: by tokens at paragraph/sentence boundaries when tiktoken is
+# available, else by characters
+CHUNK_TOKENS = 300
+CHUNK_OVERLAP_TOKENS = 20
+MIN_CHUNK_TOKENS = 100
+CHUNK_SEPARATORS = ("\n\n", "\n", ". ", " ")
+_token_encoding = None
+_token_encoding_failed = False
 
 
 def get_knowledge_base_path(kb_name="nutria"):
@@ -22,6 +78,35 @@ def get_knowledge_base_path(kb_name="nutria"):
     return PROJECT_ROOT / "knowledge-bases" / kb_name
 
 
+def hnsw_build_params(col):
+    """(space, M, construction_ef) the HNSW index of a collection was built with"""
+    metadata = col.metadata or {}
+    hnsw = (getattr(col, "configuration", None) or {}).get("hnsw") or {}
+    return (
+        hnsw.get("space", metadata.get("hnsw:space", "l2")),
+        hnsw.get("max_neighbors", metadata.get("hnsw:M", 16)),
+        hnsw.get("ef_construction", metadata.get("hnsw:construction_ef", 100)),
+    )
+
+
+def open_collection(chroma_client, name, metadata):
+    """
+    Get or create a collection with HNSW_METADATA. The HNSW build parameters
+    cannot be changed once a collection exists: one built with other values is
+    re-created, and the indexing run adds its chunks back (embeddings come from
+    the local cache).
+    """
+    expected = (HNSW_METADATA["hnsw:space"], HNSW_METADATA["hnsw:M"], HNSW_METADATA["hnsw:construction_ef"])
+    try:
+        existing = chroma_client.get_collection(name=name)
+    except Exception:
+        existing = None
+    if existing is not None and hnsw_build_params(existing) != expected:
+        print(f"Re-creating collection '{name}' with HNSW (space, M, construction_ef) = {expected}")
+        chroma_client.delete_collection(name=name)
+    return chroma_client.get_or_create_collection(name=name, metadata={**metadata, **HNSW_METADATA})
+
+
 def init_chromadb(kb_name="nutria"):
     """Initialize ChromaDB client for a specific knowledge base"""
     kb_path = get_knowledge_base_path(kb_name)
@@ -39,31 +124,151 @@ def init_chromadb(kb_name="nutria"):
     )
     
     collection_name = "transcripts"
-    collection = chroma_client.get_or_create_collection(
-        name=collection_name,
-        metadata={"description": f"Knowledge base: {kb_name}", "kb_name": kb_name}
+    collection = open_collection(
+        chroma_client,
+        collection_name,
+        {"description": f"Knowledge base: {kb_name}", "kb_name": kb_name}
     )
     
     return chroma_client, collection
 
-def get_embeddings(texts):
-    """Get embeddings from OpenAI"""
+def _embed_batch(texts):
+    resp = client.embeddings.create(model=EMBEDDING_MODEL, input=texts, dimensions=EMBEDDING_DIMENSIONS)
+    return np.asarray([e.embedding for e in resp.data], dtype=np.float32)
+
+def open_embedding_cache():
+    """Open (and create if needed) the local SQLite embedding cache"""
+    cache = sqlite3.connect(EMBEDDING_CACHE_PATH)
+    cache.execute("PRAGMA journal_mode=WAL")
+    cache.execute("PRAGMA synchronous=NORMAL")
+    cache.execute("CREATE TABLE IF NOT EXISTS emb(hash BLOB PRIMARY KEY, vec BLOB)")
+    return cache
+
+def embedding_cache_key(text):
+    """Cache key of a chunk: hash of its text and of the embedding model settings"""
+    return hashlib.blake2b(f"{EMBEDDING_MODEL}\0{EMBEDDING_DIMENSIONS}\0{text}".encode("utf-8"), digest_size=16).digest()
+
+def get_embeddings(texts, batch_size=None):
+    """
+    Get embeddings as a float32 matrix, one row per text (input order kept).
+    Texts found in the local cache are not sent again; the others are
+    requested from OpenAI by concurrent batches and added to the cache.
+    """
     if isinstance(texts, str):
         texts = [texts]
-    resp = client.embeddings.create(model="text-embedding-3-large", input=texts)
-    return [e.embedding for e in resp.data]
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
+    keys = [embedding_cache_key(text) for text in texts]
+    embeddings = np.empty((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    with closing(open_embedding_cache()) as cache:
+        cached = {}
+        for start in range(0, len(keys), EMBEDDING_CACHE_LOOKUP_SIZE):
+            lookup = keys[start:start + EMBEDDING_CACHE_LOOKUP_SIZE]
+            placeholders = ",".join("?" * len(lookup))
+            cached.update(cache.execute(f"SELECT hash, vec FROM emb WHERE hash IN ({placeholders})", lookup))
+        missing = []
+        for row, key in enumerate(keys):
+            if key in cached:
+                embeddings[row] = np.frombuffer(cached[key], dtype=np.float32)
+            else:
+                missing.append(row)
+        
+        starts = range(0, len(missing), batch_size)
+        batches = ([texts[row] for row in missing[start:start + batch_size]] for start in starts)
+        with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as pool:
+            for start, batch in zip(starts, pool.map(_embed_batch, batches)):
+                rows = missing[start:start + len(batch)]
+                embeddings[rows] = batch
+                # Saved batch by batch so an interrupted run keeps what it paid for
+                with cache:
+                    cache.executemany("INSERT OR REPLACE INTO emb(hash, vec) VALUES (?, ?)",
+                                      [(keys[row], embeddings[row].tobytes()) for row in rows])
+    return embeddings
 
 def chunk_text(text, chunk_size=500, overlap=50):
     """Split text into overlapping chunks"""
-    chunks = []
+    windows = (text[start:start + chunk_size] for start in range(0, len(text), chunk_size - overlap))
+    return [chunk for chunk in windows if chunk.strip()]
+
+def get_token_encoding():
+    """Tokenizer of the embedding model, loaded on first use (None if tiktoken or its data is unavailable)"""
+    global _token_encoding, _token_encoding_failed
+    if _token_encoding is None and tiktoken is not None and not _token_encoding_failed:
+        try:
+            _token_encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+        except KeyError:
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"⚠️  tiktoken encoding unavailable, using character chunks: {str(e)}")
+            _token_encoding_failed = True
+    return _token_encoding
+
+def _split_on_separators(text, token_encoding, max_tokens, separators):
+    """Cut text at the coarsest separator giving pieces of at most max_tokens: [(piece, n_tokens)]"""
+    tokens = token_encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return [(text, len(tokens))]
+    if not separators:
+        return [(token_encoding.decode(tokens[i:i + max_tokens]), len(tokens[i:i + max_tokens]))
+                for i in range(0, len(tokens), max_tokens)]
+    separator, finer = separators[0], separators[1:]
+    parts = text.split(separator)
+    pieces = []
+    for i, part in enumerate(parts):
+        if i < len(parts) - 1:
+            part += separator
+        if part:
+            pieces.extend(_split_on_separators(part, token_encoding, max_tokens, finer))
+    return pieces
+
+def chunk_text_tokens(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, min_tokens=MIN_CHUNK_TOKENS):
+    """
+    Split text into chunks of at most max_tokens tokens, cutting at paragraph,
+    line, sentence then word boundaries. Consecutive pieces are packed up to
+    max_tokens, each chunk repeats up to overlap_tokens of the previous one,
+    and a last chunk under min_tokens is merged into the previous chunk.
+    """
+    pieces = _split_on_separators(text, get_token_encoding(), max_tokens, CHUNK_SEPARATORS)
+    spans = []  # (first, last + 1) piece indices of each chunk
     start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunk = text[start:end]
-        if chunk.strip():
-            chunks.append(chunk)
-        start = end - overlap
-    return chunks
+    size = 0
+    for end, (_, n_tokens) in enumerate(pieces):
+        if end > start and size + n_tokens > max_tokens:
+            spans.append((start, end))
+            # The next chunk starts with the tail of this one
+            while start < end and (size > overlap_tokens or size + n_tokens > max_tokens):
+                size -= pieces[start][1]
+                start += 1
+        size += n_tokens
+    if pieces:
+        spans.append((start, len(pieces)))
+    if len(spans) > 1 and sum(n for _, n in pieces[spans[-1][0]:]) < min_tokens:
+        _, last_end = spans.pop()
+        spans[-1] = (spans[-1][0], last_end)
+    chunks = ("".join(piece for piece, _ in pieces[first:last]) for first, last in spans)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def load_chunks(file_path):
+    """Read a text file and split it into chunks: (text, chunks)"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if get_token_encoding() is not None:
+        return text, chunk_text_tokens(text)
+    return text, chunk_text(text, chunk_size=500, overlap=50)
+
+def _add_batches(collection, pending, progress):
+    """Writer thread: add the queued (ids, embeddings, documents, metadatas) batches to ChromaDB"""
+    while True:
+        batch = pending.get()
+        if batch is None:
+            return
+        if progress["error"] is not None:
+            continue  # keep draining so the producer never blocks
+        ids, embeddings, documents, metadatas = batch
+        try:
+            collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+            progress["indexed"] += len(ids)
+        except Exception as e:
+            progress["error"] = e
 
 def index_text_files(kb_name="nutria", folder_type="extracted_texts"):
     """
@@ -93,18 +298,18 @@ def index_text_files(kb_name="nutria", folder_type="extracted_texts"):
     print(f"Found {len(txt_files)} documents to index\n")
     
     all_ids = []
-    all_embeddings = []
     all_documents = []
     all_metadatas = []
     
-    for filename in txt_files:
-        file_path = os.path.join(folder_path, filename)
+    # Read and chunk the files in parallel, then handle them in listing order
+    with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, 16)) as pool:
+        loaded = [pool.submit(load_chunks, os.path.join(folder_path, f)) for f in txt_files]
+    
+    for filename, future in zip(txt_files, loaded):
         print(f"Processing: {filename}")
         
         try:
-            # Read text file
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
+            text, chunks = future.result()
             
             if not text.strip():
                 print(f"  ⚠️ No text found in {filename}")
@@ -112,18 +317,12 @@ def index_text_files(kb_name="nutria", folder_type="extracted_texts"):
             
             print(f"  Extracted {len(text)} characters")
             
-            # Split into chunks
-            chunks = chunk_text(text, chunk_size=500, overlap=50)
             print(f"  Created {len(chunks)} chunks")
             
-            # Get embeddings for chunks
-            embeddings = get_embeddings(chunks)
-            
-            # Prepare data for ChromaDB
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            # Prepare data for ChromaDB (embedded below, together with the other files)
+            for i, chunk in enumerate(chunks):
                 doc_id = f"{filename}_chunk{i}"
                 all_ids.append(doc_id)
-                all_embeddings.append(embedding)
                 all_documents.append(chunk)
                 all_metadatas.append({
                     "source": filename,
@@ -135,15 +334,36 @@ def index_text_files(kb_name="nutria", folder_type="extracted_texts"):
         except Exception as e:
             print(f"  ❌ Error processing {filename}: {str(e)}")
     
-    # Add all documents to ChromaDB in one batch
+    # Embed the chunks window by window while a background thread adds the
+    # previous embeddings to ChromaDB in batches of CHROMA_BATCH_SIZE
     if all_ids:
-        print(f"\nIndexing {len(all_ids)} chunks into ChromaDB...")
-        collection.add(
-            ids=all_ids,
-            embeddings=all_embeddings,
-            documents=all_documents,
-            metadatas=all_metadatas
-        )
+        print(f"\nEmbedding and indexing {len(all_ids)} chunks into ChromaDB...")
+        pending = queue.Queue(maxsize=2)
+        progress = {"indexed": 0, "error": None}
+        writer = threading.Thread(target=_add_batches, args=(collection, pending, progress), daemon=True)
+        writer.start()
+        window = EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY
+        try:
+            for start in range(0, len(all_ids), window):
+                if progress["error"] is not None:
+                    break
+                embeddings = get_embeddings(all_documents[start:start + window])
+                stop = start + len(embeddings)
+                for first in range(start, stop, CHROMA_BATCH_SIZE):
+                    last = min(first + CHROMA_BATCH_SIZE, stop)
+                    pending.put((all_ids[first:last], embeddings[first - start:last - start],
+                                 all_documents[first:last], all_metadatas[first:last]))
+        except Exception as e:
+            print(f"❌ Error getting embeddings: {str(e)}")
+        finally:
+            pending.put(None)
+            writer.join()
+        
+        if progress["error"] is not None:
+            print(f"❌ Error adding chunks to ChromaDB: {str(progress['error'])}")
+        if progress["indexed"] < len(all_ids):
+            print(f"⚠️ Only {progress['indexed']}/{len(all_ids)} chunks were indexed")
+            return
         print(f"✅ Successfully indexed {len(all_ids)} chunks from {len(txt_files)} documents!")
     else:
         print("❌ No data to index")